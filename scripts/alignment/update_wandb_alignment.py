@@ -4,17 +4,18 @@ from argparse import ArgumentParser
 from .wandb_alignment_utils import upload_multi_model_results, create_model_evaluation_from_results
 
 
-def main(entity: str, project: str, name: str, main_metrics: list, logs_root: Path):
+def main(entity: str, project: str, name: str, main_metrics: list, logs_root: Path, sink: str = "wandb",
+         max_samples: int = 10, seed: int = 0):
     print(f"Uploading {name}, iteration: {logs_root.name}")
     
     # Create ModelEvaluation directly from results and samples
-    model_eval = create_model_evaluation_from_results(name, logs_root, max_samples=10)
+    model_eval = create_model_evaluation_from_results(name, logs_root, max_samples=max_samples, seed=seed)
     print(f"Created evaluation with {model_eval.total_metrics_count} metrics and {model_eval.total_samples_count} samples")
     for task in model_eval.tasks:
         print(",".join([f"{task.task_name}/{metric.name}" for metric in task.metrics]))
     
     # Upload using the new structured approach
-    upload_multi_model_results(entity, project, [model_eval], main_metrics)
+    upload_multi_model_results(entity, project, [model_eval], main_metrics, sink)
 
 if __name__ == "__main__":
     parser = ArgumentParser()
@@ -23,6 +24,10 @@ if __name__ == "__main__":
     parser.add_argument("--name", type=str, required=True, help="Name of the model")
     parser.add_argument("--main_metrics", nargs='+', type=str, required=True, help="List of metrics for main table")
     parser.add_argument("--logs_root", type=Path, required=True, help="Root directory containing evaluation logs")
+    parser.add_argument("--sink", type=str, default="wandb", help="Where to upload: `wandb` or `local:<dir>` (see `evals.sinks`)")
+    parser.add_argument("--max_samples", type=int, default=10, help="Samples of every task to upload, chosen at random")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the choice of samples")
     args = parser.parse_args()
 
-    main(entity=args.entity, project=args.project, name=args.name, main_metrics=args.main_metrics, logs_root=args.logs_root)
+    main(entity=args.entity, project=args.project, name=args.name, main_metrics=args.main_metrics, logs_root=args.logs_root,
+         sink=args.sink, max_samples=args.max_samples, seed=args.seed)
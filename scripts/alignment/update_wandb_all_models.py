@@ -22,8 +22,8 @@ def load_main_metrics() -> List[str]:
         return [line.strip() for line in f if line.strip()]
 
 
-def scan_all_models(logs_root: Path) -> List[ModelEvaluation]:
-    """Scan all models and create ModelEvaluation objects."""
+def scan_all_models(logs_root: Path, max_samples: int = 5, seed: int = 0) -> List[ModelEvaluation]:
+    """Scan all models and create ModelEvaluation objects, with a random subset of `max_samples` samples per task."""
     model_evaluations = []
     print(f"Scanning logs in: {logs_root}")
 
@@ -45,29 +45,24 @@ def scan_all_models(logs_root: Path) -> List[ModelEvaluation]:
             print(f"    + Processing {eval_dir.name}")
             
             # Create evaluation for this directory
-            temp_eval = create_model_evaluation_from_results(model_name, eval_dir, max_samples=5)
+            temp_eval = create_model_evaluation_from_results(model_name, eval_dir, max_samples=max_samples, seed=seed)
             
             # Merge tasks into combined dictionary
             for task in temp_eval.tasks:
                 if task.task_name not in all_tasks_dict:
-                    all_tasks_dict[task.task_name] = {"metrics": [], "samples": []}
+                    all_tasks_dict[task.task_name] = {"metrics": {}, "samples": []}
                 
-                # Add metrics (newer ones will be added last, effectively overwriting in final task)
-                all_tasks_dict[task.task_name]["metrics"].extend(task.metrics)
+                # Keep only the latest metric of every name (newer directories are processed last)
+                all_tasks_dict[task.task_name]["metrics"].update({metric.name: metric for metric in task.metrics})
                 # Add samples
                 all_tasks_dict[task.task_name]["samples"].extend(task.samples)
         
-        # Create final merged tasks (remove duplicate metrics, keep latest)
+        # Create final merged tasks
         merged_tasks = []
         for task_name, data in all_tasks_dict.items():
-            # Remove duplicate metrics (keep latest by name)
-            unique_metrics = {}
-            for metric in data["metrics"]:
-                unique_metrics[metric.name] = metric  # Later metrics overwrite earlier ones
-            
             merged_tasks.append(Task(
                 task_name=task_name,
-                metrics=list(unique_metrics.values()),
+                metrics=list(data["metrics"].values()),
                 samples=data["samples"]  # Keep all samples
             ))
         
@@ -92,6 +87,10 @@ def main():
     parser.add_argument("--main_metrics", nargs='+', type=str, default=None,
                        help="List of main metrics for the summary table (defaults to config file)")
     parser.add_argument("--dry_run", action="store_true", help="Just scan and print results without uploading to W&B")
+    parser.add_argument("--sink", type=str, default="wandb", help="Where to upload: `wandb` or `local:<dir>` (see `evals.sinks`)")
+    parser.add_argument("--workers", type=int, default=4, help="Models uploaded at the same time")
+    parser.add_argument("--max_samples", type=int, default=5, help="Samples of every task (and evaluation directory) to upload, chosen at random")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the choice of samples")
     
     args = parser.parse_args()
     
@@ -100,7 +99,7 @@ def main():
         args.main_metrics = load_main_metrics()
     
     # Scan all models
-    model_evaluations = scan_all_models(args.logs_root)
+    model_evaluations = scan_all_models(args.logs_root, args.max_samples, args.seed)
     
     # Print summary
     print("\n=== SUMMARY ===")
@@ -114,7 +113,7 @@ def main():
         return
     
     # Upload to W&B using structured approach
-    upload_multi_model_results(args.entity, args.project, model_evaluations, args.main_metrics)
+    upload_multi_model_results(args.entity, args.project, model_evaluations, args.main_metrics, args.sink, args.workers)
 
 
 if __name__ == "__main__":
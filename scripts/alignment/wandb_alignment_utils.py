@@ -4,20 +4,72 @@ Contains common functions for collecting, processing, and uploading evaluation r
 """
 
 import json
-import wandb
+import random
 from pathlib import Path
-from typing import List
+from typing import Dict, List
+
+from evals import samples, sinks
+from evals.sinks import Table
 
 from .data_structures import Sample, Metric, Task, ModelEvaluation
 
 
-def create_model_evaluation_from_results(model_name: str, eval_dir: Path, max_samples: int = 10) -> ModelEvaluation:
+def index_eval_dir(eval_dir: Path) -> Dict[str, Path]:
+    """Map every results and samples file of an evaluation directory by its path relative to it, in a single walk."""
+    index = {}
+    for path in eval_dir.glob("**/*.json*"):
+        if path.name.startswith(("results_", "samples_")):
+            index[path.relative_to(eval_dir).as_posix()] = path
+    return index
+
+
+def get_sample_files(index: Dict[str, Path], timestamp: str) -> Dict[str, List[Path]]:
+    """Map task name -> samples files of the run with the given timestamp (aggregation tasks have none)."""
+    sample_files = {}
+    # Compacted files (see `evals.samples`) sort right after the plain ones, so they win if both exist
+    for _, path in sorted(index.items()):
+        task_name = samples.get_task(path.name, timestamp)
+        if task_name is not None:
+            sample_files.setdefault(task_name, {})[path.parent] = path
+    return {task_name: list(paths.values()) for task_name, paths in sample_files.items()}
+
+
+def reservoir_sample(sample_files: List[Path], max_samples: int, seed: int = 0) -> List[Sample]:
+    """A uniform random subset of `max_samples` samples of the files of a task, read in one pass keeping only those in memory.
+
+    The lines are drawn the same way from plain and compacted files (whose lines are counted from their index,
+    only the frames of the lines drawn are read), so the same seed gives the same samples before and after compaction.
+    """
+    rng = random.Random(f"{seed}:{sample_files[0].name.removesuffix('.zst')}")
+    reservoir = []  # (line number, line or (compacted file, its line)), only the kept lines are parsed.
+    for i, line in enumerate(_iter_lines(sample_files)):
+        if len(reservoir) < max_samples:
+            reservoir.append((i, line))
+        else:
+            j = rng.randrange(i + 1)
+            if j < max_samples:
+                reservoir[j] = (i, line)
+    return [Sample(sample_data=json.loads(line) if isinstance(line, str) else line[0].line(line[1]))
+            for _, line in sorted(reservoir, key=lambda item: item[0])]
+
+
+def _iter_lines(sample_files: List[Path]):
+    for sample_file in sample_files:
+        if sample_file.name.endswith(samples.COMPACT_SUFFIX):
+            log = samples.SampleLog(sample_file)
+            yield from ((log, i) for i in range(len(log)))
+        else:
+            yield from samples.iter_lines(sample_file)
+
+
+def create_model_evaluation_from_results(model_name: str, eval_dir: Path, max_samples: int = 10, seed: int = 0) -> ModelEvaluation:
     """Create a ModelEvaluation directly from evaluation directory."""
     
     tasks = []
     
-    # Process metrics from results and create tasks immediately
-    result_files = list(eval_dir.glob("**/results_*.json"))
+    # Index the directory once, instead of walking it again for every task
+    index = index_eval_dir(eval_dir)
+    result_files = [path for path in index.values() if path.name.startswith("results_") and path.name.endswith(".json")]
     
     assert len(result_files) == 1, f"Expected exactly one results file, found {len(result_files)} in {eval_dir}"
     
@@ -27,6 +79,7 @@ def create_model_evaluation_from_results(model_name: str, eval_dir: Path, max_sa
     
     # Extract timestamp from results filename: results_2025-07-26T00-35-42.178646.json
     timestamp = result_file.stem.replace("results_", "")
+    sample_files = get_sample_files(index, timestamp)
 
     for task_name, metrics in res["results"].items():
         # Create Metric objects for this task
@@ -38,16 +91,10 @@ def create_model_evaluation_from_results(model_name: str, eval_dir: Path, max_sa
             metric = metric_name.split(",")[0]  # Clean metric name
             task_metrics.append(Metric(name=metric, score=float(value)))
         
-        # Load corresponding samples for this task using exact filename
+        # Load a random subset of the samples of this task (aggregation tasks have no samples file)
         task_samples = []
-        # There should be only one sample file per task but for aggregation tasks there will zero
-        for sample_file in eval_dir.glob(f"**/samples_{task_name}_{timestamp}.jsonl"):
-            with open(sample_file, 'r') as f:
-                for i, line in enumerate(f):
-                    if i >= max_samples:
-                        break
-                    sample_data = json.loads(line.strip())
-                    task_samples.append(Sample(sample_data=sample_data))
+        if task_name in sample_files:
+            task_samples = reservoir_sample(sample_files[task_name], max_samples, seed)
         
         # Create Task object immediately
         tasks.append(Task(
@@ -59,11 +106,11 @@ def create_model_evaluation_from_results(model_name: str, eval_dir: Path, max_sa
     return ModelEvaluation(model_name=model_name, tasks=tasks)
 
 
-def create_wandb_table(run_id: str, main_log_data: dict) -> wandb.Table:
-    """Create a W&B table for a single model run."""
+def create_wandb_table(run_id: str, main_log_data: dict) -> Table:
+    """Create the main results table for a single model run."""
     columns = ["model"] + list(main_log_data.keys())
     table_data = [[run_id] + list(main_log_data.values())]
-    return wandb.Table(data=table_data, columns=columns)
+    return Table(columns=columns, rows=table_data)
 
 
 def find_all_eval_dirs(logs_root: Path, model_name: str) -> List[Path]:
@@ -73,68 +120,62 @@ def find_all_eval_dirs(logs_root: Path, model_name: str) -> List[Path]:
     return sorted(harness_dirs, key=lambda x: x.name)
 
 
-def upload_multi_model_results(entity: str, project: str, model_evaluations: List[ModelEvaluation], main_metrics: List[str]):
-    """Upload results from ModelEvaluation data structures to W&B, each as a separate run."""
+def upload_multi_model_results(entity: str, project: str, model_evaluations: List[ModelEvaluation], main_metrics: List[str],
+                               sink: str = "wandb", workers: int = 4):
+    """Upload results from ModelEvaluation data structures to W&B (or another sink), each as a separate run.
+
+    Every run (metrics, main table and sample tables) is pushed in a single session, `workers` runs at a time.
+    """
     model_count = len(model_evaluations)
-    print(f"Uploading {model_count} model(s) to W&B")
-    
+    print(f"Uploading {model_count} model(s) to {sink}")
+
+    uploads = []
     for model_eval in model_evaluations:
-        print(f"\nUploading {model_eval.model_name}...")
+        print(f"\nPreparing {model_eval.model_name}...")
         print(f"  - {model_eval.total_metrics_count} metrics across {len(model_eval.tasks)} tasks")
         print(f"  - {model_eval.total_samples_count} samples")
-        
-        # Upload to W&B with structured samples
-        _upload_to_wandb_with_model_eval(entity, project, model_eval, main_metrics)
-    
-    print(f"\nSuccessfully uploaded {model_count} model(s) to W&B project {project}")
+        uploads.append(_get_upload(model_eval, main_metrics))
 
+    errors = sinks.upload(sinks.get_sink(sink, entity, project), uploads, workers)
+    failed = {run_id: error for run_id, error in errors.items() if error is not None}
+    for run_id, error in failed.items():
+        print(f"Failed to upload {run_id}: {error}")
 
-def _upload_to_wandb_with_model_eval(entity: str, project: str, model_eval: ModelEvaluation, main_metrics: List[str]):
-    """Upload ModelEvaluation data to W&B with structured samples."""
-    wandb.login()
-    
+    print(f"\nSuccessfully uploaded {model_count - len(failed)} model(s) to {sink} project {project}")
+
+
+def _get_upload(model_eval: ModelEvaluation, main_metrics: List[str]) -> sinks.Upload:
+    """Everything to push for a ModelEvaluation: metrics, main table and structured samples."""
     # Get flattened metrics for W&B logging
     log_data = model_eval.get_flattened_metrics()
-    
+
     # Main log_data to only include keys that start with eval names from the file
     main_log_data = {}
     for eval_metric in main_metrics:
         if eval_metric in log_data:
             main_log_data[eval_metric] = log_data[eval_metric]
-    
+
     run_id_suffix = "-001"
-    
-    with wandb.init(
-        id=model_eval.model_name + run_id_suffix,
-        resume="allow",
-        entity=entity,
-        project=project,
-        name=model_eval.model_name,
-    ) as run:
-        run.log({"main_results": create_wandb_table(model_eval.model_name, main_log_data)})
-        run.log(log_data)
-        
-        # Upload samples as a table directly from the structured data
-        for task in model_eval.tasks:
-            if not task.samples:
-                print(f"  - No samples for task {task.task_name}, skipping")
-                continue
 
-            samples_table = upload_structured_samples_as_table(task)
-            try:
-                run.log({f"samples/{model_eval.model_name}/{task.task_name}": samples_table})
-            except Exception as e:
-                print(f"  - Failed to log samples for task {task.task_name}: {e}")
+    tables = {"main_results": create_wandb_table(model_eval.model_name, main_log_data)}
+    # Upload samples as a table directly from the structured data
+    for task in model_eval.tasks:
+        if not task.samples:
+            print(f"  - No samples for task {task.task_name}, skipping")
+            continue
+        tables[f"samples/{model_eval.model_name}/{task.task_name}"] = upload_structured_samples_as_table(task)
 
-        print(f"Logged to WandB for {model_eval.model_name}: {len(log_data)} entries")
+    print(f"  - {len(log_data)} entries and {len(tables)} tables to log for {model_eval.model_name}")
+    return sinks.Upload(run_id=model_eval.model_name + run_id_suffix, name=model_eval.model_name,
+                        logs=[log_data], tables=tables, resume="allow")
 
 
-def upload_structured_samples_as_table(task: Task):
-    """Create and return a W&B table with samples from a single task."""
+def upload_structured_samples_as_table(task: Task) -> Table:
+    """Create and return a table with samples from a single task."""
     all_rows = [_flatten_dict(sample.sample_data) for sample in task.samples]
     columns = list(all_rows[0].keys())
     table_data = [[row.get(col) for col in columns] for row in all_rows]
-    return wandb.Table(data=table_data, columns=columns)
+    return Table(columns=columns, rows=table_data)
 
 
 def _flatten_dict(d, parent_key='', sep='/'):
@@ -1,275 +1,731 @@
 """Automatic evaluations
 Usage (in a tmux session that never ends):
 ```
-while true; do
-    python scripts/automate.py
-    sleep $(( 60*60 ))
-done
+python scripts/automate.py --daemon --sync --config-path configs/automation.json configs/automation-fp8.json
 ```
+The daemon polls for new checkpoints and finished jobs every `--poll-seconds` and submits the missing evaluations
+right away, while moving/evicting converted checkpoints and syncing wandb on their own cadences.
+Without `--daemon` all stages run once, e.g. from a `while true; do python scripts/automate.py; sleep 3600; done` loop.
+Only one automation process runs at a time per LOGS_ROOT: a second daemon exits, a second one-shot run waits for the
+first at most `--lock-minutes`.
 Make sure to export your WANDB_API_KEY and LOGS_ROOT.
 """
 from __future__ import annotations
 
 import argparse
 import collections
+import dataclasses
+import fcntl
+import math
 import re
 import os
-import math
 import json
 import subprocess
 import shutil
+import threading
+import time
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+from evals import checkpoints, envs, packs, transfer
+from evals.cache import state_dir
+from evals.catalog import TaskCatalog
+from evals.cost import get_backend_key, get_cost_model, get_sizes
+from evals.failures import Attempt, FailureLedger
+from evals.partition import plan_partition
+from evals.scheduler import Scheduler, SlurmScheduler
+from evals.shards import get_default_shards, get_shards_path
+from evals.status import StatusIndex
+from evals.tasks import Task
 
-from evals.tasks import Task, get_all_tasks, get_partition
 
+GPUS_PER_NODE = 4  # As requested by `evaluate.sbatch`.
+NON_OFFICIAL_TASKS = ["blend", "switzerland_qa", "include_base_new_45", "cultural_bench"]
 
-def get_max_samples(size: int) -> int:
-    return max(filter(lambda t: int(t[0]) <= size, CFG["max_samples"].items()), key=lambda t: int(t[0]))[1]
+_ITERATIONS: dict[str, tuple[tuple, list[int]]] = {}  # model_dir -> (mtimes, iterations), shared by all configs.
+_LEDGER_LOCK = threading.Lock()  # Configs with the same `logs_root` share the failure ledger.
 
-def get_running(as_jobname: bool = False) -> dict[str, dict[int, list[str]] | list[str]]:
-    proc = subprocess.run(["squeue", "--me", '--format="%j"', "--noheader"],
-                          capture_output=True, text=True)
-    assert proc.returncode == 0
 
-    jobnames = proc.stdout.strip().split("\n")
-    if jobnames == [""]:
-        return [] if as_jobname else collections.defaultdict(lambda: collections.defaultdict(list))
-    jobnames = [re.match('^"(.*)"$', jobname).group(1) for jobname in jobnames]
+def get_backend(model: dict, extra_env: dict[str, str] = {}) -> str:
+    return extra_env.get("BACKEND", model.get("extra_env", {}).get("BACKEND", "hf"))
 
-    running = [] if as_jobname else collections.defaultdict(lambda: collections.defaultdict(list))
+
+def get_running(jobnames: Iterable[str]) -> dict[str, dict[int, list[str]]]:
+    """Model name -> iteration -> groups (`mixed` or `shard{i}of{n}`) of the evaluation jobs in `jobnames`."""
+    running = collections.defaultdict(lambda: collections.defaultdict(list))
     for jobname in jobnames:
         rmatch = re.match(r"^eval_(.*)_([a-zA-Z0-9]+)_([0-9]+)$", jobname)
         if rmatch is not None:
-            if as_jobname:
-                running.append(jobname)
-            else:
-                name, group, it = rmatch.groups()
-                running[name][int(it)].append(group)
+            name, group, it = rmatch.groups()
+            running[name][int(it)].append(group)
     return running
 
 
-def get_evaluated(model: str) -> dict[int, list[str]]:
-    status = collections.defaultdict(list)
-    for path in Path(CFG["logs_root"]).glob(f"{model}/iter_*/harness/eval_*/*/results*.json"):
-        it = int(re.match("^iter_([0-9]+)$", path.parent.parent.parent.parent.name).group(1))
-        with open(path) as f:
-            info = json.load(f)
-        for taskname in info["results"]:
-            status[it].append(taskname)
-    return status
+def parse_jobname(jobname: str) -> Optional[tuple[str, int]]:
+    """(model name, iteration) of an evaluation (`eval_*`) or materialization (`mat_*`) job, None for other jobs."""
+    rmatch = re.match(r"^mat_(.*)_([0-9]+)$|^eval_(.*)_[a-zA-Z0-9]+_([0-9]+)$", jobname)
+    if rmatch is None:
+        return None
+    name, it = [group for group in rmatch.groups() if group is not None]
+    return name, int(it)
+
+
+def get_headline_tasks(catalog: TaskCatalog, tasks_cfg_path: Path = Path("configs/tasks.json")) -> set[str]:
+    """Names of the tasks shown in the main table (`show_in_table` of the tasks config)."""
+    with open(tasks_cfg_path) as f:
+        shown = {metric.split("/")[0] for metric in json.load(f).get("show_in_table", [])}
+    return {task.name for task in catalog if task.name in shown or not shown.isdisjoint(task.result_names)}
+
+
+def get_iterations(model_dir: Path) -> list[int]:
+    """Complete checkpoints of `model_dir`, only listed again when the directory (or its tracker) changed."""
+    tracker = Path(model_dir)/"latest_checkpointed_iteration.txt"
+    try:
+        mtimes = (os.stat(model_dir).st_mtime_ns, tracker.stat().st_mtime_ns if tracker.exists() else None)
+    except FileNotFoundError:
+        return []
+    if str(model_dir) in _ITERATIONS and _ITERATIONS[str(model_dir)][0] == mtimes:
+        return _ITERATIONS[str(model_dir)][1]
+    with os.scandir(model_dir) as entries:
+        iterations = [int(entry.name[len("iter_"):]) for entry in entries
+                      if re.match("^iter_[0-9]+$", entry.name) is not None and entry.is_dir()]
+    # Megatron only updates the tracker once a checkpoint is completely saved.
+    if tracker.exists():
+        latest = tracker.read_text().strip()
+        if latest.isdigit():
+            iterations = [it for it in iterations if it <= int(latest)]
+    _ITERATIONS[str(model_dir)] = (mtimes, iterations)
+    return iterations
 
 
 def get_available(model_dirs: list[Path]) -> list[int]:
-    available = []
-    for model_dir in model_dirs:
-        for path in filter(lambda path: path.is_dir and "iter_" in path.name, Path(model_dir).iterdir()):
-            available.append(int(re.match("^iter_([0-9]+)$", path.name).group(1)))
-    return available
-
-
-def submit(name: str, model: dict, it: int, tasks: list[Task],
-           model_path: str, extra_env: dict[str, str] = {},
-           use_official_vllm: bool = False):
-
-    # Get partition of tasks.
-    total_size = sum(task.size for task in ALL_TASKS)
-    max_samples = get_max_samples(model.get("size", 1))
-    n_def_shards = math.ceil(total_size/max_samples)
-    default_partition = get_partition(tasks=ALL_TASKS, shards=n_def_shards)
-
-    # Check all parts of the default partition, if any of them is 
-    # completely contained in the tasks requested, launch that shard.
-    shards_to_launch = []
-    for shard_i, part in enumerate(default_partition):
-        if set(part) <= set(tasks):
-            shards_to_launch.append((shard_i, part))
-            tasks = [task for task in tasks if task not in part]
-
-    # For all remaining tasks that don't match perfectly a default part,
-    # create a "mixed" job submission.
-    total_size = sum(task.size for task in tasks)
-    n_shards = math.ceil(total_size/max_samples)
-    partition = get_partition(tasks=tasks, shards=n_shards)
-    for part in partition:
-        shards_to_launch.append(("mixed", part))
-
-    # Schedule all tasks requested.
-    for shard_i_or_mixed, tasks_to_launch in shards_to_launch:
-        if shard_i_or_mixed == "mixed":
-            jobname = "mixed"
-        else:
-            jobname = f"shard{shard_i_or_mixed}of{n_def_shards}"
-        jobname = f"eval_{name}_{jobname}_{it}"
-
-        if use_official_vllm:
-            cmd = ["sbatch", "--environment=./containers/env-official.toml"]
-        else:
-            #cmd = ["sbatch", "--environment=./containers/env.toml"]
-            cmd = ["sbatch", "--environment=/iopsstor/scratch/cscs/ahernnde/ncg_new_v2.toml"]
-
-        cmd += [f"--job-name={jobname}", "scripts/evaluate.sbatch", model_path,
-                str(it), model["tokens_per_iter"], name] 
-
-        env = {**os.environ,
-               "LOGS_ROOT": CFG["logs_root"],
-               "SIZE": str(model.get("size", 1)),
-               "TASKS": ",".join(task.name for task in tasks_to_launch),
-               "BACKEND": "hf"}
-        env.update(extra_env)
-        if use_official_vllm:
-            env.update({
+    return [it for model_dir in model_dirs for it in get_iterations(model_dir)]
+
+
+def get_container(use_official_vllm: bool) -> str:
+    if use_official_vllm:
+        return "./containers/env-official.toml"
+    #return "./containers/env.toml"
+    return "/iopsstor/scratch/cscs/ahernnde/ncg_new_v2.toml"
+
+
+def get_container_args(use_official_vllm: bool) -> list[str]:
+    return [f"--environment={get_container(use_official_vllm)}"]
+
+
+@dataclasses.dataclass
+class Submission:
+    """Missing tasks of an iteration, waiting to be submitted."""
+    name: str
+    model: dict
+    it: int
+    tasks: list[Task]
+    extra_env: dict[str, str]
+    pinned: bool  # In `force_iters`.
+    headline: bool  # Misses tasks shown in the main table.
+    rank: int  # Position of the iteration among the ones of its model to evaluate, newest first.
+
+
+class Automation:
+    """Evaluations of all the models of one automation config."""
+
+    def __init__(self, config_path: Path, use_official_vllm: bool = False, scheduler: Optional[Scheduler] = None):
+        self.config_path = Path(config_path)
+        self.force_official_vllm = use_official_vllm
+        self.scheduler = SlurmScheduler() if scheduler is None else scheduler
+        self.lock = threading.Lock()  # Submissions and checkpoint moves must not interleave.
+        self.transfers: dict[str, Future] = {}  # Checkpoints being copied to `hf_storage_dir`, by name.
+        self.transfer_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="transfer")
+        self.load()
+
+    def load(self):
+        """(Re)loads the config, the task catalog and the cost model, cheap when none of them changed."""
+        with open(self.config_path) as f:
+            self.cfg = json.load(f)
+        self.use_official_vllm = self.force_official_vllm or self.cfg.get("use_official_vllm", False)
+        self.catalog = TaskCatalog.load()
+        self.all_tasks = list(self.catalog)
+        # Remove non-official tasks when official vllm container was requested.
+        if self.use_official_vllm:
+            self.all_tasks = list(filter(lambda task: all(no not in task.name for no in NON_OFFICIAL_TASKS),
+                                         self.all_tasks))
+        self.headline = get_headline_tasks(self.catalog)
+        self.cost_model = get_cost_model(Path(self.cfg["logs_root"]), get_sizes(self.cfg), self.catalog,
+                                         max_age=self.cfg["cost_model_max_age_hours"]*60*60)
+
+    def get_gpus(self, model: dict) -> int:
+        """GPUs of the evaluations of `model`: 1 if its `size` is set and at most `single_gpu_max_size`, a node otherwise.
+
+        Single GPU evaluations are packed side by side in the same node, see `evals.packs`.
+        """
+        max_size = self.cfg.get("single_gpu_max_size")
+        return 1 if max_size is not None and "size" in model and model["size"] <= max_size else GPUS_PER_NODE
+
+    def get_task_cost(self, model: dict, backend: str) -> Callable[[Task], float]:
+        size = model.get("size", 1)
+        backend = get_backend_key(backend, self.get_gpus(model))
+        return lambda task: self.cost_model.predict(task, size, backend)
+
+    def get_overhead(self, model: dict) -> float:
+        return model.get("job_overhead_minutes", self.cfg["job_overhead_minutes"])*60
+
+    def get_shards(self, tasks: list[Task], model: dict, backend: str) -> tuple[list[Task], ...]:
+        """Cheapest split of `tasks` into jobs that all finish within the walltime (see `evals.partition`)."""
+        return plan_partition(tasks, self.get_task_cost(model, backend), walltime=self.cfg["walltime_hours"]*60*60,
+                              overhead=self.get_overhead(model), margin=self.cfg["walltime_margin"],
+                              gpus=self.get_gpus(model), makespan_weight=self.cfg["makespan_weight"],
+                              key=lambda task: task.name)
+
+    def get_default_partition(self, model: dict, backend: str) -> tuple[list[Task], ...]:
+        """Stable shards of all tasks (see `evals.shards`), some of them might be empty."""
+        capacity = self.cfg["walltime_hours"]*60*60*(1 - self.cfg["walltime_margin"]) - self.get_overhead(model)
+        key = f"{model.get('size', 1)}:{get_backend_key(backend, self.get_gpus(model))}"
+        return get_default_shards(get_shards_path(Path(self.cfg["logs_root"])), key,
+                                  self.all_tasks, self.get_task_cost(model, backend), capacity,
+                                  lambda tasks: self.get_shards(tasks, model, backend))
+
+    def get_available(self, name: str, model: dict) -> list[int]:
+        return get_available(model["model_dirs"])
+
+    def get_model_dir(self, name: str, model: dict, it: int) -> str:
+        """The one directory of `model_dirs` with iteration `it`."""
+        paths = [model_dir for model_dir in model["model_dirs"] if Path(f"{model_dir}/iter_{it:07d}").exists()]
+        if len(paths) != 1:
+            raise ValueError(f"Model {name} has {len(paths)} paths for iter {it} (should be =1): {paths}")
+        return str(paths[0])
+
+    def get_jobs(self, pending_only: bool = False) -> list[tuple[str, str]]:
+        """Like `Scheduler.jobs`, with the evaluations of every queued pack listed under their own names."""
+        jobs = []
+        for job_id, jobname in self.scheduler.jobs(pending_only):
+            if packs.is_pack(jobname):
+                slots = packs.read_pack(packs.get_packs_dir(Path(self.cfg["logs_root"])), jobname) or []
+                jobs += [(job_id, slot.jobname) for slot in slots]
+            else:
+                jobs.append((job_id, jobname))
+        return jobs
+
+    def get_evaluated(self, model: str) -> dict[int, set[str]]:
+        """Iteration -> tasks with results, only the results files that changed since the last call are read."""
+        index = StatusIndex.open(Path(self.cfg["logs_root"]))
+        index.refresh(self.cfg["logs_root"], model)
+        return index.evaluated(model)
+
+    def materialize(self, name: str, it: int, model_path: str,
+                    env: dict[str, str]) -> tuple[dict[str, str], Optional[str]]:
+        """Makes sure the checkpoint is converted (or downloaded) once for all the shards of an iteration.
+
+        Returns the extra environment the evaluation jobs need to use it and the id of the
+        `scripts/materialize.sbatch` job they have to wait for (None if it is already available).
+        """
+        jobname = f"mat_{name}_{it}"
+        args = [model_path]
+        if Path(model_path, "latest_checkpointed_iteration.txt").exists():  # Megatron, converted into the cache.
+            key = checkpoints.get_key(Path(model_path)/f"iter_{it:07d}", env["TOKENIZER"])
+            entry_name = checkpoints.get_entry_name(name, it, key)
+            path = checkpoints.lookup([self.cfg["hf_storage_dir"], self.cfg["hf_temp_dir"]], entry_name)
+            if path is not None:
+                checkpoints.touch(path)
+                return {"HF_CHECKPOINT": str(path)}, None
+            output = Path(self.cfg["hf_temp_dir"])/entry_name
+            args += [str(it), str(output)]
+            extra_env = {"HF_CHECKPOINT": str(output)}
+        else:  # Huggingface, downloaded to the HF_HOME.
+            extra_env = {"SKIP_DOWNLOAD": "true"}
+
+        job_ids = {other: job_id for job_id, other in self.scheduler.jobs()}
+        if jobname not in job_ids:
+            print("Launching", jobname)
+            job_ids[jobname] = self.scheduler.submit("scripts/materialize.sbatch", args, jobname, env,
+                                                     get_container_args(self.use_official_vllm))
+        return extra_env, job_ids[jobname]
+
+    def submit(self, name: str, model: dict, it: int, tasks: list[Task],
+               model_path: str, extra_env: dict[str, str] = {}, max_jobs: Optional[int] = None) -> int:
+        """Submits the shards needed to evaluate `tasks` (headline shards first, at most `max_jobs`), returns how many."""
+
+        # Get partition of tasks, based on their predicted runtime.
+        backend = get_backend(model, extra_env)
+        default_partition = self.get_default_partition(model, backend)
+        n_def_shards = len(default_partition)
+
+        # Check all parts of the default partition, if any of them is
+        # completely contained in the tasks requested, launch that shard.
+        shards_to_launch = []
+        for shard_i, part in enumerate(default_partition):
+            if len(part) > 0 and set(part) <= set(tasks):
+                shards_to_launch.append((shard_i, part))
+                tasks = [task for task in tasks if task not in part]
+
+        # For all remaining tasks that don't match perfectly a default part,
+        # create a "mixed" job submission.
+        for part in self.get_shards(tasks, model, backend):
+            shards_to_launch.append(("mixed", part))
+
+        # Shards with the tasks shown in the main table go first, the rest waits if we are over the limit.
+        shards_to_launch.sort(key=lambda shard: not any(task.name in self.headline for task in shard[1]))
+        shards_to_launch = shards_to_launch[:max_jobs]
+        if len(shards_to_launch) == 0:
+            return 0
+
+        # Convert or download the checkpoint once, all shards use it.
+        base_env = {**os.environ,
+                    "LOGS_ROOT": self.cfg["logs_root"],
+                    "SIZE": str(model.get("size", 1)),
+                    "BACKEND": "hf"}
+        base_env.update(extra_env)
+        if self.use_official_vllm:
+            base_env.update({
                 "HARNESS_FORK": "https://github.com/EleutherAI/lm-evaluation-harness.git",
                 "HARNESS_BRANCH": "main"
             })
-
-        maybe_show = [task.name for task in tasks_to_launch]
-        if len(maybe_show) > 32 or "mixed" not in jobname:
-            maybe_show = ""
-        print("Launching", jobname, maybe_show)
-        subprocess.run(cmd, env=env, stdout=subprocess.PIPE)
-
-
-def submit_needed(force_tasks: list[str], use_official_vllm: bool):
-    def get_missing(it: int) -> list[Task]:
-        handled = status.get(it, [])
-        missing = []
-        for task in ALL_TASKS:
-            if len(task.alias) > 0 and any(actual_name not in handled for actual_name in task.alias):
-                missing.append(task)
-            elif len(task.alias) == 0 and task.name not in handled:
-                missing.append(task)
-            elif task.name in force_tasks:
-                missing.append(task)
-        return missing
-
-    running = get_running()
-    for name, model in CFG["models"].items():
-        total_size = sum(task.size for task in ALL_TASKS)
-        max_samples = get_max_samples(model.get("size", 1))
-        n_shards = math.ceil(total_size/max_samples)
+        if self.cfg.get("envs_dir") is not None:  # Activate a prebuilt environment instead of installing, see `evals.envs`.
+            base_env.update({"ENVS_DIR": self.cfg["envs_dir"], "CONTAINER": get_container(self.use_official_vllm)})
+        materialized_env, dependency = self.materialize(name, it, model_path, base_env)
+
+        # Schedule all tasks requested.
+        for shard_i_or_mixed, tasks_to_launch in shards_to_launch:
+            if shard_i_or_mixed == "mixed":
+                jobname = "mixed"
+            else:
+                jobname = f"shard{shard_i_or_mixed}of{n_def_shards}"
+            jobname = f"eval_{name}_{jobname}_{it}"
+
+            env = {**base_env, **materialized_env,
+                   "TASKS": ",".join(task.name for task in tasks_to_launch),
+                   "TASKS_PER_RUN": str(self.cfg["tasks_per_run"])}
+
+            maybe_show = [task.name for task in tasks_to_launch]
+            if len(maybe_show) > 32 or "mixed" not in jobname:
+                maybe_show = ""
+            print("Launching", jobname, maybe_show)
+            args = [model_path, str(it), model["tokens_per_iter"], name]
+            attempt = Attempt(name, it, [task.name for task in tasks_to_launch], jobname, "", dependency)
+            if self.get_gpus(model) == 1 or self.get_max_batch_size() > 1:
+                # Packed or batched with other evaluations once all submissions are known.
+                seconds = sum(map(self.get_task_cost(model, backend), tasks_to_launch))
+                self.slots.append((packs.Slot(jobname, args, env), attempt, seconds))
+            else:
+                self.launch(jobname, args, env, attempt)
+        return len(shards_to_launch)
+
+    def get_max_batch_size(self) -> int:
+        return self.cfg.get("max_batch_size") or 1
+
+    def launch(self, jobname: str, args: list[str], env: dict[str, str], attempt: Attempt):
+        job_id = self.scheduler.submit("scripts/evaluate.sbatch", args, jobname, env,
+                                       get_container_args(self.use_official_vllm), attempt.dependency)
+        attempt.log = f"logs/{jobname}_{job_id}.err"
+        self.ledger.track(job_id, attempt)
+
+    def launch_pack(self, kind: str, pack: list[tuple[packs.Slot, Attempt, float]]):
+        """Submits the evaluations of `pack` as a single `scripts/evaluate_{kind}.sbatch` job (see `evals.packs`)."""
+        if len(pack) == 1:  # Nothing to share the node with, use all of it.
+            slot, attempt, _ = pack[0]
+            self.launch(slot.jobname, slot.args, slot.env, attempt)
+            return
+        dependencies = sorted({dependency for _, attempt, _ in pack if attempt.dependency is not None
+                               for dependency in attempt.dependency.split(":")})
+        dependency = ":".join(dependencies) if len(dependencies) > 0 else None
+        slots = [packs.Slot(slot.jobname, slot.args, {key: value for key, value in slot.env.items()
+                                                      if os.environ.get(key) != value})
+                 for slot, _, _ in pack]
+        path = packs.write_pack(packs.get_packs_dir(Path(self.cfg["logs_root"])), slots, kind)
+        print("Submitting", [slot.jobname for slot in slots], "as", path.name)
+        job_id = self.scheduler.submit(f"scripts/evaluate_{kind}.sbatch", [str(path)], path.name, dict(os.environ),
+                                       get_container_args(self.use_official_vllm), dependency)
+        for slot, attempt, _ in pack:
+            attempt.log = f"logs/{path.name}_{job_id}_{slot.jobname}.err"
+            self.ledger.track(job_id, attempt)
+
+    def launch_slots(self):
+        """Submits the evaluations held back by `submit`.
+
+        Single GPU evaluations are packed side by side, up to `GPUS_PER_NODE` of similar length per node.
+        The rest are batched per model, up to `max_batch_size` checkpoints (oldest first) that run one after
+        another within the walltime, each one paying `batch_item_overhead_minutes` instead of a job overhead.
+        """
+        if len(self.slots) > 0:
+            packs.prune(packs.get_packs_dir(Path(self.cfg["logs_root"])), {jobname for _, jobname in self.scheduler.jobs()})
+        single = sorted((slot for slot in self.slots if self.get_gpus(self.cfg["models"][slot[1].name]) == 1),
+                        key=lambda slot: -slot[2])
+        for i in range(0, len(single), GPUS_PER_NODE):
+            self.launch_pack("pack", single[i:i + GPUS_PER_NODE])
+
+        batches = collections.defaultdict(list)
+        for slot in self.slots:
+            if self.get_gpus(self.cfg["models"][slot[1].name]) != 1:
+                batches[slot[1].name].append(slot)
+        item_overhead = self.cfg.get("batch_item_overhead_minutes", 0)*60
+        for name, slots in batches.items():
+            model = self.cfg["models"][name]
+            capacity = self.cfg["walltime_hours"]*60*60*(1 - self.cfg["walltime_margin"]) - self.get_overhead(model)
+            batch, load = [], 0.0
+            for slot in sorted(slots, key=lambda slot: (slot[1].it, slot[1].jobname)):
+                if len(batch) > 0 and (len(batch) >= self.get_max_batch_size() or load + item_overhead + slot[2] > capacity):
+                    self.launch_pack("batch", batch)
+                    batch, load = [], 0.0
+                batch.append(slot)
+                load += item_overhead + slot[2]
+            if len(batch) > 0:
+                self.launch_pack("batch", batch)
+        self.slots = []
+
+    def get_iterations(self, name: str, model: dict) -> dict[int, dict[str, str]]:
+        """Iterations of `model` to evaluate -> extra environment of their jobs."""
+        if "model_dirs" in model:  # Megatron checkpoints where iterations are taken on the fly.
+            extra_env = {"EXTRA_PIPS": "nvidia-modelopt==0.27.0", "TOKENIZER": "alehc/swissai-tokenizer",
+                         "BOS": "true"}
+            return {it: extra_env for it in self.get_available(name, model)
+                    if (it - model["start_eval_from"]) % model["frequency"] == 0 and it >= model["start_eval_from"] or it in model.get("force_iters", [])}
+        iterations = {}  # Huggingface checkpoints.
+        for i, it in enumerate(model["iters"]):
+            extra = dict(model.get("extra_env", {}))
+            if "revisions" in model and model["revisions"][i] is not None:
+                extra["REVISION"] = model["revisions"][i]
+            iterations[it] = extra
+        return iterations
+
+    def get_ledger(self) -> FailureLedger:
+        return FailureLedger.open(Path(self.cfg["logs_root"]), backoff=self.cfg["failure_backoff_hours"]*60*60,
+                                  max_backoff=self.cfg["failure_max_backoff_hours"]*60*60,
+                                  quarantine=self.cfg["failure_quarantine"])
+
+    def get_time(self) -> float:
+        return time.time()
+
+    def submit_needed(self, force_tasks: list[str] = []):
+        """Submits the missing evaluations by priority, cancelling the queued jobs that are not needed anymore.
+
+        Pinned iterations (`force_iters`) go first, then the iterations missing headline tasks, then the newest
+        iterations of every model (round robin across models, the one with less jobs first).
+        With `max_pending_iterations` only the newest iterations of each model that miss results are evaluated
+        (older ones wait until those are done) and with `max_jobs`/`max_jobs_per_model` the number of queued
+        evaluation jobs is capped.
+        Tasks that failed recently are retried with exponential backoff, see `evals.failures`.
+        """
+        with _LEDGER_LOCK:
+            self.ledger = self.get_ledger()
+            self.slots = []
+            try:
+                self.submit_missing(force_tasks)
+                self.launch_slots()
+            finally:
+                self.ledger.save()
+
+    def submit_missing(self, force_tasks: list[str]):
+        def get_missing(name: str, status: dict[int, set[str]], it: int) -> list[Task]:
+            handled = status.get(it, set())
+            return [task for task in self.all_tasks if task.name in force_tasks or
+                    not handled.issuperset(task.result_names) and not self.ledger.blocked(name, it, task.name, now)]
 
         # Get tasks alredy evaluated (reading them from the `results.json`).
-        status = get_evaluated(name)
-        default_partition = get_partition(tasks=ALL_TASKS, shards=n_shards)
-
-        # Handle already evaluated: if a "mixed" group is running, assume it will
-        # contain all missing tasks because we don't know which one does it contain in reality,
-        # otherwise obtain the correct shard.
-        for it, groups in running[name].items():
-            for group in groups:
-                if group == "mixed":
-                    actual_tasks = ALL_TASKS
-                else:
-                    shard_i, total_shards = re.match("^shard([0-9]+)of([0-9]+)$", group).groups()
-                    assert int(total_shards) == n_shards
-                    actual_tasks = default_partition[int(shard_i)]
-
-                expected_names = []
-                for task in actual_tasks:
-                    expected_names += [task.name] if len(task.alias) == 0 else list(task.alias)
-
-                if it in status:
-                    status[it] += expected_names
-                else:
-                    status[it] = expected_names
-
-        if "model_dirs" in model:  # Megatron checkpoints where iterations are taken on the fly.
-            available = get_available(model["model_dirs"])
-            for it in available:
-                if (it - model["start_eval_from"]) % model["frequency"] == 0 and it >= model["start_eval_from"] or it in model.get("force_iters", []):
-                    missing = get_missing(it)
-                    if len(missing) > 0:
-                        paths = [model_dir for model_dir in model["model_dirs"]
-                                 if Path(f"{model_dir}/iter_{it:07d}").exists()]
-                        if len(paths) != 1:
-                            raise ValueError(f"Model {name} has {len(paths)} paths for iter {it} (should be =1): {paths}")
-                        path, = paths
-                        extra_env = {"EXTRA_PIPS": "nvidia-modelopt==0.27.0", "TOKENIZER": "alehc/swissai-tokenizer",
-                                     "BOS": "true", "HF_TEMP_DIR": CFG["hf_temp_dir"]}
-                        submit(name, model, it, missing, str(path), extra_env)
-        else:  # Huggingface checkpoints.
-            for i in range(len(model["iters"])):
-                extra = model.get("extra_env", {})
-                it = model["iters"][i]
-                if "revisions" in model and model["revisions"][i] is not None:
-                    extra["REVISION"] = model["revisions"][i]
-                # Determine missing set.
-                missing = get_missing(it)
+        evaluated = {}
+        def get_evaluated(name: str) -> dict[int, set[str]]:
+            if name not in evaluated:
+                evaluated[name] = self.get_evaluated(name)
+            return evaluated[name]
+
+        def get_completed(name: str, it: int) -> set[str]:
+            results = get_evaluated(name).get(it, set())
+            return {task.name for task in self.catalog if results.issuperset(task.result_names)}
+
+        # Record the outcome of our jobs that left the queue since the last time.
+        now = self.get_time()
+        jobs = self.get_jobs()
+        failed = self.ledger.settle({job_id for job_id, _ in jobs}, self.scheduler.states, get_completed, now)
+        for name, it, tasks, reason in failed:
+            print(f"WARNING! {len(tasks)} tasks of {name} iter {it} failed: {reason}")
+        quarantined = [failure for failure in self.ledger.quarantined() if failure[0] in self.cfg["models"]]
+        if len(quarantined) > 0:
+            print(f"WARNING! {len(quarantined)} tasks are quarantined after failing repeatedly, "
+                  f"see `python -m evals.failures --logs-root {self.cfg['logs_root']}`")
+
+        plans = {}
+        for name, model in self.cfg["models"].items():
+            try:
+                default_partition = self.get_default_partition(model, get_backend(model))
+            except ValueError as err:
+                print(f"WARNING! Skipping {name}, some of its jobs would time out: {err}")
+                continue
+
+            # Newest iterations first, keep at most `max_pending_iterations` of them (plus the pinned ones).
+            iterations = self.get_iterations(name, model)
+            pinned = set(model.get("force_iters", []))
+            unfinished = sorted((it for it in iterations if len(get_missing(name, get_evaluated(name), it)) > 0),
+                                reverse=True)
+            keep = self.cfg.get("max_pending_iterations")
+            wanted = [it for it in unfinished if it in pinned]
+            wanted += [it for it in unfinished if it not in pinned][:keep]
+            plans[name] = (model, default_partition, iterations, pinned, wanted)
+
+        # Cancel queued jobs of iterations that are done, gone or superseded by newer ones
+        # (packs only once none of their evaluations is needed).
+        needed = collections.defaultdict(bool)
+        pending = self.get_jobs(pending_only=True)
+        for job_id, jobname in pending:
+            parsed = parse_jobname(jobname)
+            needed[job_id] |= parsed is None or parsed[0] not in plans or parsed[1] in plans[parsed[0]][4]
+        for job_id, attempts in self.ledger.attempts.items():  # Cancelling a dependency would kill the job too.
+            if needed.get(job_id, True):
+                for attempt in attempts:
+                    for dependency in (attempt.dependency or "").split(":"):
+                        if dependency in needed:
+                            needed[dependency] = True
+        for job_id in [job_id for job_id, is_needed in needed.items() if not is_needed]:
+            print("Cancelling", *[jobname for other, jobname in pending if other == job_id])
+            self.scheduler.cancel(job_id)
+            self.ledger.untrack(job_id)
+            jobs = [(other, jobname) for other, jobname in jobs if other != job_id]
+
+        requests = []
+        for name, (model, default_partition, iterations, pinned, wanted) in plans.items():
+            # Handle already evaluated: if a "mixed" group is running, assume it will
+            # contain all missing tasks because we don't know which one does it contain in reality,
+            # otherwise obtain the correct shard. Shards keep their index when the catalog changes
+            # so the current assignment is used even if the job was launched with a different number of shards.
+            status = collections.defaultdict(set, {it: set(tasks) for it, tasks in get_evaluated(name).items()})
+            for it, groups in get_running(jobname for _, jobname in jobs)[name].items():
+                for group in groups:
+                    if group == "mixed":
+                        actual_tasks = self.all_tasks
+                    else:
+                        shard_i = int(re.match("^shard([0-9]+)of([0-9]+)$", group).group(1))
+                        actual_tasks = default_partition[shard_i] if shard_i < len(default_partition) else []
+
+                    status[it] |= set(self.catalog.result_names(actual_tasks))
+
+            for rank, it in enumerate(sorted(wanted, key=lambda it: (it not in pinned, -it))):
+                missing = get_missing(name, status, it)
                 if len(missing) > 0:
-                    submit(name, model, it, missing, model["name"], extra, use_official_vllm)
-
-
-def update_hf_checkpoints():
-    jobnames = get_running(as_jobname=True)
-    for path in Path(CFG["hf_temp_dir"]).iterdir():
-        if path.name in jobnames:  # Don't touch hf checkpoints of unfinished runs.
-            continue
-        name, it = re.match("^eval_(.*)_.*_([0-9]+)$", path.name).groups()
-        it = int(it)
-        dest = Path(CFG["hf_storage_dir"])/f"{name}_it{it}"
-        if dest.exists():  # Checkpoint is already stored, probably from a job with different tasks that finished earlier.
-            print("Removing", path)
-            shutil.rmtree(path)
+                    headline = any(task.name in self.headline for task in missing)
+                    requests.append(Submission(name, model, it, missing, iterations[it], it in pinned, headline, rank))
+
+        # Submit by priority within the limits, the model with less queued jobs first among equals.
+        queued = collections.Counter({name: sum(map(len, its.values())) for name, its in get_running(jobname for _, jobname in jobs).items()})
+        total = sum(queued.values())
+        max_jobs = self.cfg.get("max_jobs")
+        max_jobs_per_model = self.cfg.get("max_jobs_per_model")
+        while len(requests) > 0:
+            request = min(requests, key=lambda r: (not r.pinned, not r.headline, r.rank, queued[r.name], r.name))
+            requests.remove(request)
+            budget = min(math.inf if max_jobs is None else max_jobs - total,
+                         math.inf if max_jobs_per_model is None else max_jobs_per_model - queued[request.name])
+            if budget <= 0:
+                continue
+            model = request.model
+            path = self.get_model_dir(request.name, model, request.it) if "model_dirs" in model else model["name"]
+            launched = self.submit(request.name, model, request.it, request.tasks, path, request.extra_env,
+                                   max_jobs=None if budget == math.inf else int(budget))
+            queued[request.name] += launched
+            total += launched
+
+    def update_hf_checkpoints(self):
+        """Moves the materialized checkpoints no queued job uses anymore from `hf_temp_dir` to the `hf_storage_dir` cache.
+
+        The copies run in the background (see `evals.transfer`), the source is removed by the first call after its
+        copy is complete. Until then jobs keep using the one in `hf_temp_dir`.
+        """
+        for entry_name, future in list(self.transfers.items()):
+            if future.done():
+                del self.transfers[entry_name]
+                if future.exception() is not None:  # Resumed by the next call.
+                    print(f"WARNING! Transfer of {entry_name} failed: {future.exception()}")
+
+        jobnames = [jobname for _, jobname in self.get_jobs()]
+        running = get_running(jobnames)
+        materializing = {jobname[len("mat_"):] for jobname in jobnames if jobname.startswith("mat_")}
+        temp_dir = Path(self.cfg["hf_temp_dir"])
+        if not temp_dir.exists():
+            return
+        for path in temp_dir.iterdir():
+            if path.name.endswith(checkpoints.PARTIAL_SUFFIX):  # Leftover of a failed conversion.
+                rmatch = re.match("^(.*)_it([0-9]+)_[0-9a-f]+$", path.name[:-len(checkpoints.PARTIAL_SUFFIX)])
+                if rmatch is not None and rmatch.group(1) in self.cfg["models"] and "_".join(rmatch.groups()) not in materializing:
+                    print("Removing", path)
+                    shutil.rmtree(path)
+                continue
+            entry = checkpoints.read_entry(path)
+            if entry is None or entry.name not in self.cfg["models"]:  # Might belong to another config.
+                continue
+            if entry.it in running[entry.name] or path.name in self.transfers:  # Don't touch hf checkpoints of unfinished runs.
+                continue
+            dest = Path(self.cfg["hf_storage_dir"])/path.name
+            if checkpoints.read_entry(dest) is not None:  # Checkpoint is already stored, by us or a job with different tasks.
+                print("Removing", path)
+                shutil.rmtree(path)
+                path.with_name(f"{path.name}.lock").unlink(missing_ok=True)
+            else:
+                if dest.exists():  # Left by an interrupted `shutil.move`.
+                    print("Removing incomplete", dest)
+                    shutil.rmtree(dest)
+                print("Moving", path, "to", dest)
+                self.transfers[path.name] = self.transfer_pool.submit(
+                    transfer.copy_tree, path, dest, workers=self.cfg["transfer_workers"], last=(checkpoints.MARKER,))
+
+    def wait_transfers(self):
+        """Waits for the background checkpoint copies and removes their sources."""
+        for future in list(self.transfers.values()):
+            future.exception()
+        with self.lock:
+            self.update_hf_checkpoints()
+
+    def cleanup_hf_checkpoints(self):
+        """Evicts the least recently used checkpoints of the `hf_storage_dir` cache down to `hf_cache_quota_gb`."""
+        running = get_running(jobname for _, jobname in self.get_jobs())
+        checkpoints.evict(self.cfg["hf_storage_dir"], self.cfg["hf_cache_quota_gb"]*1e9,
+                          in_use=lambda entry: entry.it in running[entry.name])
+
+    def cleanup_envs(self):
+        """Removes the prebuilt environments of `envs_dir` unused for `envs_max_idle_days`."""
+        if self.cfg.get("envs_dir") is not None:
+            envs.gc(self.cfg["envs_dir"], self.cfg["envs_max_idle_days"]*24*60*60)
+
+    def sync_wandb(self):
+        print("Syncing wandb...")
+        env = {**os.environ,
+               "WANDB_SILENT": "true",
+               "WANDB_RESUME": "allow",
+               "WANDB_ENTITY": self.cfg["wandb_entity"],
+               "WANDB_PROJECT": self.cfg["wandb_project"]}
+        cmd = ["python3", "scripts/update_wandb.py", str(self.cfg["logs_root"]),
+               "--reconcile-days", str(self.cfg["wandb_reconcile_days"]),
+               "--bootstrap", str(self.cfg.get("wandb_bootstrap_resamples", 0)), "--names"]
+        cmd += sorted(self.cfg["models"])
+        subprocess.run(cmd, env=env)
+        cmd = ["python3", "-m", "evals.warehouse", "--logs-root", str(self.cfg["logs_root"]), "--models"]
+        cmd += sorted(self.cfg["models"])
+        subprocess.run(cmd)
+
+    def get_signature(self, jobnames: list[str]) -> tuple:
+        """Changes whenever a submission might be needed: new checkpoints, finished jobs or a different config."""
+        available = {name: sorted(get_available(model["model_dirs"]))
+                     for name, model in self.cfg["models"].items() if "model_dirs" in model}
+        ours = sorted(jobname for jobname in jobnames if packs.is_pack(jobname)
+                      or any(jobname.startswith(f"eval_{name}_") for name in self.cfg["models"]))
+        return self.config_path.stat().st_mtime_ns, json.dumps(available), tuple(ours)
+
+    def run_stages(self, force_tasks: list[str], sync: bool):
+        with self.lock:
+            self.submit_needed(force_tasks)
+            self.update_hf_checkpoints()
+            self.cleanup_hf_checkpoints()
+            self.cleanup_envs()
+        if sync:
+            self.sync_wandb()
+
+
+def acquire_lock(logs_root: Path, timeout: float, poll: float = 5):
+    """Makes sure only one automation process runs at a time on `logs_root`, waiting at most `timeout` seconds.
+
+    The lock is held until the process exits (or the returned file is closed).
+    """
+    path = state_dir(logs_root)/"automate.lock"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    f = open(path, "w")
+    deadline = time.time() + timeout
+    waiting = False
+    while True:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return f
+        except BlockingIOError:
+            if time.time() >= deadline:
+                f.close()
+                raise SystemExit(f"Another automation process is running on {logs_root} (lock {path})")
+            if not waiting:
+                print(f"Waiting for the other automation process on {logs_root} to finish...")
+                waiting = True
+            time.sleep(max(min(poll, deadline - time.time()), 0))
+
+
+def every(name: str, fn: Callable[[], None], interval: float, wakeup: Optional[threading.Event] = None):
+    """Runs `fn` forever, every `interval` seconds or as soon as `wakeup` is set."""
+    while True:
+        try:
+            fn()
+        except Exception:
+            print(f"WARNING! Stage {name} failed:")
+            traceback.print_exc()
+        if wakeup is None:
+            time.sleep(interval)
         else:
-            print("Moving", path, "to", dest)
-            shutil.move(path, dest)
-
-
-def cleanup_hf_checkpoints():
-    # Get model=>[(it, path)] mapping.
-    stored = collections.defaultdict(list)
-    for path in Path(CFG["hf_storage_dir"]).iterdir():
-        rmatch = re.match("^(.*)_it([0-9]+)$", path.name)
-        if rmatch is not None and rmatch.group(1) in CFG["models"]:
-            name, it = rmatch.groups()
-            stored[name].append((int(it), path))
-
-    # Remove old checkpoints.
-    keep = CFG["num_hf_checkpoints_to_keep"]
-    for saved in stored.values():
-        remove = sorted(saved, key=lambda t: t[0])[:-keep]
-        for _, path in remove:
-            print("Removing", path)
-            shutil.rmtree(path)
-
-
-def sync_wandb():
-    print("Syncing wandb...")
-    env = {**os.environ,
-           "WANDB_SILENT": "true",
-           "WANDB_RESUME": "allow",
-           "WANDB_ENTITY": CFG["wandb_entity"],
-           "WANDB_PROJECT": CFG["wandb_project"]}
-    cmd = ["python3", "scripts/update_wandb.py", str(CFG["logs_root"]), "--names"]
-    cmd += sorted(CFG["models"])
-    subprocess.run(cmd, env=env)
-
-
-def main(force_tasks: list[str], use_official_vllm: bool, sync: bool):
-    submit_needed(force_tasks, use_official_vllm)
-    update_hf_checkpoints()
-    cleanup_hf_checkpoints()
-    if sync:
-        sync_wandb()
+            wakeup.wait(interval)
+            wakeup.clear()
+
+
+def daemon(automations: list[Automation], force_tasks: list[str], sync: bool, poll_seconds: float,
+           submit_minutes: float, checkpoints_minutes: float, sync_minutes: float):
+    def submit_stage(automation: Automation):
+        with automation.lock:
+            automation.load()
+            automation.submit_needed(force_tasks)
+
+    def checkpoints_stage(automation: Automation):
+        with automation.lock:
+            automation.update_hf_checkpoints()
+            automation.cleanup_hf_checkpoints()
+            automation.cleanup_envs()
+
+    wakeups = {}
+    for automation in automations:
+        name = automation.config_path.name
+        wakeups[name] = threading.Event()
+        stages = [(f"{name}:submit", lambda a=automation: submit_stage(a), submit_minutes*60, wakeups[name]),
+                  (f"{name}:checkpoints", lambda a=automation: checkpoints_stage(a), checkpoints_minutes*60, None)]
+        if sync:
+            stages.append((f"{name}:sync", automation.sync_wandb, sync_minutes*60, None))
+        for stage in stages:
+            threading.Thread(target=every, args=stage, name=stage[0], daemon=True).start()
+
+    # A single scan (squeue and checkpoint directories) is shared by all configs.
+    signatures = {}
+    while True:
+        time.sleep(poll_seconds)
+        try:
+            jobnames = [jobname for _, jobname in automations[0].scheduler.jobs()]
+            for automation in automations:
+                name = automation.config_path.name
+                signature = automation.get_signature(jobnames)
+                if name in signatures and signatures[name] != signature:
+                    print(f"Changes detected for {name}, looking for evaluations to submit")
+                    wakeups[name].set()
+                signatures[name] = signature
+        except Exception:
+            print("WARNING! Polling failed:")
+            traceback.print_exc()
+
+
+def main(config_path: list[Path], force_tasks: list[str], use_official_vllm: bool, sync: bool, daemon_mode: bool,
+         poll_seconds: float, submit_minutes: float, checkpoints_minutes: float, sync_minutes: float, lock_minutes: float):
+    scheduler = SlurmScheduler()
+    automations = [Automation(path, use_official_vllm, scheduler) for path in config_path]
+    logs_roots = sorted({Path(automation.cfg["logs_root"]).resolve() for automation in automations})
+    locks = [acquire_lock(logs_root, 0 if daemon_mode else lock_minutes*60) for logs_root in logs_roots]
+    if daemon_mode:
+        daemon(automations, force_tasks, sync, poll_seconds, submit_minutes, checkpoints_minutes, sync_minutes)
+    for automation in automations:
+        automation.run_stages(force_tasks, sync)
+    for automation in automations:
+        automation.wait_transfers()
+    for lock in locks:
+        lock.close()
 
 
 if __name__ == "__main__":
-    # Argparse.
     parser = argparse.ArgumentParser()
-    parser.add_argument("--config-path", type=Path, default=Path("configs/automation.json"))
+    parser.add_argument("--config-path", type=Path, nargs="+", default=[Path("configs/automation.json")])
     parser.add_argument("--force-tasks", nargs="*", default=[])
     parser.add_argument("--sync", action="store_true")
-    parser.add_argument("--use-official-vllm", action="store_true")
-    args = parser.parse_args()
-    
-    # Get general config and launch.
-    ALL_TASKS = get_all_tasks()
-    with open(args.config_path) as f:
-        CFG = json.load(f)
-    del args.config_path
-
-    # Remove non-official tassks when official vllm container was requested.
-    if args.use_official_vllm:
-        noadd = ["blend", "switzerland_qa", "include_base_new_45", "cultural_bench"]
-        ALL_TASKS = list(filter(lambda task: all(no not in task.name for no in noadd), ALL_TASKS))
-    main(**vars(args))
+    parser.add_argument("--use-official-vllm", action="store_true",
+                        help="Use the official vllm container for all configs (set `use_official_vllm` in a config to only use it there).")
+    parser.add_argument("--daemon", dest="daemon_mode", action="store_true", help="Keep running, see the module docstring.")
+    parser.add_argument("--poll-seconds", type=float, default=60, help="How often to look for new checkpoints and finished jobs.")
+    parser.add_argument("--submit-minutes", type=float, default=60, help="Look for evaluations to submit at least this often.")
+    parser.add_argument("--checkpoints-minutes", type=float, default=10, help="How often to move and evict converted checkpoints.")
+    parser.add_argument("--sync-minutes", type=float, default=60, help="How often to sync wandb (with --sync).")
+    parser.add_argument("--lock-minutes", type=float, default=10,
+                        help="How long a one-shot run waits for another automation process on the same logs root (a daemon doesn't wait).")
+    main(**vars(parser.parse_args()))
@@ -0,0 +1,69 @@
+"""Import-time regression check for the CLI entry points.
+
+The automation spawns these scripts over and over on login nodes, so importing them
+(and loading a compiled task catalog) must not pull in heavy dependencies.
+Each check runs in a fresh interpreter; the script exits with an error if a forbidden module
+was imported or if `--budget` (in milliseconds) was exceeded.
+Usage (from the repository root):
+```
+python scripts/check_import_time.py [--budget 500]
+```
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+HEAVY = ["requests", "iso639", "prtpy", "pandas", "numpy", "pyarrow", "wandb", "datasets", "zstandard"]
+
+# name -> (python statement to time, modules that must not be imported by it).
+CHECKS = {
+    "evals.get_tasks": ("import evals.get_tasks", HEAVY),
+    "evals.catalog": ("import evals.catalog", HEAVY),
+    "scripts/automate.py": ("import runpy; runpy.run_path('scripts/automate.py')", HEAVY),
+    "scripts/update_wandb.py": ("import runpy; runpy.run_path('scripts/update_wandb.py')", HEAVY),
+    "scripts.alignment.update_wandb_all_models": ("import scripts.alignment.update_wandb_all_models", HEAVY),
+    # Loading an up to date lockfile should not need any of the heavy dependencies either.
+    "TaskCatalog.load": ("from evals.catalog import TaskCatalog; TaskCatalog.load()", HEAVY),
+}
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"elapsed": elapsed, "modules": sorted(sys.modules)}}))
+"""
+
+
+def run_check(statement: str) -> tuple[float, set[str]]:
+    proc = subprocess.run([sys.executable, "-c", PROBE.format(statement=statement)],
+                          capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr)
+    info = json.loads(proc.stdout.strip().split("\n")[-1])
+    return info["elapsed"], set(info["modules"])
+
+
+def main(budget: float) -> int:
+    failed = False
+    for name, (statement, forbidden) in CHECKS.items():
+        if name == "TaskCatalog.load" and not Path("configs/all_tasks.lock.json").exists():
+            print(f"{name}: skipped, no compiled catalog (run `python -m evals.catalog`)")
+            continue
+        elapsed, modules = run_check(statement)
+        offending = sorted(module for module in forbidden if module in modules)
+        ok = len(offending) == 0 and elapsed*1000 <= budget
+        failed = failed or not ok
+        print(f"{name}: {elapsed*1000:.0f}ms {'OK' if ok else 'FAILED'}"
+              + (f" (imports {', '.join(offending)})" if len(offending) > 0 else ""))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that the CLIs import quickly and lazily.")
+    parser.add_argument("--budget", type=float, default=500, help="Maximum import time per entry point (ms).")
+    sys.exit(main(**vars(parser.parse_args())))
@@ -0,0 +1,259 @@
+"""Simulates the automation on a fake cluster to compare partitioning and submission policies off-cluster.
+Usage:
+```
+python scripts/simulate.py --config-path configs/automation.json --nodes 16 --hours 168 \
+    --policy '{"name": "hourly", "poll_minutes": 60}' \
+    --policy '{"name": "daemon", "poll_minutes": 2}' \
+    --policy '{"name": "makespan0", "poll_minutes": 2, "makespan_weight": 0}'
+```
+Each policy is a set of overrides of the automation config (e.g. `makespan_weight`, `walltime_margin`,
+`job_overhead_minutes`) plus `poll_minutes`, how often the automation looks for work (60 for the hourly loop).
+Checkpoints arrive as recorded by the mtimes of the `iter_*` directories of the last `--hours`
+(or every `--checkpoint-hours` when they are not accessible) and tasks take the time predicted by the cost
+fitted on the recorded runtimes (see `evals.cost`), perturbed by a deterministic `--noise`.
+Reports GPU-hours, queue latency, checkpoint-to-results latency and redundant work of every policy.
+"""
+from __future__ import annotations
+
+import argparse
+import collections
+import contextlib
+import copy
+import hashlib
+import io
+import json
+import math
+import os
+import random
+import re
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from typing import Optional
+
+from automate import GPUS_PER_NODE, Automation, get_headline_tasks, parse_jobname
+from evals import packs
+from evals.catalog import TaskCatalog
+from evals.cost import CostModel, get_backend_key, get_cost_model_path
+from evals.scheduler import FakeScheduler, Job
+
+
+class SimulatedAutomation(Automation):
+    """The automation of a config, with checkpoints and results coming from the simulation."""
+
+    def __init__(self, cfg: dict, catalog: TaskCatalog, cost_model: CostModel, scheduler: FakeScheduler,
+                 arrivals: dict[str, dict[int, float]]):
+        self.sim_cfg = cfg
+        self.sim_catalog = catalog
+        self.sim_cost_model = cost_model
+        self.arrivals = arrivals
+        self.results = collections.defaultdict(lambda: collections.defaultdict(set))
+        self.materialized = set()
+        super().__init__(Path("simulated.json"), scheduler=scheduler)
+
+    def load(self):
+        self.cfg = self.sim_cfg
+        self.use_official_vllm = False
+        self.catalog = self.sim_catalog
+        self.all_tasks = list(self.catalog)
+        self.headline = get_headline_tasks(self.catalog)
+        self.cost_model = self.sim_cost_model
+
+    def get_time(self) -> float:
+        return self.scheduler.now
+
+    def get_available(self, name: str, model: dict) -> list[int]:
+        return [it for it, t in self.arrivals.get(name, {}).items() if t <= self.scheduler.now]
+
+    def get_model_dir(self, name: str, model: dict, it: int) -> str:
+        return model["model_dirs"][0]
+
+    def get_evaluated(self, model: str) -> dict[int, set[str]]:
+        return collections.defaultdict(set, {it: set(tasks) for it, tasks in self.results[model].items()})
+
+    def materialize(self, name: str, it: int, model_path: str,
+                    env: dict[str, str]) -> tuple[dict[str, str], Optional[str]]:
+        if (name, it) in self.materialized:
+            return {}, None
+        jobname = f"mat_{name}_{it}"
+        job_ids = {other: job_id for job_id, other in self.scheduler.jobs()}
+        if jobname not in job_ids:
+            job_ids[jobname] = self.scheduler.submit("scripts/materialize.sbatch", [model_path], jobname, env)
+        return {}, job_ids[jobname]
+
+
+def get_arrivals(cfg: dict, hours: float, checkpoint_hours: float) -> dict[str, dict[int, float]]:
+    """Model name -> iteration -> arrival time (seconds from the start of the simulation)."""
+    start = time.time() - hours*60*60
+    arrivals = {}
+    for name, model in cfg["models"].items():
+        if "model_dirs" not in model:  # Huggingface models are fixed, assume they are already evaluated.
+            continue
+        def wanted(it: int) -> bool:
+            return (it - model["start_eval_from"]) % model["frequency"] == 0 and it >= model["start_eval_from"] or it in model.get("force_iters", [])
+        recorded = {}
+        for model_dir in map(Path, model["model_dirs"]):
+            if model_dir.exists():
+                for path in model_dir.iterdir():
+                    rmatch = re.match("^iter_([0-9]+)$", path.name)
+                    if rmatch is not None and wanted(int(rmatch.group(1))) and path.stat().st_mtime >= start:
+                        recorded[int(rmatch.group(1))] = path.stat().st_mtime - start
+        if len(recorded) == 0:  # Not on the cluster, one checkpoint every `checkpoint_hours`.
+            first = model["start_eval_from"]
+            recorded = {first + i*model["frequency"]: i*checkpoint_hours*60*60
+                        for i in range(math.floor(hours/checkpoint_hours) + 1)}
+        arrivals[name] = recorded
+    return arrivals
+
+
+def noise(key: str, sigma: float) -> float:
+    """Deterministic multiplicative noise, so that all policies see the same runtimes."""
+    seed = int(hashlib.sha256(key.encode()).hexdigest()[:16], 16)
+    return random.Random(seed).lognormvariate(0, sigma) if sigma > 0 else 1.0
+
+
+def simulate(cfg: dict, catalog: TaskCatalog, cost_model: CostModel, arrivals: dict[str, dict[int, float]],
+             nodes: int, hours: float, poll_minutes: float, noise_sigma: float, overhead_minutes: float,
+             materialize_minutes: float, verbose: bool) -> dict[str, float]:
+    by_name = {task.name: task for task in catalog}
+    task_runs = collections.Counter()
+    redundant_seconds = 0.0
+    done_at = {}
+
+    def task_seconds(jobname: str, env: dict[str, str], gpus: int, task_name: str) -> float:
+        name, it = parse_jobname(jobname)
+        backend = get_backend_key(env["BACKEND"], gpus)
+        seconds = cost_model.predict(by_name[task_name], float(env["SIZE"]), backend)
+        return seconds*noise(f"{name}/{it}/{task_name}", noise_sigma)
+
+    def tasks_seconds(jobname: str, env: dict[str, str], gpus: int) -> float:
+        return sum(task_seconds(jobname, env, gpus, task) for task in env["TASKS"].split(","))
+
+    def evaluations(job: Job) -> list[tuple[str, dict[str, str], int, float]]:
+        """(jobname, environment, gpus, seconds from the start of the job until it is done) of the evaluations of a job.
+
+        Several if it is a pack (side by side) or a batch (one after another).
+        """
+        if packs.is_pack(job.name):
+            slots = packs.read_pack(packs.get_packs_dir(Path(cfg["logs_root"])), job.name)
+            if job.name.startswith("pack_"):
+                return [(slot.jobname, {**job.env, **slot.env}, 1,
+                         overhead_minutes*60 + tasks_seconds(slot.jobname, {**job.env, **slot.env}, 1)) for slot in slots]
+            result, end = [], overhead_minutes*60
+            for slot in slots:
+                env = {**job.env, **slot.env}
+                end += cfg.get("batch_item_overhead_minutes", 0)*60 + tasks_seconds(slot.jobname, env, GPUS_PER_NODE)
+                result.append((slot.jobname, env, GPUS_PER_NODE, end))
+            return result
+        return [(job.name, job.env, GPUS_PER_NODE, overhead_minutes*60 + tasks_seconds(job.name, job.env, GPUS_PER_NODE))]
+
+    def duration(job: Job) -> tuple[float, bool]:
+        if job.name.startswith("mat_"):
+            return materialize_minutes*60, True
+        seconds = max(end for _, _, _, end in evaluations(job))
+        walltime = cfg["walltime_hours"]*60*60
+        return min(seconds, walltime), seconds <= walltime
+
+    def on_finish(job: Job):
+        nonlocal redundant_seconds
+        if job.failed and (job.cancelled or not packs.is_pack(job.name)):  # Evaluations of a pack fail on their own.
+            return
+        if job.name.startswith("mat_"):
+            automation.materialized.add(parse_jobname(job.name))
+            return
+        for jobname, env, gpus, end in evaluations(job):
+            if end > cfg["walltime_hours"]*60*60:
+                continue
+            name, it = parse_jobname(jobname)
+            for task_name in env["TASKS"].split(","):
+                task_runs[name, it, task_name] += 1
+                if task_runs[name, it, task_name] > 1:
+                    redundant_seconds += task_seconds(jobname, env, gpus, task_name)*gpus/GPUS_PER_NODE
+                automation.results[name][it].update(by_name[task_name].result_names)
+            expected = set(catalog.result_names())
+            if (name, it) not in done_at and automation.results[name][it] >= expected:
+                done_at[name, it] = job.started + end
+
+    scheduler = FakeScheduler(nodes, duration, on_finish)
+    automation = SimulatedAutomation(cfg, catalog, cost_model, scheduler, arrivals)
+
+    horizon = hours*60*60
+    t = 0.0
+    while True:
+        scheduler.advance(t)
+        submitted = len(scheduler.history)
+        with contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO()):
+            automation.submit_needed()
+        idle = len(scheduler.jobs()) == 0 and len(scheduler.history) == submitted
+        if t >= horizon and idle or t >= 2*horizon:
+            break
+        t += poll_minutes*60
+
+    jobs = list(scheduler.history.values())
+    evals = [job for job in jobs if job.name.startswith("eval_") or packs.is_pack(job.name)]
+    waits = [(job.started - job.submitted)/3600 for job in evals if job.started is not None]
+    latencies = [(done_at[name, it] - t0)/3600 for name, its in arrivals.items() for it, t0 in its.items()
+                 if (name, it) in done_at]
+    gpu_hours = sum(job.finished - job.started for job in jobs if job.finished is not None)*GPUS_PER_NODE/3600
+    failed_hours = sum(job.finished - job.started for job in evals if job.failed)*GPUS_PER_NODE/3600
+    return {
+        "jobs": len(evals),
+        "cancelled": sum(job.cancelled for job in evals),
+        "gpu_hours": gpu_hours,
+        "queue_h_mean": statistics.mean(waits) if len(waits) > 0 else 0.0,
+        "queue_h_max": max(waits, default=0.0),
+        "latency_h_mean": statistics.mean(latencies) if len(latencies) > 0 else math.nan,
+        "latency_h_max": max(latencies, default=math.nan),
+        "unfinished": sum(len(its) for its in arrivals.values()) - len(latencies),
+        "redundant_gpu_hours": redundant_seconds*GPUS_PER_NODE/3600,
+        "failed_gpu_hours": failed_hours,
+    }
+
+
+def main(config_path: Path, policy: list[str], nodes: int, hours: float, checkpoint_hours: float,
+         noise_sigma: float, overhead_minutes: Optional[float], materialize_minutes: float, verbose: bool):
+    with open(config_path) as f:
+        base_cfg = json.load(f)
+    catalog = TaskCatalog.load()
+    cost_model = CostModel.load(get_cost_model_path(Path(base_cfg["logs_root"])))
+    arrivals = get_arrivals(base_cfg, hours, checkpoint_hours)
+    if overhead_minutes is None:
+        overhead_minutes = base_cfg["job_overhead_minutes"]
+    policies = [json.loads(p) for p in policy] if len(policy) > 0 else [{"name": "default"}]
+
+    rows = []
+    for i, overrides in enumerate(policies):
+        overrides = dict(overrides)
+        name = overrides.pop("name", f"policy{i}")
+        poll_minutes = overrides.pop("poll_minutes", 60)
+        cfg = copy.deepcopy(base_cfg)
+        cfg.update(overrides)
+        cfg["models"] = {name: model for name, model in cfg["models"].items() if name in arrivals}
+        # Shard assignments are persisted in the cache, start every policy from scratch.
+        with tempfile.TemporaryDirectory() as tmp:
+            os.environ["EVALS_CACHE_DIR"] = tmp
+            rows.append((name, simulate(cfg, catalog, cost_model, arrivals, nodes, hours, poll_minutes,
+                                        noise_sigma, overhead_minutes, materialize_minutes, verbose)))
+
+    metrics = list(rows[0][1])
+    width = max(len(name) for name, _ in rows)
+    print(" "*width, *(f"{metric:>19}" for metric in metrics))
+    for name, result in rows:
+        print(f"{name:<{width}}", *(f"{result[metric]:>19.2f}" for metric in metrics))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare automation policies on a simulated cluster.")
+    parser.add_argument("--config-path", type=Path, default=Path("configs/automation.json"))
+    parser.add_argument("--policy", action="append", default=[], help="Json object with the config overrides of a policy.")
+    parser.add_argument("--nodes", type=int, default=16, help="Nodes available to the evaluations.")
+    parser.add_argument("--hours", type=float, default=7*24, help="Simulated period of checkpoint arrivals.")
+    parser.add_argument("--checkpoint-hours", type=float, default=6,
+                        help="Hours between checkpoints of models whose checkpoint directories are not accessible.")
+    parser.add_argument("--noise", dest="noise_sigma", type=float, default=0.2,
+                        help="Sigma of the log-normal error of the predicted task runtimes.")
+    parser.add_argument("--overhead-minutes", type=float, help="Actual overhead of a job (default: the config's).")
+    parser.add_argument("--materialize-minutes", type=float, default=30, help="Duration of a materialization job.")
+    parser.add_argument("--verbose", action="store_true", help="Show the submissions of the automation.")
+    main(**vars(parser.parse_args()))
@@ -1,147 +1,25 @@
 import collections
-import statistics
+import hashlib
 import re
 import json
 import os
+import time
 from argparse import ArgumentParser
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional
 
-import pandas as pd
-import wandb
-import iso639
+from evals import sinks
+from evals.aggregate import INVALID_NUM, Graph, Results, State, StateStore, aggregate, get_stamp, load_groups, read_results
+from evals.bootstrap import confidence_intervals
+from evals.catalog import TaskCatalog
+from evals.pushed import PushedLog
 
-from evals.tasks import get_all_tasks, Task
-
-INVALID_NUM = -1.0  # or -float("inf")
-
-def get_log(infos: List[dict], tasks_cfg: dict, all_tasks: list[Task]) -> dict[str, float]:
-    def agg(log: dict[str, dict[str, float]], prefix: str, tasks_to_agg: list[str], warn: bool = True,
-            macro: bool = True, micro: bool = True, no_micro_suffix: bool = False,
-            no_macro_suffix: bool = False, metrics: Optional[list[str]] = None):
-
-        missing = set(tasks_to_agg) - set(log)
-        macro_name = prefix if no_macro_suffix else f"{prefix}.macro"
-        micro_name = prefix if no_micro_suffix else f"{prefix}.micro"
-        if len(missing) > 0:
-            if warn:
-                print("WARNING! Aggregation for", prefix, "not available. Missing:", sorted(missing))
-            for metric in metrics if metrics is not None else ["acc"]:
-                if macro:
-                    log[macro_name][metric] = INVALID_NUM
-                if micro:
-                    log[micro_name][metric] = INVALID_NUM
-            return
-
-        for metric in filter(lambda metric: "stderr" not in metric and (metrics is None or metric in metrics), all_metrics):
-            values = [log[taskname][metric] for taskname in tasks_to_agg if metric in log[taskname]]
-            sizes = [true_sizes[taskname] for taskname in tasks_to_agg if metric in log[taskname]]
-            if len(values) > 0:
-                if macro:
-                    log[macro_name][metric] = statistics.mean(values)
-                if micro:
-                    log[micro_name][metric] = sum(value*size for value, size in zip(values, sizes))/sum(sizes)
-
-    def pretty_dim(dim: str) -> str:
-        return " ".join(dim.split("_")).title()
-
-
-    # Aggregate raw info.
-    groups = {}
-    results = {}
-    true_sizes = {}
-    all_metrics = set()
-    for info in infos:
-        groups.update(info["group_subtasks"])
-        results.update(info["results"])
-        true_sizes.update({name: details["effective"] for name, details in info["n-samples"].items()})
-
-    # Aggregate true_sizes if needed.
-    for taskname in results:
-        if taskname not in true_sizes:
-            true_sizes[taskname] = sum(size for other_taskname, size in true_sizes.items()
-                                       if other_taskname.startswith(taskname))
-
-    # Prepare final logs.
-    log = collections.defaultdict(dict)
-    for dataname, details in results.items():
-        for metricname, val in details.items():
-            if metricname == "alias" or val in ["N/A", " "]:
-                continue
-            assert isinstance(val, float), f"{dataname}.{metricname} = val"
-            metricname, _ = metricname.split(",")  # for some reason it is always acc,none so we remove the none.
-            all_metrics.add(metricname)
-            log[dataname][metricname] = val
-
-    # Fix some aggregations.
-    cultural_bench_parts = ["cultural_bench", "cultural_bench_easy", "cultural_bench_hard"]
-    aggs = {
-        "cultural_bench": (90, lambda taskname: taskname.startswith("cultural_bench") and taskname not in cultural_bench_parts),
-        "cultural_bench_easy": (45, lambda taskname: taskname.startswith("cultural_bench_easy") and taskname not in cultural_bench_parts),
-        "cultural_bench_hard": (45, lambda taskname: taskname.startswith("cultural_bench_hard") and taskname not in cultural_bench_parts),
-        "m_hellaswag": (30, lambda taskname: taskname.startswith("hellaswag_")),
-        "arc": (2, lambda taskname: taskname in ["arc_easy", "arc_challenge"]),
-        "m_arc": (31, lambda taskname: taskname.startswith("arc_") and taskname not in ["arc_easy", "arc_challenge"]),
-        "global_mmlu": (15, lambda taskname: re.match("^global_mmlu_[a-z]{2}$", taskname)),
-        "include_base_44": (44, lambda taskname: re.match("^include_base_44_[a-z ]+$", taskname)),
-        "xcopa": (11, lambda taskname: taskname.startswith("xcopa_")),
-        "xnli": (15, lambda taskname: taskname.startswith("xnli_")),
-        "xwinograd": (6, lambda taskname: taskname.startswith("xwinograd_")),
-        "switzerland_qa": (5, lambda taskname: re.match("^switzerland_qa_[a-z]{2}$", taskname)),
-        "blend": (16, lambda taskname: taskname.startswith("blend_")),
-        "include_base_45": (45, lambda taskname: taskname.startswith("include_base_new_45_")),
-    }
-    for part, (target, filter_fn) in aggs.items():
-        tasks_to_agg = list(filter(filter_fn, results))
-        if len(tasks_to_agg) == target:
-            agg(log, part, tasks_to_agg)
-            if part == "cultural_bench":  # Legacy.
-                agg(log, part, tasks_to_agg, macro=False, no_micro_suffix=True)
-        else:
-            print(f"WARNING! Couldn't fix {part} because all its parts haven't been evaluated (have {len(tasks_to_agg)}; expect {target})")
-
-    # Fix cultural bench microaggregation.
-    #for prefix in cultural_bench_parts:
-    #    tasks_to_agg = [taskname for taskname in results
-    #                    if taskname.startswith(prefix) and taskname not in cultural_bench_parts]
-    #    target = 2*45 if prefix == "cultural_bench" else 45
-    #    if len(tasks_to_agg) == target:
-    #        agg(log, prefix, tasks_to_agg)
-    #    else:
-    #        print("WARNING! Couldn't fix", prefix, "because it hasn't been evaluated", tasks_to_agg)
-
-    # Now that we have all the "leaf task groups" we can do four aggregations:
-    # Let's start with the {language_group} agg.
-    for lang_group_name, langs in tasks_cfg["language_groups"].items():
-        tasks_to_agg = [task.name for task in all_tasks
-                        if task.language.pt3 in langs]
-        agg(log, f"All Tasks/{lang_group_name}", list(tasks_to_agg), micro=False, metrics=["acc"])
-
-    # Aggregate start with the {dimension} agg.
-    all_dims = sorted({task.dimension for task in all_tasks})
-    for dim in all_dims:
-        tasks_to_agg = [task.name for task in all_tasks
-                        if task.dimension == dim]
-        metrics = ["exact_match"] if dim == "reasoning" else ["acc"] 
-        agg(log, f"All Dimensions/{pretty_dim(dim)}", list(tasks_to_agg), micro=False, metrics=metrics)
-
-    # Aggregate {dimension}.{language_group}.macro.
-    for lang_group_name, langs in tasks_cfg["language_groups"].items():
-        for dim in all_dims:
-            tasks_to_agg = [task.name for task in all_tasks
-                            if task.language.pt3 in langs and task.dimension == dim]
-            agg(log, f"{pretty_dim(dim)}/{lang_group_name}", list(tasks_to_agg), micro=False, metrics=["acc"])
-
-
-    # Finally, prepare wandb format.
-    wandb_log = {}
-    for dataname, details in log.items():
-        for metric, value in details.items():
-            wandb_log[f"{dataname}/{metric}"] = value
-    return wandb_log
+LOG_VERSION = 1  # Bump when the aggregation (`evals.aggregate`) changes, so the next sync recomputes every iteration.
 
 
 def get_history(name: str) -> Dict[int, Dict[str, float]]:
+    import wandb
+
     api = wandb.Api()
     try:
         run = api.run(f"{api.default_entity}/{os.environ['WANDB_PROJECT']}/{name}")
@@ -155,96 +33,199 @@ def get_history(name: str) -> Dict[int, Dict[str, float]]:
     return history
 
 
-def repair(all_tasks: list[Task]) -> list[Task]:
-    repaired = []
-    for task in all_tasks:
-        if task.name == "ai2_arc":
-            repaired += [Task("arc_easy", (), 0, iso639.Lang("en"), task.dimension),
-                         Task("arc_challenge", (), 0, iso639.Lang("en"), task.dimension)]
-        else:
-            repaired.append(task)
-    return repaired
-
-
-def main(logs_root: Path, names: list[str], it: Optional[int], cfg: Path):
-
-    all_tasks = get_all_tasks(all_tasks_json=cfg/"all_tasks.json")
-    all_tasks = repair(all_tasks)
+def get_pushed(pushed: PushedLog, project: str, name: str, reconcile: bool, reconcile_days: Optional[float],
+               get_remote: Optional[Callable[[str], Dict[int, Dict[str, float]]]] = get_history) -> Dict[int, Dict[str, float]]:
+    """What was already pushed to run `name`, from the local record (reconciled with wandb first if due)."""
+    reconciled = pushed.reconciled_at(project, name)
+    due = reconcile or reconciled is None or reconcile_days is not None and time.time() - reconciled > reconcile_days*24*60*60
+    if due and get_remote is not None:  # None when there is nothing remote, the local record is all there is.
+        print("Reconciling with the wandb history")
+        differ = pushed.reconcile(project, name, get_remote(name))
+        if differ > 0:
+            print(f"{differ} steps differed between the wandb history and the local record, resyncing their iterations")
+    return pushed.history(project, name)
+
+
+def get_cfg_hash(cfg: Path, bootstrap: int = 0) -> str:
+    """Fingerprint of the aggregation config (and of how it is aggregated, see `LOG_VERSION`)."""
+    digest = hashlib.sha256(f"{LOG_VERSION}\n".encode())
+    if bootstrap > 0:
+        digest.update(f"bootstrap {bootstrap}\n".encode())
+    for fname in ["all_tasks.json", "tasks.json", "aggregations.json"]:
+        digest.update((cfg/fname).read_bytes())
+    return digest.hexdigest()
+
+
+def get_fingerprint(iter_dir: Path, results_paths: List[Path], cfg_hash: str) -> str:
+    """Fingerprint of the inputs of the log of an iteration: the paths, mtimes and sizes of its files and the config."""
+    digest = hashlib.sha256(f"{cfg_hash}\n".encode())
+    for path in [iter_dir/"consumed_tokens.txt"] + results_paths:
+        stat = path.stat()
+        digest.update(f"{path}:{stat.st_mtime_ns}:{stat.st_size}\n".encode())
+    return digest.hexdigest()
+
+
+def main(logs_root: Path, names: list[str], it: Optional[int], cfg: Path, reconcile: bool,
+         reconcile_days: Optional[float], full: bool, sink: str, workers: int, bootstrap: int):
+    # Aggregations are done over the names reported by the harness, i.e. aliases (e.g. `ai2_arc` -> `arc_easy`, `arc_challenge`).
+    catalog = TaskCatalog.load(cfg/"all_tasks.json")
     with open(cfg/"tasks.json") as f:
         tasks_cfg = json.load(f)
-    all_languages = {task.language.pt3 for task in all_tasks}
+    all_languages = set(catalog.languages)
 
     for lang_group in tasks_cfg["language_groups"].values():
         for lang in lang_group:
-            print(lang)
-            assert lang in all_languages
+            assert lang in all_languages, f"Language {lang} of a language group has no tasks in the catalog"
 
     tasks_cfg["language_groups"]["global"] = list(all_languages)
+    graph = Graph(load_groups(cfg/"aggregations.json", tasks_cfg, catalog))
 
     # Grab each possible log and update wandb run.
-    # First, iterate model names.
+    # First, iterate model names and collect the results of the iterations that changed since the last sync.
     latest_logs = {}
+    histories = {}
+    changed = {}  # Name -> (iteration, consumed tokens) of the iterations to aggregate.
+    all_inputs = {}
+    table = Results()
+    previous, previous_outputs = Results(), {}  # What the iterations were last aggregated from and into.
+    files = {}
+    reread = 0
+    pushed = PushedLog.open(logs_root)
+    states = StateStore.open(logs_root)
+    if sink == "wandb":
+        project = f"{os.environ.get('WANDB_ENTITY', '')}/{os.environ['WANDB_PROJECT']}"
+        get_remote = get_history
+    else:  # Recorded apart from what was pushed to wandb, nothing remote to reconcile with.
+        project, get_remote = sink, None
+    cfg_hash = get_cfg_hash(cfg, bootstrap)
+    iterations = {}  # Name -> iteration -> its directory, to find the samples to bootstrap (and their bases).
     for p1 in filter(lambda p: names == [] or p.name in names, logs_root.iterdir()):
-        print("Updating path", p1)
-        history = get_history(p1.name)  # Get already pushed information.
-        with wandb.init(id=p1.name, name=p1.name) as run:
-            run.define_metric("ConsumedTokens")
-            run.define_metric("*", step_metric="ConsumedTokens")
-            # Now iterate all iterations for this name.
-            for p2 in p1.iterdir():
-                current_it = int(re.match("^iter_([0-9]+)$", p2.name).group(1))
-                # Skip if specified --it doesn't match currently iterated it.
-                if it is not None and it != current_it:
-                    continue
-                print("Updating iteration", current_it)
-
-                with open(p2/"consumed_tokens.txt") as f:
-                    consumed_tokens = int("".join(f).strip())
-
-                # Get all results.json harness logs.
-                results = []
-                for path in sorted(p2.glob("harness/eval_*/*/results*.json")):
-                    with open(path) as f:
-                        results.append(json.load(f))
+        print("Reading path", p1)
+        history = histories[p1.name] = get_pushed(pushed, project, p1.name, reconcile, reconcile_days, get_remote)  # Get already pushed information.
+        inputs = {} if full else pushed.inputs(project, p1.name)
+        changed[p1.name] = []
+        synced_inputs = all_inputs[p1.name] = {}
+        iterations[p1.name] = {int(re.match("^iter_([0-9]+)$", p2.name).group(1)): p2 for p2 in p1.iterdir()}
+        samples_paths = {current_it: sorted(path for suffix in [".jsonl", ".jsonl.zst"]
+                                            for path in p2.glob(f"harness/eval_*/*/samples_*{suffix}"))
+                         for current_it, p2 in iterations[p1.name].items()} if bootstrap > 0 else {}
+        # Now iterate all iterations for this name.
+        for current_it, p2 in iterations[p1.name].items():
+            # Skip if specified --it doesn't match currently iterated it.
+            if it is not None and it != current_it:
+                continue
 
-                if len(results) > 0:
-                    log = get_log(results, tasks_cfg, all_tasks)
-                    log.update({"ConsumedTokens": consumed_tokens, "OptStep": current_it})
+            # Skip if nothing changed since the last sync. The deltas are bootstrapped against the samples of the
+            # previous iteration with samples, so those count as inputs too (e.g. an earlier checkpoint evaluated later).
+            results_paths = sorted(p2.glob("harness/eval_*/*/results*.json"))
+            base_it = max((other for other, paths in samples_paths.items() if other < current_it and len(paths) > 0),
+                          default=None)
+            base_paths = [] if base_it is None else samples_paths[base_it]
+            fingerprint = get_fingerprint(p2, results_paths + samples_paths.get(current_it, []) + base_paths, cfg_hash)
+            if current_it in inputs and inputs[current_it][0] == fingerprint:
+                consumed_tokens = inputs[current_it][1]
+                if consumed_tokens in history and (p1.name not in latest_logs or
+                                                   latest_logs[p1.name]["ConsumedTokens"] < consumed_tokens):
+                    latest_logs[p1.name] = history[consumed_tokens]
+                continue
 
-                    # Update log if needed.
-                    if consumed_tokens in history:
-                        for key in set(history[consumed_tokens]) - set(log):
-                            log[key] = INVALID_NUM
+            with open(p2/"consumed_tokens.txt") as f:
+                consumed_tokens = int("".join(f).strip())
+            synced_inputs[current_it] = fingerprint, consumed_tokens
+
+            # Get all results.json harness logs, only reading the ones that changed since they were last aggregated.
+            state = None if full else states.get(p1.name, current_it)
+            state = None if state is None or state.graph != graph.key else state
+            cached = {} if state is None else state.files
+            iter_files = {}
+            for path in map(str, results_paths):
+                stamp = get_stamp(path)
+                if path not in cached or cached[path][0] != stamp:
+                    cached_stamp, content = stamp, read_results(path)
+                    reread += 1
+                else:
+                    cached_stamp, content = cached[path]
+                iter_files[path] = cached_stamp, content
+
+            if len(iter_files) > 0:
+                key = p1.name, current_it
+                table.add(key, [content for _, content in iter_files.values()])
+                if state is not None:
+                    previous.add(key, [content for _, content in state.files.values()])
+                    previous_outputs[key] = state.outputs
+                files[key] = iter_files
+                changed[p1.name].append((current_it, consumed_tokens))
+            else:
+                print("No logs found for iteration", current_it)
+
+    # Aggregate all the changed iterations of all the models at once.
+    print(f"Aggregating {sum(map(len, changed.values()))} iterations ({len(table)} values, {reread} results files read, "
+          f"{len(previous_outputs)} iterations updated incrementally)")
+    logs, outputs = aggregate(table, graph, previous, previous_outputs)
+    states.put({key: State(graph.key, files[key], outputs[key]) for key in logs})
+    states.close()
+    if bootstrap > 0:
+        print(f"Bootstrapping the aggregates of {len(logs)} iterations ({bootstrap} resamples)")
+        for key, intervals in confidence_intervals(logs_root, table, graph, outputs, iterations, bootstrap).items():
+            logs[key].update(intervals)
+
+    # Compare them with what was already pushed.
+    uploads = {}  # Everything to push to each run, pushed (concurrently) after this big loop.
+    for name, its in changed.items():
+        print("Updating", name)
+        history = histories[name]
+        to_log = []
+        for current_it, consumed_tokens in its:
+            print("Updating iteration", current_it)
+            log = logs[name, current_it]
+            log.update({"ConsumedTokens": consumed_tokens, "OptStep": current_it})
+
+            # Update log if needed.
+            if consumed_tokens in history:
+                for key in set(history[consumed_tokens]) - set(log):
+                    log[key] = INVALID_NUM
+
+                if log == history[consumed_tokens]:
+                    print("Exact log already matches wandb! Ignoring entry to avoid pushing duplicates")
+                else:
+                    print("Important! wandb log at current iteration already found, but differs. Updating")
+                    to_log.append(log)
+            else:
+                to_log.append(log)
+                print("Logging")
 
-                        if log == history[consumed_tokens]:
-                            print("Exact log already matches wandb! Ignoring entry to avoid pushing duplicates")
-                        else:
-                            print("Important! wandb log at current iteration already found, but differs. Updating")
-                            run.log(log)
-                    else:
-                        run.log(log)
-                        print("Logging")
+            # Update all_logs so we can build the table after this big loop.
+            if name not in latest_logs or latest_logs[name]["ConsumedTokens"] < consumed_tokens:
+                latest_logs[name] = log
+        print()
 
-                    # Update all_logs so we can build the table after this big loop.
-                    if p1.name not in latest_logs or latest_logs[p1.name]["ConsumedTokens"] < consumed_tokens:
-                        latest_logs[p1.name] = log
-                else:
-                    print("No logs found!")
-                print()
+        if len(to_log) > 0:
+            uploads[name] = sinks.Upload(run_id=name, name=name, logs=to_log, step_metric="ConsumedTokens")
 
-    # Build and push the table.
+    # Build the table, pushed in the same session as the logs.
     # We need `it` to be None to ensure that the logs on `latest_logs` actually
     # belong to the latest known iteration.
     show_in_table = tasks_cfg["show_in_table"]
     if it is None:
-        for name, log in filter(lambda t: set(show_in_table) <= set(t[1]),
+        for name, log in filter(lambda t: t[0] in uploads and set(show_in_table) <= set(t[1]),
                                 latest_logs.items()):
             print("Updating table for model", name)
-            sublog = {"Model": name}
-            sublog.update({task: log[task] for task in ["ConsumedTokens"] + show_in_table})
-            df = pd.DataFrame([sublog])
-            with wandb.init(id=name, name=name) as run:
-                run.log({"eval_table": wandb.Table(dataframe=df), "ConsumedTokens": log["ConsumedTokens"]})
+            columns = ["Model", "ConsumedTokens"] + show_in_table
+            uploads[name].tables["eval_table"] = sinks.Table(columns, [[name] + [log[task] for task in columns[1:]]])
+            uploads[name].table_log = {"ConsumedTokens": log["ConsumedTokens"]}
+
+    # Push and record what was pushed (runs that failed are retried by the next sync).
+    print(f"Pushing {len(uploads)} runs")
+    errors = sinks.upload(sinks.get_sink(sink), list(uploads.values()), workers)
+    for name, error in errors.items():
+        if error is not None:
+            print(f"WARNING! Pushing {name} failed: {error}")
+            all_inputs.pop(name)
+        else:
+            pushed.append(project, name, uploads[name].logs)
+    for name, inputs in all_inputs.items():
+        pushed.set_inputs(project, name, inputs)
+    pushed.close()
 
     # Update text description.
     print("Goodbye")
@@ -256,5 +237,15 @@ if __name__ == "__main__":
     parser.add_argument("--names", nargs="*", default=[])
     parser.add_argument("--it", type=int)
     parser.add_argument("--cfg", type=Path, default=Path("configs"))
+    parser.add_argument("--reconcile", action="store_true",
+                        help="Compare the local record of what was pushed with the wandb history of every run.")
+    parser.add_argument("--sink", default="wandb", help="Where to push the logs: `wandb` or `local:<dir>` (see `evals.sinks`).")
+    parser.add_argument("--workers", type=int, default=4, help="Runs pushed at the same time.")
+    parser.add_argument("--full", action="store_true",
+                        help="Recompute the logs of every iteration from all its results files, not only the ones that changed.")
+    parser.add_argument("--bootstrap", type=int, default=0, metavar="RESAMPLES",
+                        help="Also log bootstrap confidence intervals of the aggregates from the samples files (see `evals.bootstrap`).")
+    parser.add_argument("--reconcile-days", type=float,
+                        help="Reconcile the runs that were last reconciled longer ago than this (see `evals.pushed`).")
     args = parser.parse_args()
     main(**vars(args))
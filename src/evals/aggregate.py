@@ -0,0 +1,353 @@
+"""Aggregation of harness results into the logs pushed by `scripts/update_wandb.py`.
+
+What is aggregated is declared in `configs/aggregations.json`: the `families` and the `averages` over the catalog
+tasks of every language group (`language_groups` of `configs/tasks.json`) and/or dimension. The members of a family
+are the results of the catalog tasks of a `group` (e.g. `m_arc` over the `arc_{language}` tasks) and/or of its
+`tasks` (catalog tasks or aliases), resolved (and checked) once when loading, or the leaves the harness reports under
+one of its groups (`subtasks_of`, e.g. the countries of `cultural_bench`, which the catalog doesn't list).
+They are compiled once per sync into a `Graph` of what depends on each result name and on each aggregate (e.g. the
+averages including the legacy `cultural_bench`, which a family writes).
+The results of all the iterations to aggregate are collected in a long-format `Results` table (a value per key, task
+and metric, keys being e.g. `(run, iteration)`) and aggregated in a single pass. Given what an iteration was last
+aggregated from and into (its `State`, kept in `state_dir(LOGS_ROOT)/aggregates.sqlite`), only its results files
+that changed are read again and only the aggregates downstream of the results that changed are recomputed, so
+syncing a new shard of an iteration is cheap.
+Aggregates with missing tasks are `INVALID_NUM`, families missing members are not logged (a warning lists them with
+the members found).
+"""
+from __future__ import annotations
+
+import collections
+import dataclasses
+import hashlib
+import json
+import sqlite3
+import statistics
+import zlib
+from collections.abc import Hashable, Iterable, Iterator
+from pathlib import Path
+from typing import Optional
+
+from evals.cache import state_dir
+from evals.catalog import TaskCatalog
+
+
+INVALID_NUM = -1.0  # or -float("inf")
+
+Outputs = dict[str, dict[str, float]]  # Aggregate name -> metric -> value.
+
+
+@dataclasses.dataclass(frozen=True)
+class Group:
+    """Aggregate of `tasks`, or of the leaves reported under the harness group `subtasks_of` (except `exclude`).
+
+    Logged as `{prefix}.macro` (mean) and `{prefix}.micro` (mean weighted by the effective samples) for every
+    metric (but stderrs) or only `metrics`. With missing members, it is not logged if `complete` (families),
+    `INVALID_NUM` otherwise.
+    """
+    prefix: str
+    tasks: tuple[str, ...] = ()
+    subtasks_of: Optional[str] = None
+    exclude: tuple[str, ...] = ()
+    complete: bool = False
+    macro: bool = True
+    micro: bool = True
+    no_micro_suffix: bool = False
+    metrics: Optional[tuple[str, ...]] = None
+    warn: bool = True
+
+    @property
+    def macro_name(self) -> str:
+        return f"{self.prefix}.macro"
+
+    @property
+    def micro_name(self) -> str:
+        return self.prefix if self.no_micro_suffix else f"{self.prefix}.micro"
+
+
+def pretty_dim(dim: str) -> str:
+    return " ".join(dim.split("_")).title()
+
+
+def _get_group(prefix: str, tasks: Iterable[str], spec: dict) -> Group:
+    kwargs = {key: tuple(value) if isinstance(value, list) else value for key, value in spec.items()
+              if key not in {"prefix", "over", "dimension_metrics", "group", "tasks"}}
+    return Group(prefix, tuple(tasks), **kwargs)
+
+
+def _get_members(family: dict, catalog: TaskCatalog) -> tuple[list[str], list[str]]:
+    """The result names of the `group` and `tasks` of a family (but `exclude`), and its `tasks` not in the catalog."""
+    names = catalog.result_names(catalog.select(group=family["group"])) if "group" in family else []
+    unknown = []
+    for name in family.get("tasks", []):
+        if name in catalog.by_alias:  # Only that part of the task.
+            names.append(name)
+        elif name in catalog.by_name:
+            names += catalog.by_name[name].result_names
+        else:
+            unknown.append(name)
+    return [name for name in dict.fromkeys(names) if name not in family.get("exclude", [])], unknown
+
+
+def load_groups(path: Path, tasks_cfg: dict, catalog: TaskCatalog) -> list[Group]:
+    """The families, then the averages of `path` (`configs/aggregations.json`), in order.
+
+    Families whose members are not in the catalog are left out, with a warning.
+    """
+    with open(path) as f:
+        cfg = json.load(f)
+    groups, empty = [], []
+    for family in cfg["families"]:
+        if "subtasks_of" in family:  # Members reported by the harness.
+            groups.append(_get_group(family["prefix"], [], {**family, "complete": True}))
+            continue
+        members, unknown = _get_members(family, catalog)
+        if len(unknown) > 0:
+            print(f"WARNING! Tasks of the family {family['prefix']} not in the catalog: {unknown}")
+        if len(members) == 0:
+            empty.append(family["prefix"])
+            continue
+        groups.append(_get_group(family["prefix"], members, {**family, "complete": True}))
+    if len(empty) > 0:
+        print("WARNING! Not aggregating the families without members in the catalog:", ", ".join(empty))
+    for average in cfg["averages"]:
+        # Language groups first, e.g. {dimension}/{language_group} goes over the dimensions of each language group.
+        lang_groups = tasks_cfg["language_groups"].items() if "language_group" in average["over"] else [(None, None)]
+        for lang_group_name, langs in lang_groups:
+            for dim in catalog.dimensions if "dimension" in average["over"] else [None]:
+                tasks = catalog.result_names(catalog.select(language=langs, dimension=dim))
+                prefix = average["prefix"].format(language_group=lang_group_name,
+                                                  dimension=None if dim is None else pretty_dim(dim))
+                metrics = average.get("dimension_metrics", {}).get(str(dim), average.get("metrics"))
+                groups.append(_get_group(prefix, tasks, {**average, "metrics": metrics}))
+    return groups
+
+
+class Graph:
+    """The aggregates in order, with what depends on each result name and on each aggregate."""
+
+    def __init__(self, groups: list[Group]):
+        self.groups = groups
+        self.key = hashlib.sha256(repr(groups).encode()).hexdigest()[:16]
+        self.reported = [i for i, group in enumerate(groups) if group.subtasks_of is not None]
+        self._fixed = collections.defaultdict(list)  # Name -> groups it is one of the `tasks` of.
+        for i, group in enumerate(groups):
+            for task in dict.fromkeys(group.tasks):
+                self._fixed[task].append(i)
+
+    def members(self, group_subtasks: dict[str, list[str]]) -> dict[int, list[str]]:
+        """The members of every group, the ones of `subtasks_of` groups as reported in `group_subtasks`."""
+        members = {i: list(group.tasks) for i, group in enumerate(self.groups)}
+        for i in self.reported:
+            group = self.groups[i]
+            if group.subtasks_of in group_subtasks:
+                leaves = _leaves(group.subtasks_of, group_subtasks)
+                members[i] = [name for name in dict.fromkeys(leaves) if name not in group.exclude]
+        return members
+
+    def downstream(self, names: Iterable[str], members: dict[int, list[str]]) -> set[int]:
+        """The groups that depend on `names` (given the `members` of the groups), directly or through other groups."""
+        reported = collections.defaultdict(list)
+        for i in self.reported:
+            for name in members[i]:
+                reported[name].append(i)
+        dirty = set()
+        stack = list(names)
+        while len(stack) > 0:
+            name = stack.pop()
+            for i in self._fixed.get(name, []) + reported.get(name, []):
+                if i not in dirty:
+                    dirty.add(i)
+                    stack += [self.groups[i].macro_name, self.groups[i].micro_name]
+        return dirty
+
+
+def _leaves(name: str, group_subtasks: dict[str, list[str]]) -> list[str]:
+    if len(group_subtasks.get(name, [])) == 0:
+        return [name]
+    return [leaf for subtask in group_subtasks[name] for leaf in _leaves(subtask, group_subtasks)]
+
+
+class Results:
+    """Long-format harness results: a value per (key, task, metric), indexed by key and task."""
+
+    def __init__(self):
+        self.cells: dict[Hashable, dict[str, dict[str, float]]] = {}  # Key -> task -> metric -> value.
+        self.names: dict[Hashable, list[str]] = {}  # Every task reported for a key (even without values), in order.
+        self.sizes: dict[Hashable, dict[str, int]] = {}  # Effective samples of every task of a key.
+        self.metrics: dict[Hashable, set[str]] = {}  # Every metric reported for a key.
+        self.subtasks: dict[Hashable, dict[str, list[str]]] = {}  # Harness group -> its subtasks, of every key.
+
+    def __len__(self) -> int:
+        return sum(len(details) for cells in self.cells.values() for details in cells.values())
+
+    def rows(self) -> Iterator[tuple[Hashable, str, str, float, Optional[int]]]:
+        """(key, task, metric, value, effective samples) rows."""
+        for key, cells in self.cells.items():
+            for task, details in cells.items():
+                for metric, value in details.items():
+                    yield key, task, metric, value, self.sizes[key].get(task)
+
+    def add(self, key: Hashable, infos: list[dict]):
+        """Adds the results of a key, `infos` being the contents of its harness `results.json`s."""
+        results = {}
+        true_sizes = {}
+        subtasks = {}
+        for info in infos:
+            results.update(info["results"])
+            subtasks.update(info.get("group_subtasks", {}))
+            true_sizes.update({name: details["effective"] for name, details in info["n-samples"].items()})
+
+        # Aggregate true_sizes if needed.
+        for taskname in results:
+            if taskname not in true_sizes:
+                true_sizes[taskname] = sum(size for other_taskname, size in true_sizes.items()
+                                           if other_taskname.startswith(taskname))
+
+        cells = {}
+        all_metrics = set()
+        for dataname, details in results.items():
+            for metricname, val in details.items():
+                if metricname == "alias" or val in ["N/A", " "]:
+                    continue
+                assert isinstance(val, float), f"{dataname}.{metricname} = val"
+                metricname, _ = metricname.split(",")  # for some reason it is always acc,none so we remove the none.
+                all_metrics.add(metricname)
+                cells.setdefault(dataname, {})[metricname] = val
+        self.cells[key] = cells
+        self.names[key] = list(results)
+        self.sizes[key] = true_sizes
+        self.metrics[key] = all_metrics
+        self.subtasks[key] = subtasks
+
+    def changed(self, key: Hashable, other: Results) -> Optional[set[str]]:
+        """The names whose results or samples differ between `key` here and in `other`, None if everything might."""
+        names, other_names = set(self.names[key]), set(other.names[key])
+        if (self.metrics[key] != other.metrics[key] or  # Aggregated over every metric.
+                self.subtasks[key] != other.subtasks[key]):  # Members of the `subtasks_of` groups.
+            return None
+        changed = names ^ other_names
+        for mine, theirs in [(self.cells[key], other.cells[key]), (self.sizes[key], other.sizes[key])]:
+            changed.update(name for name in mine.keys() | theirs.keys() if mine.get(name) != theirs.get(name))
+        return changed
+
+
+def aggregate(results: Results, graph: Graph, previous: Optional[Results] = None,
+              previous_outputs: Optional[dict[Hashable, list[Outputs]]] = None
+              ) -> tuple[dict[Hashable, dict[str, float]], dict[Hashable, list[Outputs]]]:
+    """The log (`{task}/{metric}` -> value) of every key of `results`, and the aggregates written by each group.
+
+    The keys in `previous_outputs`, aggregated before from their results in `previous`, only recompute the groups
+    downstream of what changed since.
+    """
+    previous_outputs = {} if previous_outputs is None else previous_outputs
+    logs, outputs = {}, {}
+    for key, cells in results.cells.items():
+        log = {task: dict(details) for task, details in cells.items()}
+        members = graph.members(results.subtasks[key])
+        changed = results.changed(key, previous) if key in previous_outputs else None
+        dirty = None if changed is None else graph.downstream(changed, members)
+
+        outputs[key] = []
+        skipped = {}  # Family -> its members found / expected, of the families missing members.
+        for i, group in enumerate(graph.groups):
+            tasks = members[i]
+            if group.complete and len(tasks) == 0:  # `subtasks_of` not reported.
+                skipped[group.prefix] = "not evaluated"
+            elif group.complete and not log.keys() >= set(tasks):
+                found = [task for task in tasks if task in log]
+                skipped[group.prefix] = f"{len(found)}/{len(tasks)}"
+                if 0 < len(found) and len(tasks) - len(found) <= 5:
+                    skipped[group.prefix] += f" (missing {', '.join(task for task in tasks if task not in log)})"
+            if dirty is None or i in dirty:
+                group_outputs = _aggregate_group(key, log, group, tasks, results.metrics[key], results.sizes[key])
+            else:
+                group_outputs = previous_outputs[key][i]
+            for name, details in group_outputs.items():
+                log.setdefault(name, {}).update(details)
+            outputs[key].append(group_outputs)
+        if len(skipped) > 0:
+            print(f"WARNING! {key}: Not logging the families missing members (found/expected):",
+                  ", ".join(f"{prefix} {found}" for prefix, found in skipped.items()))
+        logs[key] = {f"{dataname}/{metric}": value for dataname, details in log.items()
+                     for metric, value in details.items()}
+    return logs, outputs
+
+
+def _aggregate_group(key: Hashable, log: dict[str, dict[str, float]], group: Group, tasks: list[str],
+                     all_metrics: set[str], true_sizes: dict[str, int]) -> Outputs:
+    outputs = collections.defaultdict(dict)
+    if group.complete and (len(tasks) == 0 or not log.keys() >= set(tasks)):  # Reported by `aggregate`.
+        return {}
+    if not log.keys() >= set(tasks):
+        if group.warn:
+            print(f"WARNING! {key}: Aggregation for", group.prefix, "not available. Missing:", sorted(set(tasks) - set(log)))
+        for metric in group.metrics if group.metrics is not None else ["acc"]:
+            if group.macro:
+                outputs[group.macro_name][metric] = INVALID_NUM
+            if group.micro:
+                outputs[group.micro_name][metric] = INVALID_NUM
+        return dict(outputs)
+
+    for metric in all_metrics:
+        if "stderr" in metric or group.metrics is not None and metric not in group.metrics:
+            continue
+        values = [log[taskname][metric] for taskname in tasks if metric in log[taskname]]
+        if len(values) > 0:
+            if group.macro:
+                outputs[group.macro_name][metric] = statistics.mean(values)
+            if group.micro:
+                sizes = [true_sizes[taskname] for taskname in tasks if metric in log[taskname]]
+                outputs[group.micro_name][metric] = sum(value*size for value, size in zip(values, sizes))/sum(sizes)
+    return dict(outputs)
+
+
+def get_stamp(path: Path) -> str:
+    stat = Path(path).stat()
+    return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+
+def read_results(path: Path) -> dict:
+    """What is aggregated of a harness `results.json`."""
+    with open(path) as f:
+        info = json.load(f)
+    return {"results": info["results"], "n-samples": info["n-samples"], "group_subtasks": info.get("group_subtasks", {})}
+
+
+@dataclasses.dataclass
+class State:
+    """What an iteration was last aggregated from and into."""
+    graph: str  # `Graph.key`.
+    files: dict[str, tuple[str, dict]]  # Results file -> its stamp and `read_results`.
+    outputs: list[Outputs]  # Of each group of the graph.
+
+
+class StateStore:
+    """The `State` of every aggregated iteration, in `state_dir(LOGS_ROOT)/aggregates.sqlite`."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(self.path, timeout=60)
+        self.db.execute("CREATE TABLE IF NOT EXISTS states (run TEXT NOT NULL, iteration INTEGER NOT NULL, "
+                        "state BLOB NOT NULL, PRIMARY KEY (run, iteration))")
+
+    @classmethod
+    def open(cls, logs_root: Path) -> StateStore:
+        return cls(state_dir(logs_root)/"aggregates.sqlite")
+
+    def close(self):
+        self.db.close()
+
+    def get(self, run: str, iteration: int) -> Optional[State]:
+        row = self.db.execute("SELECT state FROM states WHERE run = ? AND iteration = ?", (run, iteration)).fetchone()
+        if row is None:
+            return None
+        state = json.loads(zlib.decompress(row[0]))
+        return State(state["graph"], {path: tuple(file) for path, file in state["files"].items()}, state["outputs"])
+
+    def put(self, states: dict[tuple[str, int], State]):
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO states VALUES (?, ?, ?)",
+                                [(run, iteration, zlib.compress(json.dumps(dataclasses.asdict(state)).encode()))
+                                 for (run, iteration), state in states.items()])
@@ -0,0 +1,308 @@
+"""Bootstrap confidence intervals of the aggregates of `scripts/update_wandb.py`, from the per-sample logs.
+
+With `LOG_SAMPLES=true` the harness writes the scores of every document next to the results
+(`samples_{task}_{timestamp}.jsonl` for `results_{timestamp}.json`, or `.jsonl.zst` once compacted by `evals.samples`).
+Each samples file is read once into a compact array (a row per document, a column per metric), cached in
+`state_dir(LOGS_ROOT)/samples` by its mtime and size.
+The documents of every task are resampled independently (stratified), and the resampled task means are aggregated
+exactly like the point estimates (`evals.aggregate`), so every aggregate gets a percentile interval:
+`{aggregate}/{metric}_ci_low` and `{aggregate}/{metric}_ci_high`.
+A resample only changes how many times each distinct row of scores is drawn, so it is a multinomial draw over the
+distinct rows (a handful for 0/1 scores), which makes thousands of resamples take milliseconds per task.
+The previous evaluated iteration of the run is resampled in the same draws (paired by `doc_id`), giving the
+change of every aggregate since then with its interval: `{aggregate}/{metric}_delta`, `_delta_ci_low` and
+`_delta_ci_high` (the base iteration is logged as `Bootstrap/BaseOptStep`).
+Draws are seeded by task, so the intervals of an iteration only change when its samples do.
+Only the metrics whose mean over the samples is what the harness reported are resampled (e.g. not corpus-level
+metrics such as bleu), and aggregates with a member that has no samples get no interval.
+"""
+from __future__ import annotations
+
+import dataclasses
+import hashlib
+import json
+import math
+import os
+import tempfile
+import zlib
+from collections.abc import Hashable
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional
+
+from evals.aggregate import INVALID_NUM, Graph, Outputs, Results, get_stamp
+from evals.cache import state_dir
+from evals.samples import find_samples, iter_lines
+
+if TYPE_CHECKING:  # numpy is slow to import, only load it when actually bootstrapping.
+    import numpy as np
+
+
+CONFIDENCE = 0.95
+SEED = 0
+CHUNK = 2**22  # Maximum draws held in memory at once.
+NOT_METRICS = {"doc_id", "target"}  # Numbers of a sample that are not scores (if it doesn't list its `metrics`).
+
+Distributions = dict[str, "np.ndarray"]  # Metric -> its value in every resample.
+Deltas = dict[str, tuple[float, "np.ndarray"]]  # Metric -> change since the base, and in every resample.
+
+
+@dataclasses.dataclass
+class Samples:
+    doc_ids: np.ndarray  # Sorted.
+    metrics: list[str]
+    values: np.ndarray  # A row per document, a column per metric.
+
+
+def read_samples(path: Path) -> Optional[Samples]:
+    """The scores of a samples file, None if it can't be read (e.g. still being written)."""
+    import numpy as np
+
+    filters = {}  # Filter -> doc_id -> metric -> score.
+    try:
+        for line in iter_lines(path):
+            sample = json.loads(line)
+            names = sample.get("metrics", [name for name in sample if name not in NOT_METRICS])
+            scores = {name: float(sample[name]) for name in names if isinstance(sample.get(name), (bool, int, float))}
+            filters.setdefault(sample.get("filter", "none"), {})[sample["doc_id"]] = scores
+    except (json.JSONDecodeError, KeyError):
+        return None
+
+    # Every metric is taken from the last filter scoring it, as the last `{metric},{filter}` is the one aggregated.
+    chosen = {}
+    for name, docs in filters.items():
+        chosen.update(dict.fromkeys(set().union(*docs.values()), name))
+    metrics = sorted(chosen)
+    doc_ids = sorted(set.intersection(*[set(filters[name]) for name in set(chosen.values())])) if chosen else []
+    values = np.array([[filters[chosen[metric]][doc_id].get(metric, math.nan) for metric in metrics]
+                       for doc_id in doc_ids], dtype=np.float64).reshape(len(doc_ids), len(metrics))
+    complete = ~np.isnan(values).any(axis=1)
+    return Samples(np.array(doc_ids, dtype=np.int64)[complete], metrics, values[complete])
+
+
+def load_samples(path: Path, cache: Path) -> Optional[Samples]:
+    """`read_samples`, only reading `path` if it changed since it was cached in `cache`."""
+    import numpy as np
+
+    stamp = get_stamp(path)
+    cached = Path(cache)/f"{hashlib.sha256(str(Path(path).resolve()).encode()).hexdigest()[:16]}.npz"
+    if cached.exists():
+        with np.load(cached) as f:
+            if str(f["stamp"]) == stamp:
+                return Samples(f["doc_ids"], f["metrics"].tolist(), f["values"])
+    samples = read_samples(path)
+    if samples is not None:
+        cached.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=cached.parent, prefix=f".{cached.name}.")
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, stamp=stamp, doc_ids=samples.doc_ids, metrics=np.array(samples.metrics, dtype=str),
+                     values=samples.values)
+        os.replace(tmp, cached)
+    return samples
+
+
+class IterationSamples:
+    """The samples files of an iteration (loaded when needed) and the subtasks of its harness groups."""
+
+    def __init__(self, iter_dir: Path, cache: Path):
+        self.cache = cache
+        self.paths = {}  # Task -> samples file, the last shard writing it winning (as for the results).
+        self.subtasks = {}
+        for results_path in sorted(Path(iter_dir).glob("harness/eval_*/*/results*.json")):
+            timestamp = results_path.stem[len("results_"):]
+            self.paths.update(find_samples(results_path.parent, timestamp))
+            try:
+                with open(results_path) as f:
+                    self.subtasks.update(json.load(f).get("group_subtasks", {}))
+            except json.JSONDecodeError:
+                pass
+        self._loaded = {}
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def get(self, task: str) -> Optional[Samples]:
+        if task not in self._loaded:
+            self._loaded[task] = None if task not in self.paths else load_samples(self.paths[task], self.cache)
+        return self._loaded[task]
+
+    def leaves(self, name: str) -> Optional[list[str]]:
+        """The tasks with samples that make up `name` (itself or the subtasks of a group), None if some have none."""
+        if name in self.paths:
+            return [name]
+        if len(self.subtasks.get(name, [])) == 0:
+            return None
+        leaves = []
+        for subtask in self.subtasks[name]:
+            subtask_leaves = self.leaves(subtask)
+            if subtask_leaves is None:
+                return None
+            leaves += subtask_leaves
+        return leaves
+
+
+def resample_means(values: np.ndarray, resamples: int, rng: np.random.Generator) -> np.ndarray:
+    """The column means of `resamples` bootstrap resamples of the rows of `values`, one row per resample."""
+    import numpy as np
+
+    rows, counts = np.unique(values, axis=0, return_counts=True)
+    means = []
+    if len(rows) <= len(values)//4:  # Few distinct rows (e.g. 0/1 scores): how many times each one is drawn.
+        step = max(1, CHUNK//len(rows))
+        for start in range(0, resamples, step):
+            draws = rng.multinomial(len(values), counts/len(values), size=min(step, resamples - start))
+            means.append(draws@rows/len(values))
+    else:  # Mostly distinct rows (e.g. continuous scores): which rows are drawn.
+        step = max(1, CHUNK//len(values))
+        for start in range(0, resamples, step):
+            size = min(step, resamples - start)
+            draws = rng.integers(0, len(values), size=(size, len(values)))
+            draws += len(values)*np.arange(size)[:, None]
+            means.append(np.bincount(draws.ravel(), minlength=draws.size).reshape(size, -1)@values/len(values))
+    return np.concatenate(means)
+
+
+def draw_task(task: str, current: Samples, base: Optional[Samples], resamples: int,
+              seed: int = SEED) -> tuple[Distributions, Deltas]:
+    """The resampled means of every metric of `task`, and their changes since `base` (on the documents of both)."""
+    import numpy as np
+
+    rng = np.random.default_rng([seed, zlib.crc32(task.encode())])
+    if len(current.doc_ids) == 0 or len(current.metrics) == 0:
+        return {}, {}
+    shared = [] if base is None else [metric for metric in current.metrics if metric in base.metrics]
+    if len(shared) > 0:
+        _, mine, theirs = np.intersect1d(current.doc_ids, base.doc_ids, assume_unique=True, return_indices=True)
+        paired = np.hstack([current.values[mine][:, [current.metrics.index(metric) for metric in shared]],
+                            base.values[theirs][:, [base.metrics.index(metric) for metric in shared]]])
+    if len(shared) == 0 or len(mine) == 0:
+        means = resample_means(current.values, resamples, rng)
+        return dict(zip(current.metrics, means.T)), {}
+
+    if len(mine) == len(current.doc_ids):  # Both from the same draws.
+        means = resample_means(np.hstack([current.values, paired[:, len(shared):]]), resamples, rng)
+        current_means = means[:, :len(current.metrics)]
+        paired_means = np.hstack([current_means[:, [current.metrics.index(metric) for metric in shared]],
+                                  means[:, len(current.metrics):]])
+    else:
+        current_means = resample_means(current.values, resamples, rng)
+        paired_means = resample_means(paired, resamples, rng)
+    points = paired.mean(axis=0)
+    deltas = {metric: (float(points[j] - points[len(shared) + j]),
+                       paired_means[:, j] - paired_means[:, len(shared) + j]) for j, metric in enumerate(shared)}
+    return dict(zip(current.metrics, current_means.T)), deltas
+
+
+def _isclose(a: float, b: float) -> bool:
+    return math.isclose(a, b, rel_tol=1e-6, abs_tol=1e-9)
+
+
+def _combine(weights: list[float], parts: list[np.ndarray]) -> np.ndarray:
+    return sum(weight*part for weight, part in zip(weights, parts))/sum(weights)
+
+
+def _draw_member(name: str, reported: dict[str, float], current: IterationSamples, base: Optional[IterationSamples],
+                 resamples: int, draws: dict[str, tuple[Distributions, Deltas]]) -> tuple[Distributions, Deltas]:
+    """The resampled results of `name` (a task or a harness group) for the metrics whose reported value they match."""
+    leaves = current.leaves(name)
+    if leaves is None or any(current.get(leaf) is None for leaf in leaves):
+        return {}, {}
+    for leaf in leaves:
+        if leaf not in draws:
+            draws[leaf] = draw_task(leaf, current.get(leaf), None if base is None else base.get(leaf), resamples)
+    dists, deltas = {}, {}
+    for metric, value in reported.items():
+        if not all(metric in draws[leaf][0] for leaf in leaves):
+            continue
+        # A harness group is the mean of its subtasks, weighted by their samples or not.
+        sizes = [len(current.get(leaf).doc_ids) for leaf in leaves]
+        points = [float(current.get(leaf).values[:, current.get(leaf).metrics.index(metric)].mean()) for leaf in leaves]
+        for weights in [sizes, [1]*len(leaves)]:
+            if _isclose(_combine(weights, points), value):
+                dists[metric] = _combine(weights, [draws[leaf][0][metric] for leaf in leaves])
+                if all(metric in draws[leaf][1] for leaf in leaves):
+                    deltas[metric] = (_combine(weights, [draws[leaf][1][metric][0] for leaf in leaves]),
+                                      _combine(weights, [draws[leaf][1][metric][1] for leaf in leaves]))
+                break
+    return dists, deltas
+
+
+def get_base(iterations: dict[int, Path], iteration: int, cache: Path) -> tuple[Optional[int], Optional[IterationSamples]]:
+    """The last iteration before `iteration` with samples, and its samples."""
+    for it in sorted((it for it in iterations if it < iteration), reverse=True):
+        samples = IterationSamples(iterations[it], cache)
+        if len(samples) > 0:
+            return it, samples
+    return None, None
+
+
+def confidence_intervals(logs_root: Path, results: Results, graph: Graph, outputs: dict[Hashable, list[Outputs]],
+                         iterations: dict[str, dict[int, Path]], resamples: int,
+                         confidence: float = CONFIDENCE) -> dict[Hashable, dict[str, float]]:
+    """The intervals to log for every `(run, iteration)` key of `results`, aggregated by `graph` into `outputs`.
+
+    `iterations` are the iteration directories of every run, where the samples (and those of the bases) are found.
+    """
+    import numpy as np
+
+    cache = state_dir(logs_root)/"samples"
+    quantiles = [100*(1 - confidence)/2, 100*(1 + confidence)/2]
+    intervals = {}
+    for key in outputs:
+        run, iteration = key
+        current = IterationSamples(iterations[run][iteration], cache)
+        if len(current) == 0:
+            continue
+        base_iteration, base = get_base(iterations[run], iteration, cache)
+        log = {task: dict(details) for task, details in results.cells[key].items()}
+        members = graph.members(results.subtasks[key])
+
+        # Distributions of the results and aggregates, as `log` holds their values when each group is aggregated.
+        draws = {}
+        drawn_members = {}
+        aggregated = {}  # (name, metric) -> distribution and delta of what the groups so far wrote (None if they have none).
+
+        def get(name: str, metric: str) -> tuple[Optional[np.ndarray], Optional[tuple[float, np.ndarray]]]:
+            if (name, metric) in aggregated:
+                return aggregated[name, metric] or (None, None)
+            if name not in drawn_members:
+                drawn_members[name] = _draw_member(name, results.cells[key].get(name, {}), current, base,
+                                                   resamples, draws)
+            return drawn_members[name][0].get(metric), drawn_members[name][1].get(metric)
+
+        values = {}
+        for i, group in enumerate(graph.groups):
+            tasks = members[i]
+            computed = {}
+            for name, details in outputs[key][i].items():
+                for metric, value in details.items():
+                    computed[name, metric] = None
+                    if value == INVALID_NUM:
+                        continue
+                    present = [task for task in tasks if metric in log.get(task, {})]
+                    parts = [get(task, metric) for task in present]
+                    if len(parts) == 0 or any(dist is None for dist, _ in parts):
+                        continue
+                    weights = [1]*len(parts) if name == group.macro_name else [results.sizes[key][task] for task in present]
+                    delta = None
+                    if all(part_delta is not None for _, part_delta in parts):
+                        delta = (_combine(weights, [point for _, (point, _) in parts]),
+                                 _combine(weights, [dist for _, (_, dist) in parts]))
+                    computed[name, metric] = _combine(weights, [dist for dist, _ in parts]), delta
+            for (name, metric), drawn in computed.items():
+                log.setdefault(name, {})[metric] = outputs[key][i][name][metric]
+                aggregated[name, metric] = drawn
+                if drawn is None:
+                    continue
+                dist, delta = drawn
+                low, high = np.percentile(dist, quantiles)
+                values[f"{name}/{metric}_ci_low"] = float(low)
+                values[f"{name}/{metric}_ci_high"] = float(high)
+                if delta is not None:
+                    low, high = np.percentile(delta[1], quantiles)
+                    values[f"{name}/{metric}_delta"] = float(delta[0])
+                    values[f"{name}/{metric}_delta_ci_low"] = float(low)
+                    values[f"{name}/{metric}_delta_ci_high"] = float(high)
+        if len(values) > 0 and base_iteration is not None:
+            values["Bootstrap/BaseOptStep"] = base_iteration
+        intervals[key] = values
+    return intervals
@@ -0,0 +1,135 @@
+"""Small persistent caches shared by the evaluation scripts.
+
+Everything lives under `EVALS_CACHE_DIR` (default `$XDG_CACHE_HOME/evals`, i.e. `~/.cache/evals`).
+Set `EVALS_OFFLINE=1` (or `HF_HUB_OFFLINE=1`) to never hit the network and rely on whatever is cached.
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+
+DEFAULT_TTL = 7*24*60*60  # One week, dataset metadata rarely changes.
+
+
+def cache_dir() -> Path:
+    if "EVALS_CACHE_DIR" in os.environ:
+        return Path(os.environ["EVALS_CACHE_DIR"])
+    return Path(os.environ.get("XDG_CACHE_HOME", Path.home()/".cache"))/"evals"
+
+
+def state_dir(logs_root: Path) -> Path:
+    """Directory for the automation state derived from a `LOGS_ROOT` (kept out of it so it only contains model logs)."""
+    key = hashlib.sha256(str(Path(logs_root).resolve()).encode()).hexdigest()[:16]
+    return cache_dir()/"state"/key
+
+
+def is_offline() -> bool:
+    flag = os.environ.get("EVALS_OFFLINE", os.environ.get("HF_HUB_OFFLINE", "0"))
+    return flag.lower() in {"1", "true", "yes"}
+
+
+def write_json(path: Path, obj: Any, indent: Optional[int] = None):
+    """Atomically (over)writes `path`, so concurrent readers never see a partial file."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    with os.fdopen(fd, "w") as f:
+        json.dump(obj, f, indent=indent)
+    os.replace(tmp, path)
+
+
+class JsonCache:
+    """A key->value store persisted as a single json file.
+
+    Entries older than `ttl` seconds are considered stale but are kept around,
+    so they can still be used as a fallback when offline or when a refresh fails.
+    Writes are atomic and merge with whatever other processes saved in the meantime.
+    """
+
+    def __init__(self, path: Path, ttl: float = DEFAULT_TTL):
+        self.path = Path(path)
+        self.ttl = ttl
+        self._entries: Optional[dict[str, dict]] = None
+        self._dirty: set[str] = set()
+        self._lock = threading.Lock()
+
+    @property
+    def entries(self) -> dict[str, dict]:
+        if self._entries is None:
+            self._entries = self._read()
+        return self._entries
+
+    def _read(self) -> dict[str, dict]:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def is_fresh(self, key: str) -> bool:
+        return key in self.entries and time.time() - self.entries[key]["time"] < self.ttl
+
+    def get(self, key: str, allow_stale: bool = False) -> Optional[Any]:
+        if self.is_fresh(key) or (allow_stale and key in self.entries):
+            return self.entries[key]["value"]
+        return None
+
+    def put(self, key: str, value: Any):
+        with self._lock:
+            self.entries[key] = {"time": time.time(), "value": value}
+            self._dirty.add(key)
+
+    def invalidate(self, keys: Optional[list[str]] = None):
+        with self._lock:
+            if keys is None:
+                self._entries = {}
+                self._dirty.clear()
+                self.path.unlink(missing_ok=True)
+                return
+            on_disk = self._read()
+            for key in keys:
+                self.entries.pop(key, None)
+                on_disk.pop(key, None)
+                self._dirty.discard(key)
+            self._write(on_disk)
+
+    def save(self):
+        with self._lock:
+            if len(self._dirty) == 0:
+                return
+            merged = self._read()
+            merged.update({key: self.entries[key] for key in self._dirty})
+            self._write(merged)
+            self._entries = merged
+            self._dirty.clear()
+
+    def _write(self, entries: dict[str, dict]):
+        write_json(self.path, entries)
+
+
+def main(clear: bool, keys: list[str]):
+    from evals.tasks import DATASET_INFO
+
+    if clear:
+        DATASET_INFO.invalidate(keys if len(keys) > 0 else None)
+        print("Invalidated", ", ".join(keys) if len(keys) > 0 else DATASET_INFO.path)
+        return
+    print("Cache:", DATASET_INFO.path)
+    for key, entry in sorted(DATASET_INFO.entries.items()):
+        age = (time.time() - entry["time"])/3600
+        print(f"{key}: {age:.1f}h old{'' if DATASET_INFO.is_fresh(key) else ' (stale)'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or invalidate the dataset metadata cache.")
+    parser.add_argument("--clear", action="store_true", help="Invalidate the given keys (all of them if none given).")
+    parser.add_argument("keys", nargs="*", default=[])
+    main(**vars(parser.parse_args()))
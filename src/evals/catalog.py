@@ -0,0 +1,178 @@
+"""Compiled, indexed view of `configs/all_tasks.json`.
+
+Building the task list requires dataset size inference, language lookups and dimension inference.
+`TaskCatalog.load` does that once and stores the result in a lockfile next to the config
+(`configs/all_tasks.lock.json`), which is reused as long as the config does not change.
+Regenerate it explicitly with `python -m evals.catalog`.
+"""
+from __future__ import annotations
+
+import argparse
+import collections
+import dataclasses
+import hashlib
+import json
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+from typing import Optional
+
+from evals.cache import write_json
+from evals.tasks import Dimension, Language, Task, TaskKind, build_tasks
+
+
+LOCK_VERSION = 2
+DEFAULT_CONFIG = Path("configs/all_tasks.json")
+
+_LOADED: dict[str, TaskCatalog] = {}  # Memoized catalogs, keyed by their config hash.
+
+
+def get_lock_path(all_tasks_json: Path) -> Path:
+    return all_tasks_json.with_suffix(".lock.json")
+
+
+def get_group(task: Task) -> str:
+    """The family a task belongs to, e.g. `arc` for `arc_de` or `include_base_44` for `include_base_44_german`."""
+    chunks = task.name.split("_")
+    if len(chunks) > 1 and chunks[-1].lower() in {task.language.pt1, task.language.pt3, task.language.name.lower()}:
+        return "_".join(chunks[:-1])
+    return task.name
+
+
+class TaskCatalog:
+    """All tasks known to the evaluation pipeline, with O(1) lookups by the fields we filter on."""
+
+    def __init__(self, tasks: list[Task], version: str, groups: Optional[dict[str, str]] = None):
+        self.tasks = tuple(tasks)
+        self.version = version
+        self.groups = {task.name: get_group(task) for task in tasks} if groups is None else groups
+        self._position = {task.name: i for i, task in enumerate(self.tasks)}
+
+        self.by_name = {task.name: task for task in self.tasks}
+        by_kind = collections.defaultdict(list)
+        by_language = collections.defaultdict(list)
+        by_dimension = collections.defaultdict(list)
+        by_group = collections.defaultdict(list)
+        self.by_alias = {}
+        for task in self.tasks:
+            for kind in task.kinds:
+                by_kind[kind].append(task)
+            by_language[task.language.pt3].append(task)
+            by_dimension[task.dimension].append(task)
+            by_group[self.groups[task.name]].append(task)
+            for alias in task.alias:
+                self.by_alias[alias] = task
+        self.by_kind = {key: tuple(value) for key, value in by_kind.items()}
+        self.by_language = {key: tuple(value) for key, value in by_language.items()}
+        self.by_dimension = {key: tuple(value) for key, value in by_dimension.items()}
+        self.by_group = {key: tuple(value) for key, value in by_group.items()}
+
+    def __iter__(self) -> Iterator[Task]:
+        return iter(self.tasks)
+
+    def __len__(self) -> int:
+        return len(self.tasks)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.by_name or name in self.by_alias
+
+    def get(self, name: str) -> Task:
+        """Gets a task by its name or by one of its aliases."""
+        if name in self.by_name:
+            return self.by_name[name]
+        return self.by_alias[name]
+
+    @property
+    def languages(self) -> list[str]:
+        return sorted(self.by_language)
+
+    @property
+    def dimensions(self) -> list[Dimension]:
+        return sorted(self.by_dimension)
+
+    def select(self, kind: Optional[str | Iterable[str]] = None,
+               language: Optional[str | Iterable[str]] = None,
+               dimension: Optional[str | Iterable[str]] = None,
+               group: Optional[str | Iterable[str]] = None) -> list[Task]:
+        """Tasks matching all the given filters, in catalog order.
+
+        Each filter can be a single value or a collection of values (matching any of them).
+        """
+        selected = None
+        for index, values in [(self.by_kind, kind), (self.by_language, language),
+                              (self.by_dimension, dimension), (self.by_group, group)]:
+            if values is None:
+                continue
+            values = [values] if isinstance(values, str) else values
+            matches = {task.name for value in values for task in index.get(value, ())}
+            selected = matches if selected is None else selected & matches
+        if selected is None:
+            return list(self.tasks)
+        return [self.by_name[name] for name in sorted(selected, key=self._position.__getitem__)]
+
+    def result_names(self, tasks: Optional[Iterable[Task]] = None) -> list[str]:
+        """Names reported by the harness for the given tasks (all of them by default)."""
+        return [name for task in (self.tasks if tasks is None else tasks) for name in task.result_names]
+
+    def to_lock(self) -> dict:
+        rows = [{"name": task.name, "kinds": list(task.kinds), "size": task.size,
+                 "language": dataclasses.asdict(task.language), "dimension": task.dimension,
+                 "alias": list(task.alias), "group": self.groups[task.name]}
+                for task in self.tasks]
+        return {"lock_version": LOCK_VERSION, "version": self.version, "tasks": rows}
+
+    @classmethod
+    def from_lock(cls, lock: dict) -> TaskCatalog:
+        tasks = [Task(name=row["name"],
+                      kinds=tuple(TaskKind(kind) for kind in row["kinds"]),
+                      size=row["size"],
+                      language=Language(**row["language"]),
+                      dimension=Dimension(row["dimension"]),
+                      alias=tuple(row["alias"]))
+                 for row in lock["tasks"]]
+        return cls(tasks, lock["version"], {row["name"]: row["group"] for row in lock["tasks"]})
+
+    @classmethod
+    def compile(cls, all_tasks_json: Path = DEFAULT_CONFIG, write: bool = True) -> TaskCatalog:
+        """Builds the catalog from scratch and (optionally) stores its lockfile."""
+        with open(all_tasks_json, "rb") as f:
+            content = f.read()
+        catalog = cls(build_tasks(json.loads(content)), hashlib.sha256(content).hexdigest())
+        if write:
+            lock_path = get_lock_path(all_tasks_json)
+            try:
+                write_json(lock_path, catalog.to_lock(), indent=1)
+            except OSError as err:  # E.g. read-only checkouts, the catalog is still usable.
+                print(f"WARNING! Could not write {lock_path}: {err}")
+        return catalog
+
+    @classmethod
+    def load(cls, all_tasks_json: Path = DEFAULT_CONFIG) -> TaskCatalog:
+        """Loads the catalog from its lockfile, recompiling it when `all_tasks_json` changed."""
+        with open(all_tasks_json, "rb") as f:
+            version = hashlib.sha256(f.read()).hexdigest()
+        if version in _LOADED:
+            return _LOADED[version]
+
+        try:
+            with open(get_lock_path(all_tasks_json)) as f:
+                lock = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            lock = None
+        if lock is not None and lock.get("lock_version") == LOCK_VERSION and lock["version"] == version:
+            catalog = cls.from_lock(lock)
+        else:
+            catalog = cls.compile(all_tasks_json)
+        _LOADED[version] = catalog
+        return catalog
+
+
+def main(config: Path):
+    catalog = TaskCatalog.compile(config)
+    print(f"Compiled {len(catalog)} tasks ({len(catalog.by_group)} groups, {len(catalog.languages)} languages) "
+          f"into {get_lock_path(config)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile the task catalog lockfile.")
+    parser.add_argument("--config", type=Path, default=DEFAULT_CONFIG)
+    main(**vars(parser.parse_args()))
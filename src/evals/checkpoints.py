@@ -0,0 +1,120 @@
+"""Cache of converted (megatron->huggingface) checkpoints.
+
+A checkpoint is converted once per (model, iteration) by `scripts/materialize.sbatch` and then shared by all the
+evaluation shards of that iteration. Entries are directories named `{name}_it{it}_{key}`, where `key` fingerprints
+the megatron checkpoint contents and the tokenizer, so a different checkpoint with the same iteration is never reused.
+An entry is only valid once its `.complete` marker exists (written last, together with its size in bytes),
+and the mtime of the marker is its last use (touched by every evaluation job), used for the LRU eviction.
+Run `python -m evals.checkpoints $HF_STORAGE_DIR` to list a cache and `--quota-gb` to evict from it.
+"""
+from __future__ import annotations
+
+import argparse
+import dataclasses
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+
+MARKER = ".complete"
+PARTIAL_SUFFIX = ".partial"
+
+
+@dataclasses.dataclass
+class Entry:
+    path: Path
+    name: str
+    it: int
+    key: str
+    size: int  # Bytes.
+    last_used: float
+
+
+def get_key(checkpoint: Path, tokenizer: str) -> str:
+    """Fingerprint of a megatron `iter_*` directory (file names and sizes) and the tokenizer it is converted with."""
+    digest = hashlib.sha256(tokenizer.encode())
+    for root, dirs, files in os.walk(checkpoint):
+        dirs.sort()
+        for fname in sorted(files):
+            path = Path(root)/fname
+            digest.update(f"{path.relative_to(checkpoint)}:{path.stat().st_size}\n".encode())
+    return digest.hexdigest()[:12]
+
+
+def get_entry_name(name: str, it: int, key: str) -> str:
+    return f"{name}_it{it}_{key}"
+
+
+def read_entry(path: Path) -> Optional[Entry]:
+    """The cache entry at `path`, None if it is not a complete entry."""
+    rmatch = re.match("^(.*)_it([0-9]+)_([0-9a-f]+)$", path.name)
+    marker = path/MARKER
+    if rmatch is None or not marker.exists():
+        return None
+    with open(marker) as f:
+        info = json.load(f)
+    name, it, key = rmatch.groups()
+    return Entry(path=path, name=name, it=int(it), key=key, size=info.get("bytes", 0),
+                 last_used=marker.stat().st_mtime)
+
+
+def list_entries(root: Path) -> list[Entry]:
+    if not Path(root).exists():
+        return []
+    entries = [read_entry(path) for path in Path(root).iterdir() if path.is_dir()]
+    return [entry for entry in entries if entry is not None]
+
+
+def lookup(roots: list[Path], entry_name: str) -> Optional[Path]:
+    """Path of the complete entry named `entry_name` in the first of `roots` that has it."""
+    for root in roots:
+        path = Path(root)/entry_name
+        if (path/MARKER).exists():
+            return path
+    return None
+
+
+def touch(path: Path):
+    (Path(path)/MARKER).touch()
+
+
+def evict(root: Path, quota: float, in_use: Callable[[Entry], bool] = lambda entry: False) -> list[Entry]:
+    """Removes the least recently used entries of `root` until they take less than `quota` bytes.
+
+    Entries for which `in_use` is true are never removed. Returns the removed entries.
+    """
+    entries = sorted(list_entries(root), key=lambda entry: entry.last_used)
+    total = sum(entry.size for entry in entries)
+    removed = []
+    for entry in entries:
+        if total <= quota:
+            break
+        if in_use(entry):
+            continue
+        print("Removing", entry.path, f"({entry.size/1e9:.1f}GB, last used {(time.time() - entry.last_used)/3600:.1f}h ago)")
+        shutil.rmtree(entry.path)
+        total -= entry.size
+        removed.append(entry)
+    return removed
+
+
+def main(root: Path, quota_gb: Optional[float]):
+    if quota_gb is not None:
+        evict(root, quota_gb*1e9)
+    entries = sorted(list_entries(root), key=lambda entry: entry.last_used, reverse=True)
+    for entry in entries:
+        age = (time.time() - entry.last_used)/3600
+        print(f"{entry.path.name}: {entry.size/1e9:.1f}GB, last used {age:.1f}h ago")
+    print(f"Total: {len(entries)} checkpoints, {sum(entry.size for entry in entries)/1e9:.1f}GB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect (and evict from) a converted checkpoints cache.")
+    parser.add_argument("root", type=Path)
+    parser.add_argument("--quota-gb", type=float, help="Evict least recently used checkpoints down to this size.")
+    main(**vars(parser.parse_args()))
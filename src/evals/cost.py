@@ -0,0 +1,203 @@
+"""Per-task runtime cost model.
+
+Predicts the seconds needed to evaluate a task given the model size (in billions) and backend (`hf` or `vllm`).
+Rates (seconds per row) are fitted from the harness outputs already in `LOGS_ROOT`: every `results*.json`
+tells us the evaluation time of a job, and its `n-samples` how many rows each of its tasks had.
+The job time is split across its tasks proportionally to the current rate estimates until convergence
+(multiplicative updates of a non-negative least squares fit), which also handles tasks that are always evaluated together.
+Unobserved sizes are extrapolated linearly in parameters from the closest observed size, unobserved tasks fall back
+to the historical rule of thumb of 9h for a 70B model over all tasks.
+Evaluations packed on a single GPU (harness outputs `eval_{job}_{slot}`, see `evals.packs`) are fitted separately
+under the backend `{backend}/1gpu`, which falls back to the same GPU-hours as a whole node until observed.
+Refit the model with `python -m evals.cost --logs-root $LOGS_ROOT --config configs/automation.json`.
+"""
+from __future__ import annotations
+
+import argparse
+import collections
+import dataclasses
+import json
+import math
+import re
+import time
+from pathlib import Path
+from typing import Optional
+
+from evals.cache import state_dir, write_json
+from evals.catalog import TaskCatalog
+from evals.tasks import Task
+
+
+PRIOR_SECONDS_PER_ROW_PER_B = 9*60*60/794_148/70  # A 70B model needs ~9h for all tasks (794k rows).
+DEFAULT_BACKEND = "hf"
+GPUS_PER_NODE = 4
+
+
+def get_backend_key(backend: str, gpus: int = GPUS_PER_NODE) -> str:
+    return backend if gpus == GPUS_PER_NODE else f"{backend}/{gpus}gpu"
+
+
+@dataclasses.dataclass
+class Observation:
+    backend: str
+    size: float
+    seconds: float
+    rows: dict[str, int]  # task name -> number of rows evaluated.
+
+
+@dataclasses.dataclass
+class CostModel:
+    rates: dict[str, dict[float, dict[str, float]]] = dataclasses.field(default_factory=dict)  # backend -> size -> task -> s/row.
+    fitted_at: float = 0.0
+
+    def rate(self, name: str, size: float, backend: str = DEFAULT_BACKEND) -> float:
+        """Seconds per row of task `name`."""
+        by_size = self.rates.get(backend, {})
+        if name in by_size.get(size, {}):
+            return by_size[size][name]
+        observed = [(other_size, rates[name]) for other_size, rates in by_size.items() if name in rates]
+        if len(observed) > 0:
+            other_size, rate = min(observed, key=lambda t: abs(math.log(t[0]/size)))
+            return rate*size/other_size
+        if "/" in backend:  # Fewer GPUs than a node, assume the work scales linearly with them.
+            base, gpus = backend.split("/")
+            return self.rate(name, size, base)*GPUS_PER_NODE/int(gpus[:-len("gpu")])
+        return PRIOR_SECONDS_PER_ROW_PER_B*size
+
+    def predict(self, task: Task, size: float, backend: str = DEFAULT_BACKEND) -> float:
+        """Predicted seconds to evaluate `task`."""
+        return self.rate(task.name, size, backend)*task.size
+
+    def to_json(self) -> dict:
+        return {"fitted_at": self.fitted_at,
+                "rates": {backend: {str(size): rates for size, rates in by_size.items()}
+                          for backend, by_size in self.rates.items()}}
+
+    @classmethod
+    def from_json(cls, info: dict) -> CostModel:
+        return cls(rates={backend: {float(size): rates for size, rates in by_size.items()}
+                          for backend, by_size in info["rates"].items()},
+                   fitted_at=info["fitted_at"])
+
+    def save(self, path: Path):
+        write_json(path, self.to_json(), indent=1)
+
+    @classmethod
+    def load(cls, path: Path) -> CostModel:
+        try:
+            with open(path) as f:
+                return cls.from_json(json.load(f))
+        except FileNotFoundError:
+            return cls()
+
+
+def get_cost_model_path(logs_root: Path) -> Path:
+    return state_dir(logs_root)/"cost_model.json"
+
+
+def _leaves(name: str, group_subtasks: dict[str, list[str]]) -> list[str]:
+    if name not in group_subtasks or len(group_subtasks[name]) == 0:
+        return [name]
+    return [leaf for subtask in group_subtasks[name] for leaf in _leaves(subtask, group_subtasks)]
+
+
+def read_observation(info: dict, size: float, catalog: TaskCatalog, gpus: int = GPUS_PER_NODE) -> Optional[Observation]:
+    """Gets the observation of a single harness `results*.json`, None if it has no timing information."""
+    try:
+        seconds = float(info.get("total_evaluation_time_seconds", 0))
+    except ValueError:
+        return None
+    if seconds <= 0 or "n-samples" not in info:
+        return None
+
+    # Map every leaf subtask to the catalog task it belongs to (leaves not in the catalog are their own task).
+    group_subtasks = info.get("group_subtasks", {})
+    owner = {}
+    for task in catalog:
+        for name in task.result_names:
+            for leaf in _leaves(name, group_subtasks):
+                owner[leaf] = task.name
+    rows = collections.Counter()
+    for leaf, details in info["n-samples"].items():
+        rows[owner.get(leaf, leaf)] += details["effective"]
+    rows = {name: n for name, n in rows.items() if n > 0}
+    if len(rows) == 0:
+        return None
+    backend = get_backend_key(info.get("config", {}).get("model", DEFAULT_BACKEND), gpus)
+    return Observation(backend=backend, size=size, seconds=seconds, rows=rows)
+
+
+def collect_observations(logs_root: Path, sizes: dict[str, float], catalog: TaskCatalog) -> list[Observation]:
+    observations = []
+    for path in Path(logs_root).glob("*/iter_*/harness/eval_*/*/results*.json"):
+        name = path.parents[4].name
+        if re.match("^iter_[0-9]+$", path.parents[3].name) is None:
+            continue
+        with open(path) as f:
+            info = json.load(f)
+        gpus = 1 if re.match("^eval_[0-9]+_[0-9]+$", path.parents[1].name) is not None else GPUS_PER_NODE
+        observation = read_observation(info, sizes.get(name, 1), catalog, gpus)
+        if observation is not None:
+            observations.append(observation)
+    return observations
+
+
+def fit(observations: list[Observation], iterations: int = 100) -> CostModel:
+    groups = collections.defaultdict(list)
+    for observation in observations:
+        groups[observation.backend, observation.size].append(observation)
+
+    model = CostModel(fitted_at=time.time())
+    for (backend, size), group in groups.items():
+        rates = {name: PRIOR_SECONDS_PER_ROW_PER_B*size for observation in group for name in observation.rows}
+        for _ in range(iterations):
+            allocated = collections.defaultdict(float)
+            total_rows = collections.defaultdict(int)
+            for observation in group:
+                predicted = sum(rates[name]*n for name, n in observation.rows.items())
+                for name, n in observation.rows.items():
+                    allocated[name] += observation.seconds*rates[name]*n/predicted
+                    total_rows[name] += n
+            rates = {name: allocated[name]/total_rows[name] for name in rates}
+        model.rates.setdefault(backend, {})[size] = rates
+    return model
+
+
+def get_cost_model(logs_root: Path, sizes: dict[str, float], catalog: TaskCatalog,
+                   max_age: float = 24*60*60) -> CostModel:
+    """Loads the cost model of `logs_root`, refitting it if it is older than `max_age` seconds."""
+    path = get_cost_model_path(logs_root)
+    model = CostModel.load(path)
+    if time.time() - model.fitted_at > max_age:
+        print("Refitting cost model from", logs_root)
+        model = fit(collect_observations(logs_root, sizes, catalog))
+        model.save(path)
+    return model
+
+
+def get_sizes(automation_cfg: dict) -> dict[str, float]:
+    """Model name -> size mapping of an automation config (size defaults to 1 as in `evaluate.sbatch`)."""
+    return {name: model.get("size", 1) for name, model in automation_cfg["models"].items()}
+
+
+def main(logs_root: Path, config: Path, all_tasks: Path):
+    with open(config) as f:
+        sizes = get_sizes(json.load(f))
+    catalog = TaskCatalog.load(all_tasks)
+    observations = collect_observations(logs_root, sizes, catalog)
+    model = fit(observations)
+    model.save(get_cost_model_path(logs_root))
+    print(f"Fitted cost model from {len(observations)} harness runs, saved to {get_cost_model_path(logs_root)}")
+    for backend, by_size in sorted(model.rates.items()):
+        for size, rates in sorted(by_size.items()):
+            hours = sum(model.predict(task, size, backend) for task in catalog)/3600
+            print(f"{backend} {size}B: {len(rates)} tasks observed, all tasks take ~{hours:.1f}h")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fit the per-task runtime cost model.")
+    parser.add_argument("--logs-root", type=Path, required=True)
+    parser.add_argument("--config", type=Path, default=Path("configs/automation.json"),
+                        help="Automation config, used to get the size of each model.")
+    parser.add_argument("--all-tasks", type=Path, default=Path("configs/all_tasks.json"))
+    main(**vars(parser.parse_args()))
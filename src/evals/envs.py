@@ -0,0 +1,194 @@
+"""Cache of prebuilt evaluation environments.
+
+Instead of installing the harness, transformers and `EXTRA_PIPS` in every job, evaluations activate a virtualenv
+built once on shared storage (`envs_dir` of the automation config, `ENVS_DIR` of the jobs).
+Environments are directories `{ENVS_DIR}/{key}`, where `key` fingerprints the container, the harness and
+transformers commits and the extra pips, so a new commit on a branch gets a new environment and one in use is
+never modified. They are built on top of the container (`--system-site-packages`, so the build has to run inside it)
+under a lock, so concurrent jobs wait for the first one and then reuse it.
+An environment is only valid once its `.complete` marker exists (written last, with what it was built from),
+and the mtime of the marker is its last use (touched by every job), used to garbage collect the unused ones.
+Run `python -m evals.envs $ENVS_DIR` to list them, `--gc-days N` to remove the ones unused for N days
+and `--build ...` (inside the container, e.g. with `srun --environment=...`) to prebuild one.
+"""
+from __future__ import annotations
+
+import argparse
+import dataclasses
+import fcntl
+import hashlib
+import json
+import re
+import shlex
+import shutil
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+
+MARKER = ".complete"
+LOCK_SUFFIX = ".lock"
+
+
+@dataclasses.dataclass
+class Spec:
+    """What an environment is built from, commits already resolved."""
+    container: str  # Fingerprint of the container description (or its name if it can't be read).
+    harness_fork: str
+    harness_commit: str
+    transformers_path: str  # Local checkout, empty to keep the transformers of the container.
+    transformers_commit: str  # With a `+{diff hash}` suffix if the checkout has uncommitted changes.
+    extra_pips: str
+
+
+@dataclasses.dataclass
+class Entry:
+    path: Path
+    key: str
+    spec: dict
+    last_used: float
+
+
+def get_container_id(container: str) -> str:
+    try:
+        return hashlib.sha256(Path(container).read_bytes()).hexdigest()[:16]
+    except OSError:
+        return container
+
+
+def resolve_commit(repo: str, ref: Optional[str] = None) -> str:
+    """Commit `ref` of the remote `repo`, or the checked out commit of a local `repo` when `ref` is None."""
+    if ref is None:
+        commit = subprocess.run(["git", "-C", repo, "rev-parse", "HEAD"], capture_output=True, text=True,
+                                check=True).stdout.strip()
+        diff = subprocess.run(["git", "-C", repo, "diff", "HEAD"], capture_output=True, check=True).stdout
+        return commit if len(diff) == 0 else f"{commit}+{hashlib.sha256(diff).hexdigest()[:12]}"
+    if re.match("^[0-9a-f]{40}$", ref):
+        return ref
+    lines = subprocess.run(["git", "ls-remote", repo, ref], capture_output=True, text=True,
+                           check=True).stdout.splitlines()
+    commits = {line.split()[1]: line.split()[0] for line in lines}
+    for name in [f"refs/heads/{ref}", f"refs/tags/{ref}^{{}}", f"refs/tags/{ref}", ref]:
+        if name in commits:
+            return commits[name]
+    raise ValueError(f"{ref} not found in {repo}")
+
+
+def get_spec(container: str, harness_fork: str, harness_branch: str, transformers_path: str = "",
+             extra_pips: str = "") -> Spec:
+    return Spec(container=get_container_id(container),
+                harness_fork=harness_fork,
+                harness_commit=resolve_commit(harness_fork, harness_branch),
+                transformers_path=transformers_path,
+                transformers_commit=resolve_commit(transformers_path) if transformers_path != "" else "",
+                extra_pips=" ".join(sorted(shlex.split(extra_pips))))
+
+
+def get_key(spec: Spec) -> str:
+    return hashlib.sha256(json.dumps(dataclasses.asdict(spec), sort_keys=True).encode()).hexdigest()[:16]
+
+
+def read_entry(path: Path) -> Optional[Entry]:
+    """The environment at `path`, None if it is not a complete one."""
+    marker = Path(path)/MARKER
+    if not marker.exists():
+        return None
+    with open(marker) as f:
+        spec = json.load(f)
+    return Entry(path=Path(path), key=Path(path).name, spec=spec, last_used=marker.stat().st_mtime)
+
+
+def list_entries(root: Path) -> list[Entry]:
+    if not Path(root).exists():
+        return []
+    entries = [read_entry(path) for path in Path(root).iterdir() if path.is_dir()]
+    return [entry for entry in entries if entry is not None]
+
+
+def touch(path: Path):
+    (Path(path)/MARKER).touch()
+
+
+def build(root: Path, spec: Spec) -> Path:
+    """Path of the environment of `spec`, built first if it doesn't exist yet (waiting for concurrent builds)."""
+    path = Path(root)/get_key(spec)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path.with_name(path.name + LOCK_SUFFIX), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if (path/MARKER).exists():
+            touch(path)
+            return path
+
+        # Installed (not editable) in a venv that sees the packages of the container, pip output goes to stderr.
+        print("Building environment", path, spec, file=sys.stderr)
+        shutil.rmtree(path, ignore_errors=True)
+
+        def run(*cmd: str):
+            subprocess.run(list(cmd), stdout=sys.stderr, check=True)
+
+        run(sys.executable, "-m", "venv", "--system-site-packages", "--without-pip", str(path))
+        pip = [str(path/"bin"/"python"), "-m", "pip", "install", "--no-cache-dir"]
+        if spec.transformers_path != "":
+            run(*pip, spec.transformers_path)
+        run(*pip, f"git+{spec.harness_fork}@{spec.harness_commit}")
+        if spec.extra_pips != "":
+            run(*pip, *shlex.split(spec.extra_pips), "--no-build-isolation")
+        with open(path/MARKER, "w") as f:
+            json.dump(dataclasses.asdict(spec), f, indent=1)
+    return path
+
+
+def gc(root: Path, max_idle: float, in_use: Callable[[Entry], bool] = lambda entry: False) -> list[Path]:
+    """Removes the environments of `root` unused for `max_idle` seconds (and old failed builds), returns their paths."""
+    if not Path(root).exists():
+        return []
+    removed = []
+    for path in Path(root).iterdir():
+        if not path.is_dir():
+            continue
+        entry = read_entry(path)
+        last_used = entry.last_used if entry is not None else path.stat().st_mtime
+        if time.time() - last_used < max_idle or entry is not None and in_use(entry):
+            continue
+        with open(path.with_name(path.name + LOCK_SUFFIX), "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:  # Being built right now.
+                continue
+            print("Removing", path, f"(last used {(time.time() - last_used)/3600/24:.1f} days ago)")
+            shutil.rmtree(path)
+        path.with_name(path.name + LOCK_SUFFIX).unlink(missing_ok=True)
+        removed.append(path)
+    return removed
+
+
+def main(root: Path, gc_days: Optional[float], build_env: bool, container: str, harness_fork: str,
+         harness_branch: str, transformers_path: str, extra_pips: str):
+    if build_env:
+        spec = get_spec(container, harness_fork, harness_branch, transformers_path, extra_pips)
+        print(build(root, spec))
+        return
+    if gc_days is not None:
+        gc(root, gc_days*24*60*60)
+    entries = sorted(list_entries(root), key=lambda entry: entry.last_used, reverse=True)
+    for entry in entries:
+        age = (time.time() - entry.last_used)/3600
+        print(f"{entry.key}: last used {age:.1f}h ago, harness {entry.spec['harness_commit'][:8]}, "
+              f"transformers {entry.spec['transformers_commit'][:8] or '-'}, extra pips '{entry.spec['extra_pips']}'")
+    print(f"Total: {len(entries)} environments")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect, garbage collect or (pre)build evaluation environments.")
+    parser.add_argument("root", type=Path)
+    parser.add_argument("--gc-days", type=float, help="Remove the environments unused for this many days.")
+    parser.add_argument("--build", dest="build_env", action="store_true",
+                        help="Build the environment (if needed) and print its path, must run inside the container.")
+    parser.add_argument("--container", default="", help="Container description (e.g. the toml) the build runs in.")
+    parser.add_argument("--harness-fork", default="https://github.com/swiss-ai/lm-evaluation-harness.git")
+    parser.add_argument("--harness-branch", default="old-hellaswag")
+    parser.add_argument("--transformers-path", default="", help="Local transformers checkout to install.")
+    parser.add_argument("--extra-pips", default="")
+    main(**vars(parser.parse_args()))
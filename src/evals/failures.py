@@ -0,0 +1,195 @@
+"""Ledger of failed evaluations, so that a shard that keeps crashing is not resubmitted every hour forever.
+
+Every submitted evaluation job is tracked until it leaves the queue, then its final Slurm state decides:
+tasks that got results are cleared, the others get a failure (with the state and the last error of the job log).
+A task that failed `n` times is only retried `backoff*2**(n-1)` seconds (at most `max_backoff`) after its last
+failure, and is quarantined (never retried automatically) after `quarantine` failures.
+Jobs cancelled by us, infrastructure problems (node failures, preemptions) and jobs `sacct` doesn't know about
+don't count as failures.
+The ledger lives in `state_dir(LOGS_ROOT)/failures.json`, run
+`python -m evals.failures --logs-root $LOGS_ROOT [--forget MODEL[/ITER[/TASK]]]` to inspect it or to retry quarantined tasks.
+"""
+from __future__ import annotations
+
+import argparse
+import dataclasses
+import json
+import math
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+from evals.cache import state_dir, write_json
+
+
+IGNORED_STATES = {"NODE_FAIL", "PREEMPTED", "BOOT_FAIL", "UNKNOWN"}  # Not the fault of the job (or sacct forgot it).
+DEPENDENCY_CANCELLED = "CANCELLED"  # What `--kill-on-invalid-dep=yes` leaves when the materialization failed.
+
+
+@dataclasses.dataclass
+class Attempt:
+    """A submitted evaluation whose outcome is not known yet (a packed job has one per evaluation)."""
+    name: str
+    it: int
+    tasks: list[str]
+    jobname: str
+    log: str  # Stderr of the evaluation.
+    dependency: Optional[str] = None  # Job ids separated by `:`.
+
+
+@dataclasses.dataclass
+class Failure:
+    count: int
+    last: float
+    reason: str
+
+
+def get_failures_path(logs_root: Path) -> Path:
+    return state_dir(logs_root)/"failures.json"
+
+
+def read_error(log_path: Path, max_chars: int = 200) -> str:
+    """Last line of a job log that looks like an error, empty if there is none."""
+    try:
+        with open(log_path, errors="replace") as f:
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        return ""
+    for line in reversed(lines):
+        if any(word in line for word in ["Error", "error:", "Killed", "CANCELLED", "oom"]):
+            return line.strip()[:max_chars]
+    return ""
+
+
+class FailureLedger:
+    def __init__(self, path: Path, backoff: float = 60*60, max_backoff: float = 24*60*60, quarantine: int = 4):
+        self.path = Path(path)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.quarantine = quarantine
+        self.attempts: dict[str, list[Attempt]] = {}  # job id -> attempts.
+        self.failures: dict[str, dict[int, dict[str, Failure]]] = {}  # model -> iteration -> task -> failure.
+        try:
+            with open(self.path) as f:
+                info = json.load(f)
+        except FileNotFoundError:
+            return
+        self.attempts = {job_id: [Attempt(**attempt) for attempt in attempts]
+                         for job_id, attempts in info["attempts"].items()}
+        self.failures = {name: {int(it): {task: Failure(**failure) for task, failure in tasks.items()}
+                                for it, tasks in its.items()}
+                         for name, its in info["failures"].items()}
+
+    @classmethod
+    def open(cls, logs_root: Path, **kwargs) -> FailureLedger:
+        return cls(get_failures_path(logs_root), **kwargs)
+
+    def save(self):
+        write_json(self.path, {
+            "attempts": {job_id: list(map(dataclasses.asdict, attempts)) for job_id, attempts in self.attempts.items()},
+            "failures": {name: {str(it): {task: dataclasses.asdict(failure) for task, failure in tasks.items()}
+                                for it, tasks in its.items() if len(tasks) > 0}
+                         for name, its in self.failures.items() if len(its) > 0},
+        }, indent=1)
+
+    def track(self, job_id: str, attempt: Attempt):
+        self.attempts.setdefault(job_id, []).append(attempt)
+
+    def untrack(self, job_id: str):
+        self.attempts.pop(job_id, None)
+
+    def record(self, name: str, it: int, tasks: list[str], reason: str, now: Optional[float] = None):
+        now = time.time() if now is None else now
+        its = self.failures.setdefault(name, {}).setdefault(it, {})
+        for task in tasks:
+            count = its[task].count + 1 if task in its else 1
+            its[task] = Failure(count=count, last=now, reason=reason)
+
+    def clear(self, name: str, it: Optional[int] = None, tasks: Optional[list[str]] = None):
+        """Forgets the failures of `name` (only of iteration `it` and `tasks` if given)."""
+        its = self.failures.get(name, {})
+        for other_it in [it] if it is not None else list(its):
+            for task in tasks if tasks is not None else list(its.get(other_it, {})):
+                its.get(other_it, {}).pop(task, None)
+
+    def retry_at(self, name: str, it: int, task: str) -> float:
+        """When `task` can be submitted again, `inf` if it is quarantined."""
+        failure = self.failures.get(name, {}).get(it, {}).get(task)
+        if failure is None:
+            return 0.0
+        if failure.count >= self.quarantine:
+            return math.inf
+        return failure.last + min(self.backoff*2**(failure.count - 1), self.max_backoff)
+
+    def blocked(self, name: str, it: int, task: str, now: Optional[float] = None) -> bool:
+        return self.retry_at(name, it, task) > (time.time() if now is None else now)
+
+    def quarantined(self) -> list[tuple[str, int, str, Failure]]:
+        return [(name, it, task, failure) for name, its in self.failures.items() for it, tasks in its.items()
+                for task, failure in tasks.items() if failure.count >= self.quarantine]
+
+    def settle(self, queued: set[str], states: Callable[[list[str]], dict[str, str]],
+               evaluated: Callable[[str, int], set[str]],
+               now: Optional[float] = None) -> list[tuple[str, int, list[str], str]]:
+        """Updates the ledger with the outcome of the tracked jobs that are not `queued` anymore.
+
+        `states(job_ids)` gives their final Slurm states (and the ones of their dependencies),
+        `evaluated(name, it)` the tasks with results. Returns the (name, it, tasks, reason) failures recorded.
+        """
+        done = [job_id for job_id in self.attempts if job_id not in queued]
+        if len(done) == 0:
+            return []
+        dependencies = {dependency for job_id in done for attempt in self.attempts[job_id]
+                        if attempt.dependency is not None for dependency in attempt.dependency.split(":")}
+        final = states(done + sorted(dependencies))
+        recorded = []
+        for job_id in done:
+            state = final.get(job_id, "UNKNOWN")
+            if state in {"PENDING", "RUNNING", "REQUEUED"}:  # Still there, squeue was just slow to show it.
+                continue
+            for attempt in self.attempts.pop(job_id):
+                if state in IGNORED_STATES:
+                    continue
+                dependency_states = [final.get(dependency, "UNKNOWN") for dependency in
+                                     (attempt.dependency.split(":") if attempt.dependency is not None else [])]
+                dependency_state = next((dependency_state for dependency_state in dependency_states
+                                         if dependency_state in {"FAILED", "TIMEOUT", "OUT_OF_MEMORY"}), None)
+                if state == DEPENDENCY_CANCELLED and dependency_state is None:
+                    continue  # Cancelled by us (obsolete) or by hand.
+
+                # Tasks with results are salvaged, whatever the state of the job.
+                done_tasks = evaluated(attempt.name, attempt.it)
+                succeeded = [task for task in attempt.tasks if task in done_tasks]
+                failed = [task for task in attempt.tasks if task not in done_tasks]
+                self.clear(attempt.name, attempt.it, succeeded)
+                if len(failed) > 0:
+                    if state == DEPENDENCY_CANCELLED:
+                        reason = f"materialization {dependency_state}"
+                    else:
+                        reason = " ".join([state, read_error(Path(attempt.log))]).strip()
+                    self.record(attempt.name, attempt.it, failed, reason, now)
+                    recorded.append((attempt.name, attempt.it, failed, reason))
+        return recorded
+
+
+def main(logs_root: Path, forget: list[str]):
+    ledger = FailureLedger.open(logs_root)
+    for target in forget:
+        name, *rest = target.split("/", 2)
+        ledger.clear(name, int(rest[0]) if len(rest) > 0 else None, rest[1:] if len(rest) > 1 else None)
+    if len(forget) > 0:
+        ledger.save()
+    for name, its in sorted(ledger.failures.items()):
+        for it, tasks in sorted(its.items()):
+            for task, failure in sorted(tasks.items()):
+                retry = ledger.retry_at(name, it, task)
+                when = "quarantined" if retry == math.inf else time.strftime("retry after %Y-%m-%d %H:%M", time.localtime(retry))
+                print(f"{name}/{it}/{task}: {failure.count} failures, {when} ({failure.reason})")
+    print(f"{len(ledger.attempts)} jobs tracked, ledger:", ledger.path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show (or forget) the failed evaluations of a LOGS_ROOT.")
+    parser.add_argument("--logs-root", type=Path, required=True)
+    parser.add_argument("--forget", nargs="*", default=[], help="MODEL, MODEL/ITER or MODEL/ITER/TASK to retry right away.")
+    main(**vars(parser.parse_args()))
@@ -1,23 +1,27 @@
-from evals.tasks import get_all_tasks
+import argparse
+from pathlib import Path
+from typing import Optional
+
+from evals.catalog import TaskCatalog
+from evals.cost import GPUS_PER_NODE, CostModel, get_backend_key, get_cost_model_path
 
 
 def get_time_str(minutes: float) -> str:
     return f"{int(minutes/60)}h{int(minutes) % 60}m{int(minutes*60) % 60}s"
 
 
-if __name__ == "__main__":
-    total_time = 9*60  # Total time for a 70B to run all tasks.
-    total_size = 794_148
-
-    tasks = get_all_tasks()
-    est = 0
-    print("Estimated sizes:")
-    for task in sorted(tasks, key=lambda task: task.size, reverse=True):
-        estimated_time = total_time*task.size/total_size
-        est += estimated_time
-        print(f"{task.name}: {task.size}rows ({get_time_str(estimated_time)})")
+def main(size: float, backend: str, gpus: int, logs_root: Optional[Path]):
+    # Without a `--logs-root` (i.e. no fitted model) the estimates fall back to the rule-of-thumb prior.
+    cost_model = CostModel() if logs_root is None else CostModel.load(get_cost_model_path(logs_root))
+    tasks = list(TaskCatalog.load())
+    minutes = {task.name: cost_model.predict(task, size, get_backend_key(backend, gpus))/60 for task in tasks}
+    total_size = sum(task.size for task in tasks)
+    total_time = sum(minutes.values())
+
+    print(f"Estimated times for a {size}B model using {backend} on {gpus} GPUs:")
+    for task in sorted(tasks, key=lambda task: minutes[task.name], reverse=True):
+        print(f"{task.name}: {task.size}rows ({get_time_str(minutes[task.name])})")
     print("Total size:", total_size, "Total time:", get_time_str(total_time))
-    print(get_time_str(est))
     print()
 
     dimensions = sorted({task.dimension for task in tasks})
@@ -32,3 +36,12 @@ if __name__ == "__main__":
     langs = {lang: sum(task.size for task in tasks if task.language.name == lang)
              for lang in {task.language.name for task in tasks}}
     print(sorted(langs.items(), key=lambda t: t[1], reverse=True))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=float, default=70, help="Model size in billions.")
+    parser.add_argument("--backend", choices=["hf", "vllm"], default="hf")
+    parser.add_argument("--gpus", type=int, default=GPUS_PER_NODE, help="1 for the evaluations packed on a single GPU.")
+    parser.add_argument("--logs-root", type=Path, help="Use the cost model fitted on this LOGS_ROOT.")
+    main(**vars(parser.parse_args()))
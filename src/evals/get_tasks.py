@@ -1,13 +1,13 @@
 import argparse
 from typing import Optional
 
-from evals.tasks import TaskKind, get_all_tasks
+from evals.catalog import TaskCatalog
+from evals.tasks import TaskKind
 
 
 def main(kind: Optional[TaskKind]):
-    tasks = get_all_tasks()
-    if kind is not None:
-        tasks = list(filter(lambda task: kind in task.kind, tasks))
+    catalog = TaskCatalog.load()
+    tasks = catalog.select(kind=kind)
     print(",".join(task.name for task in tasks))
 
 
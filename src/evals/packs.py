@@ -0,0 +1,81 @@
+"""Several evaluations in a single allocation.
+
+Models that fit on one GPU don't need the four GPUs (and tensor parallelism) of a whole `evaluate.sbatch` job:
+up to `GPUS_PER_NODE` of their (model, iteration, shard) evaluations are submitted together as one
+`scripts/evaluate_pack.sbatch` job, each one running `evaluate.sbatch` pinned to its own GPU.
+Evaluations of several checkpoints of a bigger model are instead run one after another by a
+`scripts/evaluate_batch.sbatch` job, so that they only pay the queue wait, container start and installs once.
+Both are a directory under `state_dir(LOGS_ROOT)/packs/` named as their Slurm job (`pack_{hash}` or `batch_{hash}`),
+with a `slots.json` manifest (the job name, arguments and environment each slot would have as a standalone job)
+and one script per slot, so the automation can still tell which evaluations are running while the job is queued.
+"""
+from __future__ import annotations
+
+import dataclasses
+import hashlib
+import json
+import shlex
+import shutil
+import time
+from pathlib import Path
+from typing import Optional
+
+from evals.cache import state_dir, write_json
+
+
+MAX_AGE = 7*24*60*60  # Manifests of jobs that left the queue are removed after a week.
+KINDS = ("pack", "batch")
+
+
+@dataclasses.dataclass
+class Slot:
+    jobname: str  # The `eval_*` name it would have as a standalone job.
+    args: list[str]
+    env: dict[str, str]  # Only the variables that differ from the submitting environment.
+
+
+def get_packs_dir(logs_root: Path) -> Path:
+    return state_dir(logs_root)/"packs"
+
+
+def is_pack(jobname: str) -> bool:
+    """Whether `jobname` is a pack or batch job."""
+    return any(jobname.startswith(f"{kind}_") for kind in KINDS)
+
+
+def get_pack_name(slots: list[Slot], kind: str = "pack") -> str:
+    key = "\n".join(sorted(slot.jobname for slot in slots)) + f"\n{time.time()}"
+    return f"{kind}_{hashlib.sha256(key.encode()).hexdigest()[:12]}"
+
+
+def write_pack(packs_dir: Path, slots: list[Slot], kind: str = "pack", script: str = "scripts/evaluate.sbatch") -> Path:
+    """Writes the manifest and slot scripts of a new pack (or batch), returns its directory.
+
+    Slot scripts are numbered in the order of `slots`, which is the order a batch runs them in.
+    """
+    path = Path(packs_dir)/get_pack_name(slots, kind)
+    path.mkdir(parents=True)
+    for i, slot in enumerate(slots):
+        lines = ["#!/bin/bash"]
+        lines += [f"export {key}={shlex.quote(value)}" for key, value in sorted(slot.env.items())]
+        lines.append(shlex.join(["exec", "bash", script] + slot.args))
+        (path/f"{i:02d}_{slot.jobname}.sh").write_text("\n".join(lines) + "\n")
+    write_json(path/"slots.json", [dataclasses.asdict(slot) for slot in slots], indent=1)
+    return path
+
+
+def read_pack(packs_dir: Path, name: str) -> Optional[list[Slot]]:
+    try:
+        with open(Path(packs_dir)/name/"slots.json") as f:
+            return [Slot(**slot) for slot in json.load(f)]
+    except FileNotFoundError:
+        return None
+
+
+def prune(packs_dir: Path, queued: set[str], max_age: float = MAX_AGE):
+    """Removes the old packs and batches not in `queued` (names of the ones still in the queue)."""
+    if not Path(packs_dir).exists():
+        return
+    for path in Path(packs_dir).iterdir():
+        if path.name not in queued and time.time() - path.stat().st_mtime > max_age:
+            shutil.rmtree(path)
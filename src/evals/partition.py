@@ -0,0 +1,93 @@
+"""Walltime-aware construction of evaluation shards.
+
+Every shard is a slurm job that pays a fixed overhead (container start, installs, model download or
+conversion, vllm warmup) before evaluating its tasks, and gets killed when it exceeds the walltime.
+`plan_partition` picks the number of shards and the task assignment that minimize
+`gpu_hours + makespan_weight*makespan_hours`, only considering partitions where every shard finishes
+within `walltime*(1 - margin)` according to the predicted task costs (see `evals.cost`).
+"""
+from __future__ import annotations
+
+import heapq
+import math
+from typing import Callable, TypeVar
+
+T = TypeVar("T")
+
+
+def lpt(items: list[T], cost: Callable[[T], float], shards: int) -> list[list[T]]:
+    """Longest processing time first: assign each item (most expensive first) to the least loaded shard."""
+    parts = [[] for _ in range(shards)]
+    heap = [(0.0, i) for i in range(shards)]
+    for item in items:
+        load, i = heapq.heappop(heap)
+        parts[i].append(item)
+        heapq.heappush(heap, (load + cost(item), i))
+    return parts
+
+
+def improve(parts: list[list[T]], cost: Callable[[T], float], max_rounds: int = 100) -> list[list[T]]:
+    """Local search on top of `lpt`: moves or swaps items between the most and least loaded shards while that helps."""
+    costs = {id(item): cost(item) for part in parts for item in part}
+    loads = [sum(costs[id(item)] for item in part) for part in parts]
+    for _ in range(max_rounds):
+        top = max(range(len(parts)), key=loads.__getitem__)
+        low = min(range(len(parts)), key=loads.__getitem__)
+        best = None  # (new max load of both shards, item to move from `top`, item to move back or None).
+        for item in parts[top]:
+            for swap in [None] + parts[low]:
+                delta = costs[id(item)] - (0.0 if swap is None else costs[id(swap)])
+                new_max = max(loads[top] - delta, loads[low] + delta)
+                if delta > 0 and new_max < loads[top] - 1e-9 and (best is None or new_max < best[0]):
+                    best = (new_max, item, swap)
+        if best is None:
+            break
+        _, item, swap = best
+        parts[top].remove(item)
+        parts[low].append(item)
+        delta = costs[id(item)]
+        if swap is not None:
+            parts[low].remove(swap)
+            parts[top].append(swap)
+            delta -= costs[id(swap)]
+        loads[top] -= delta
+        loads[low] += delta
+    return parts
+
+
+def plan_partition(items: list[T], cost: Callable[[T], float], walltime: float, overhead: float = 0.0,
+                   margin: float = 0.1, gpus: int = 4, makespan_weight: float = 1.0,
+                   key: Callable[[T], str] = str) -> tuple[list[T], ...]:
+    """Partitions `items` into the cheapest set of shards that all finish before the walltime.
+
+    `cost` and `overhead` (per shard) are in seconds, as is `walltime`.
+    The objective is `gpu_hours + makespan_weight*makespan_hours`, where the makespan is the duration of
+    the longest shard (i.e. the time until all results are available when all shards run in parallel).
+    Raises ValueError when some item does not fit in a shard on its own.
+    """
+    if len(items) == 0:
+        return ()
+    capacity = walltime*(1 - margin) - overhead
+    items = sorted(items, key=lambda item: (-cost(item), key(item)))
+    too_long = [key(item) for item in items if cost(item) > capacity]
+    if len(too_long) > 0:
+        raise ValueError(f"Tasks {too_long} need more than the {capacity/3600:.1f}h available in a single job")
+
+    total = sum(map(cost, items))
+    def objective(parts: list[list[T]]) -> float:
+        makespan = overhead + max(sum(map(cost, part)) for part in parts)
+        return gpus*(len(parts)*overhead + total)/3600 + makespan_weight*makespan/3600
+
+    best = None
+    for shards in range(max(1, math.ceil(total/capacity)), len(items) + 1):
+        # Lower bound of the objective with this many shards, no point in looking further once it can't win.
+        bound = gpus*(shards*overhead + total)/3600 + makespan_weight*(overhead + max(cost(items[0]), total/shards))/3600
+        if best is not None and bound >= best[0]:
+            break
+        parts = improve(lpt(items, cost, shards), cost)
+        if max(sum(map(cost, part)) for part in parts) > capacity:
+            continue
+        parts = [part for part in parts if len(part) > 0]
+        if best is None or objective(parts) < best[0]:
+            best = (objective(parts), parts)
+    return tuple(sorted((sorted(part, key=key) for part in best[1]), key=lambda part: key(part[0])))
@@ -0,0 +1,144 @@
+"""Local record of what `scripts/update_wandb.py` pushed to wandb, so a sync doesn't scan the history of every run.
+
+Every log pushed to a run is appended (never updated) to an sqlite database in
+`state_dir(LOGS_ROOT)/wandb_pushed.sqlite`, keyed by (project, run, ConsumedTokens), so what wandb shows for a
+step is the merge of its rows in order, the same as merging the rows of `run.scan_history()`.
+Runs are reconciled against the remote history (which replaces the local one, as rows with source `remote`)
+the first time they are synced from a LOGS_ROOT, every `--reconcile-days` or with `--reconcile`;
+otherwise syncs make no history requests.
+It also keeps the fingerprint of the inputs (results files, aggregation config) each iteration was last synced
+with, so a sync only reads and aggregates the iterations that changed since.
+Run `python -m evals.pushed --logs-root $LOGS_ROOT` to list what was pushed.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import sqlite3
+import time
+from pathlib import Path
+from typing import Optional
+
+from evals.cache import state_dir
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pushed (
+    project TEXT NOT NULL,
+    run TEXT NOT NULL,
+    consumed_tokens INTEGER NOT NULL,
+    log TEXT NOT NULL,
+    source TEXT NOT NULL,
+    time REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pushed_run ON pushed (project, run);
+CREATE TABLE IF NOT EXISTS inputs (
+    project TEXT NOT NULL,
+    run TEXT NOT NULL,
+    iteration INTEGER NOT NULL,
+    fingerprint TEXT NOT NULL,
+    consumed_tokens INTEGER,
+    PRIMARY KEY (project, run, iteration)
+);
+CREATE TABLE IF NOT EXISTS reconciled (
+    project TEXT NOT NULL,
+    run TEXT NOT NULL,
+    time REAL NOT NULL,
+    PRIMARY KEY (project, run)
+);
+"""
+
+
+def get_pushed_path(logs_root: Path) -> Path:
+    return state_dir(logs_root)/"wandb_pushed.sqlite"
+
+
+class PushedLog:
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(self.path, timeout=60)
+        self.db.executescript(SCHEMA)
+
+    @classmethod
+    def open(cls, logs_root: Path) -> PushedLog:
+        return cls(get_pushed_path(logs_root))
+
+    def close(self):
+        self.db.close()
+
+    def history(self, project: str, run: str) -> dict[int, dict[str, float]]:
+        """ConsumedTokens -> what the run shows at that step (the merge of every log pushed to it)."""
+        history = {}
+        for consumed_tokens, log in self.db.execute(
+                "SELECT consumed_tokens, log FROM pushed WHERE project = ? AND run = ? ORDER BY rowid", (project, run)):
+            history.setdefault(consumed_tokens, {}).update(json.loads(log))
+        return history
+
+    def append(self, project: str, run: str, logs: list[dict[str, float]], source: str = "push"):
+        """Records `logs` (with their `ConsumedTokens`) as pushed to `run`."""
+        now = time.time()
+        with self.db:
+            self.db.executemany("INSERT INTO pushed VALUES (?, ?, ?, ?, ?, ?)",
+                                [(project, run, log["ConsumedTokens"], json.dumps(log, sort_keys=True), source, now)
+                                 for log in logs])
+
+    def inputs(self, project: str, run: str) -> dict[int, tuple[str, Optional[int]]]:
+        """Iteration -> (fingerprint of its inputs, ConsumedTokens) when it was last synced to `run`."""
+        return {it: (fingerprint, consumed_tokens) for it, fingerprint, consumed_tokens in self.db.execute(
+            "SELECT iteration, fingerprint, consumed_tokens FROM inputs WHERE project = ? AND run = ?", (project, run))}
+
+    def set_inputs(self, project: str, run: str, inputs: dict[int, tuple[str, Optional[int]]]):
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO inputs VALUES (?, ?, ?, ?, ?)",
+                                [(project, run, it, fingerprint, consumed_tokens)
+                                 for it, (fingerprint, consumed_tokens) in inputs.items()])
+
+    def reconciled_at(self, project: str, run: str) -> Optional[float]:
+        row = self.db.execute("SELECT time FROM reconciled WHERE project = ? AND run = ?", (project, run)).fetchone()
+        return None if row is None else row[0]
+
+    def reconcile(self, project: str, run: str, remote: dict[int, dict[str, float]]) -> int:
+        """Replaces the local history of `run` with the `remote` one, returns how many steps differed.
+
+        The inputs of the iterations whose step is missing or differs remotely are forgotten, so the next
+        sync aggregates and pushes them again.
+        """
+        local = self.history(project, run)
+        remote = {consumed_tokens: {**log, "ConsumedTokens": consumed_tokens}
+                  for consumed_tokens, log in remote.items()}
+        differ = {consumed_tokens for consumed_tokens in local.keys() | remote.keys()
+                  if local.get(consumed_tokens) != remote.get(consumed_tokens)}
+        stale = [it for it, (_, consumed_tokens) in self.inputs(project, run).items()
+                 if consumed_tokens is None or consumed_tokens in differ or consumed_tokens not in remote]
+        now = time.time()
+        with self.db:
+            self.db.execute("DELETE FROM pushed WHERE project = ? AND run = ?", (project, run))
+            self.db.executemany("INSERT INTO pushed VALUES (?, ?, ?, ?, ?, ?)",
+                                [(project, run, consumed_tokens, json.dumps(log, sort_keys=True), "remote", now)
+                                 for consumed_tokens, log in sorted(remote.items())])
+            self.db.executemany("DELETE FROM inputs WHERE project = ? AND run = ? AND iteration = ?",
+                                [(project, run, it) for it in stale])
+            self.db.execute("INSERT OR REPLACE INTO reconciled VALUES (?, ?, ?)", (project, run, now))
+        return len(differ)
+
+
+def main(logs_root: Path, project: Optional[str]):
+    pushed = PushedLog.open(logs_root)
+    query = "SELECT project, run, COUNT(DISTINCT consumed_tokens), COUNT(*), MAX(time) FROM pushed"
+    query += " WHERE project = ?" if project is not None else ""
+    for row_project, run, steps, rows, last in pushed.db.execute(query + " GROUP BY project, run ORDER BY project, run",
+                                                                  () if project is None else (project,)):
+        reconciled = pushed.reconciled_at(row_project, run)
+        when = "never" if reconciled is None else f"{(time.time() - reconciled)/3600:.1f}h ago"
+        print(f"{row_project}/{run}: {steps} steps ({rows} logs), last pushed {(time.time() - last)/3600:.1f}h ago, "
+              f"reconciled {when}")
+    print("Record:", pushed.path)
+    pushed.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="List what was pushed to wandb from a LOGS_ROOT.")
+    parser.add_argument("--logs-root", type=Path, required=True)
+    parser.add_argument("--project", help="Only runs of this `entity/project`.")
+    main(**vars(parser.parse_args()))
@@ -0,0 +1,190 @@
+"""Compressed, seekable storage of the samples logged by the harness (`--log_samples`, i.e. `LOG_SAMPLES=true`).
+
+`compact` rewrites a `samples_{task}_{timestamp}.jsonl` as `samples_{task}_{timestamp}.jsonl.zst`: independent zstd
+frames of whole lines (about `BLOCK_BYTES` each before compression), with a sidecar index
+(`samples_{task}_{timestamp}.jsonl.zst.idx`, json) of the offset, size and lines of every frame and the `doc_id` of
+every line. The original is only removed once the compressed file decompresses to the same bytes.
+Readers go through `iter_lines` (streams plain and compacted files alike) and `SampleLog` (random access by `doc_id`,
+decompressing only the frames needed), and find the files of a run with `find_samples`.
+Run `python -m evals.samples DIR` after an evaluation to compact every samples file under DIR (done by
+`scripts/evaluate.sbatch`), `python -m evals.samples --show FILE --doc-id N` to print a sample.
+"""
+from __future__ import annotations
+
+import argparse
+import bisect
+import hashlib
+import io
+import json
+import os
+import tempfile
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Optional
+
+from evals.cache import write_json
+
+
+SUFFIX = ".jsonl"
+COMPACT_SUFFIX = ".jsonl.zst"
+INDEX_SUFFIX = ".idx"  # Of the sidecar index, appended to the name of the compacted file.
+BLOCK_BYTES = 1 << 20  # Uncompressed bytes per frame: the most read to get a single sample.
+LEVEL = 10
+
+
+def get_index_path(path: Path) -> Path:
+    return Path(path).with_name(Path(path).name + INDEX_SUFFIX)
+
+
+def get_task(name: str, timestamp: str) -> Optional[str]:
+    """The task of a samples file of the run with `timestamp`, None if `name` is not one."""
+    for suffix in [f"_{timestamp}{SUFFIX}", f"_{timestamp}{COMPACT_SUFFIX}"]:
+        if name.startswith("samples_") and name.endswith(suffix):
+            return name[len("samples_"):-len(suffix)]
+    return None
+
+
+def find_samples(directory: Path, timestamp: str) -> dict[str, Path]:
+    """Task -> samples file of the run with `timestamp` in `directory`, the compacted one if both exist."""
+    found = {}
+    for suffix in [SUFFIX, COMPACT_SUFFIX]:
+        for path in Path(directory).glob(f"samples_*_{timestamp}{suffix}"):
+            found[get_task(path.name, timestamp)] = path
+    return found
+
+
+def iter_lines(path: Path) -> Iterator[str]:
+    """The lines of a plain or compacted samples file, streamed."""
+    if not Path(path).name.endswith(COMPACT_SUFFIX):
+        with open(path) as f:
+            yield from f
+        return
+
+    import zstandard
+
+    with open(path, "rb") as f:
+        reader = zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True)
+        yield from io.TextIOWrapper(reader, encoding="utf-8", newline="")
+
+
+class SampleLog:
+    """Random access to the samples of a compacted file, by `doc_id` or line."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with open(get_index_path(self.path)) as f:
+            index = json.load(f)
+        self.frames = index["frames"]  # (offset, compressed size, lines) of every frame.
+        self.doc_ids = index["doc_ids"]  # Of every line (several lines per document with several filters).
+        self.starts = []  # First line of every frame.
+        lines = 0
+        for _, _, frame_lines in self.frames:
+            self.starts.append(lines)
+            lines += frame_lines
+        self.lines = {}  # doc_id -> its lines.
+        for line, doc_id in enumerate(self.doc_ids):
+            self.lines.setdefault(doc_id, []).append(line)
+        self._frame: Optional[tuple[int, list[bytes]]] = None  # Last frame read, as sequential lookups share it.
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def _read_frame(self, frame: int) -> list[bytes]:
+        import zstandard
+
+        if self._frame is None or self._frame[0] != frame:
+            offset, size, _ = self.frames[frame]
+            with open(self.path, "rb") as f:
+                f.seek(offset)
+                data = zstandard.ZstdDecompressor().decompress(f.read(size))
+            self._frame = frame, data.split(b"\n")
+        return self._frame[1]
+
+    def line(self, line: int) -> dict:
+        frame = bisect.bisect_right(self.starts, line) - 1
+        return json.loads(self._read_frame(frame)[line - self.starts[frame]])
+
+    def get(self, doc_id: int) -> list[dict]:
+        """The samples of a document (one per filter)."""
+        return [self.line(line) for line in self.lines.get(doc_id, [])]
+
+
+def compact(path: Path, level: int = LEVEL, block_bytes: int = BLOCK_BYTES) -> Path:
+    """Compacts a plain samples file (see above), returns the compacted file."""
+    import zstandard
+
+    path = Path(path)
+    dest = path.with_name(path.name[:-len(SUFFIX)] + COMPACT_SUFFIX)
+    compressor = zstandard.ZstdCompressor(level=level)
+    frames, doc_ids = [], []
+    digest = hashlib.sha256()
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{dest.name}.", suffix=COMPACT_SUFFIX)
+    try:
+        with open(path, "rb") as src, os.fdopen(fd, "wb") as out:
+            block, block_size = [], 0
+            for line in src:
+                digest.update(line)
+                doc_ids.append(json.loads(line).get("doc_id"))
+                block.append(line)
+                block_size += len(line)
+                if block_size >= block_bytes:
+                    frames.append(_write_frame(out, compressor, block))
+                    block, block_size = [], 0
+            if len(block) > 0:
+                frames.append(_write_frame(out, compressor, block))
+
+        # Only replace the original once its compacted version reads back the same.
+        check = hashlib.sha256()
+        for line in iter_lines(tmp):
+            check.update(line.encode())
+        if check.digest() != digest.digest():
+            raise ValueError(f"Compacting {path} doesn't read back the same samples")
+        write_json(get_index_path(dest), {"frames": frames, "doc_ids": doc_ids})
+        os.replace(tmp, dest)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    path.unlink()
+    return dest
+
+
+def _write_frame(out, compressor, block: list[bytes]) -> tuple[int, int, int]:
+    offset = out.tell()
+    out.write(compressor.compress(b"".join(block)))
+    return offset, out.tell() - offset, len(block)
+
+
+def compact_all(directory: Path, level: int = LEVEL) -> tuple[int, int]:
+    """Compacts every plain samples file under `directory`, returns the bytes before and after."""
+    before = after = 0
+    for path in sorted(Path(directory).glob(f"**/samples_*{SUFFIX}")):
+        size = path.stat().st_size
+        try:
+            dest = compact(path, level)
+        except ValueError as error:  # E.g. truncated by a crash, left as it is.
+            print(f"WARNING! Couldn't compact {path}: {error}")
+            continue
+        before += size
+        after += dest.stat().st_size + get_index_path(dest).stat().st_size
+        print(f"Compacted {path.name}: {size/2**20:.1f}MiB -> {dest.stat().st_size/2**20:.1f}MiB")
+    return before, after
+
+
+def main(directories: list[Path], level: int, show: Optional[Path], doc_id: Optional[int]):
+    if show is not None:
+        for sample in SampleLog(show).get(doc_id):
+            print(json.dumps(sample, indent=2))
+        return
+    for directory in directories:
+        before, after = compact_all(directory, level)
+        if before > 0:
+            print(f"{directory}: {before/2**20:.1f}MiB of samples compacted to {after/2**20:.1f}MiB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compact the samples files logged by the harness.")
+    parser.add_argument("directories", nargs="*", type=Path, help="Compact every samples file under these.")
+    parser.add_argument("--level", type=int, default=LEVEL, help="zstd compression level.")
+    parser.add_argument("--show", type=Path, help="Print the samples of `--doc-id` in this compacted file instead.")
+    parser.add_argument("--doc-id", type=int)
+    main(**vars(parser.parse_args()))
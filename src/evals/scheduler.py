@@ -0,0 +1,191 @@
+"""Job schedulers used by the automation.
+
+`SlurmScheduler` submits through `sbatch` and lists jobs with `squeue`, `FakeScheduler` is an in-process
+stand-in (a discrete event simulation of a cluster with a fixed number of nodes) used to test and
+tune the automation off-cluster, see `scripts/simulate.py`.
+"""
+from __future__ import annotations
+
+import abc
+import dataclasses
+import heapq
+import itertools
+import re
+import subprocess
+from typing import Callable, Optional
+
+
+@dataclasses.dataclass
+class Job:
+    id: str
+    name: str
+    script: str
+    args: list[str]
+    env: dict[str, str]
+    dependency: Optional[str] = None
+    submitted: float = 0.0
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    failed: bool = False
+    cancelled: bool = False
+
+
+class Scheduler(abc.ABC):
+    @abc.abstractmethod
+    def jobs(self, pending_only: bool = False) -> list[tuple[str, str]]:
+        """(id, name) of all our queued and running jobs (only the ones not started yet if `pending_only`).
+
+        Several jobs can have the same name (e.g. shards of the same iteration).
+        """
+
+    @abc.abstractmethod
+    def cancel(self, job_id: str):
+        """Cancels a queued or running job."""
+
+    @abc.abstractmethod
+    def states(self, job_ids: list[str]) -> dict[str, str]:
+        """Id -> Slurm state (e.g. `COMPLETED`, `FAILED`, `TIMEOUT`) of the given jobs, also after they left the queue."""
+
+    @abc.abstractmethod
+    def submit(self, script: str, args: list[str], name: str, env: dict[str, str],
+               options: list[str] = [], dependency: Optional[str] = None) -> str:
+        """Submits `script args` as `name`, only starting after the jobs of `dependency` (ids separated by `:`) succeeded.
+
+        Returns the job id.
+        """
+
+
+class SlurmScheduler(Scheduler):
+    def jobs(self, pending_only: bool = False) -> list[tuple[str, str]]:
+        cmd = ["squeue", "--me", '--format="%i %j"', "--noheader"]
+        if pending_only:
+            cmd.append("--states=PENDING")
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+        assert proc.returncode == 0, proc.stderr
+        jobs = []
+        for line in proc.stdout.strip().split("\n"):
+            rmatch = re.match('^"([^ ]+) (.*)"$', line)
+            if rmatch is not None:
+                jobs.append(rmatch.groups())
+        return jobs
+
+    def submit(self, script: str, args: list[str], name: str, env: dict[str, str],
+               options: list[str] = [], dependency: Optional[str] = None) -> str:
+        cmd = ["sbatch", "--parsable"] + options + [f"--job-name={name}"]
+        if dependency is not None:
+            cmd += [f"--dependency=afterok:{dependency}", "--kill-on-invalid-dep=yes"]
+        cmd += [script] + args
+        proc = subprocess.run(cmd, env=env, capture_output=True, text=True)
+        assert proc.returncode == 0, proc.stderr
+        return re.match("^[^0-9]*([0-9]+)", proc.stdout.strip()).group(1)
+
+    def cancel(self, job_id: str):
+        proc = subprocess.run(["scancel", job_id], capture_output=True, text=True)
+        if proc.returncode != 0:  # E.g. it started or left the queue since it was listed.
+            print(f"WARNING! Cancelling {job_id} failed:", proc.stderr.strip())
+
+    def states(self, job_ids: list[str]) -> dict[str, str]:
+        if len(job_ids) == 0:
+            return {}
+        proc = subprocess.run(["sacct", "--jobs", ",".join(job_ids), "--allocations", "--noheader", "--parsable2",
+                               "--format=JobID,State"], capture_output=True, text=True)
+        if proc.returncode != 0:
+            print("WARNING! sacct failed:", proc.stderr.strip())
+            return {}
+        states = {}
+        for line in proc.stdout.strip().split("\n"):
+            if "|" in line:
+                job_id, state = line.split("|", 1)
+                states[job_id] = state.split(" ")[0]  # E.g. `CANCELLED by 1234`.
+        return states
+
+
+class FakeScheduler(Scheduler):
+    """A cluster of `nodes` exclusive nodes that starts queued jobs in submission order.
+
+    `duration(job)` gives the seconds a job runs for and whether it succeeds, `on_finish(job)` is called
+    when it ends. Jobs whose dependency failed are cancelled (as with `--kill-on-invalid-dep=yes`).
+    Time only moves with `advance`.
+    """
+
+    def __init__(self, nodes: int, duration: Callable[[Job], tuple[float, bool]],
+                 on_finish: Callable[[Job], None] = lambda job: None):
+        self.nodes = nodes
+        self.duration = duration
+        self.on_finish = on_finish
+        self.now = 0.0
+        self.queue: list[Job] = []
+        self.running: list[tuple[float, str]] = []  # Heap of (end time, job id).
+        self.history: dict[str, Job] = {}
+        self._succeeds: dict[str, bool] = {}
+        self._ids = itertools.count(1)
+
+    def jobs(self, pending_only: bool = False) -> list[tuple[str, str]]:
+        return [(job.id, job.name) for job in self.history.values()
+                if job.finished is None and (not pending_only or job.started is None)]
+
+    def cancel(self, job_id: str):
+        job = self.history[job_id]
+        if job.finished is None:
+            if job.started is None:
+                self.queue.remove(job)
+            else:
+                self.running = [(end, other) for end, other in self.running if other != job_id]
+                heapq.heapify(self.running)
+                self._succeeds.pop(job_id)
+            job.started = job.started if job.started is not None else self.now
+            job.finished = self.now
+            job.failed = job.cancelled = True
+            self._start()
+
+    def states(self, job_ids: list[str]) -> dict[str, str]:
+        states = {}
+        for job_id in job_ids:
+            job = self.history.get(job_id)
+            if job is None:
+                continue
+            if job.started is None:
+                states[job_id] = "PENDING"
+            elif job.finished is None:
+                states[job_id] = "RUNNING"
+            else:
+                states[job_id] = "CANCELLED" if job.cancelled else "FAILED" if job.failed else "COMPLETED"
+        return states
+
+    def submit(self, script: str, args: list[str], name: str, env: dict[str, str],
+               options: list[str] = [], dependency: Optional[str] = None) -> str:
+        job = Job(id=str(next(self._ids)), name=name, script=script, args=list(args), env=dict(env),
+                  dependency=dependency, submitted=self.now)
+        self.history[job.id] = job
+        self.queue.append(job)
+        self._start()
+        return job.id
+
+    def _start(self):
+        for job in list(self.queue):
+            dependencies = [self.history[job_id] for job_id in job.dependency.split(":")] if job.dependency is not None else []
+            if any(dependency.finished is not None and dependency.failed for dependency in dependencies):
+                self.queue.remove(job)
+                job.started = job.finished = self.now
+                job.failed = job.cancelled = True
+                self.on_finish(job)
+            elif len(self.running) < self.nodes and all(dependency.finished is not None for dependency in dependencies):
+                self.queue.remove(job)
+                job.started = self.now
+                seconds, self._succeeds[job.id] = self.duration(job)
+                heapq.heappush(self.running, (self.now + seconds, job.id))
+
+    def next_event(self) -> Optional[float]:
+        return self.running[0][0] if len(self.running) > 0 else None
+
+    def advance(self, until: float):
+        """Runs the cluster until time `until`."""
+        while len(self.running) > 0 and self.running[0][0] <= until:
+            end, job_id = heapq.heappop(self.running)
+            self.now = end
+            job = self.history[job_id]
+            job.finished = end
+            job.failed = not self._succeeds.pop(job_id)
+            self.on_finish(job)
+            self._start()
+        self.now = max(self.now, until)
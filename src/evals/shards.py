@@ -0,0 +1,109 @@
+"""Stable default shards of the task catalog.
+
+The default shards of a model are the jobs every new checkpoint is evaluated with, and jobs are matched back to
+them by index (`shard{i}of{n}`), so they must not be reshuffled whenever `all_tasks.json` changes.
+Assignments are persisted per model size and backend in `state_dir(LOGS_ROOT)/shards.json`, one per version of
+the catalog, of the cost estimates of its tasks and of the capacity of a job.
+When any of them changes the latest assignment is updated incrementally:
+removed tasks leave their shard (an emptied shard is kept as a placeholder so indices don't move),
+shards that no longer fit evict their most expensive tasks, new (or evicted) tasks go to the least loaded shard they
+fit in, and only what fits nowhere is planned into new shards.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+from pathlib import Path
+from typing import Callable
+
+from evals.cache import state_dir, write_json
+from evals.tasks import Task
+
+
+MAX_VERSIONS = 8  # Assignments of older catalog versions kept around, newest first.
+
+_MEMO: dict[tuple[Path, str, str], list[list[str]]] = {}
+
+
+def get_shards_path(logs_root: Path) -> Path:
+    return state_dir(logs_root)/"shards.json"
+
+
+def get_version(tasks: list[Task], cost: Callable[[Task], float], capacity: float) -> str:
+    """Fingerprint of the tasks, their costs (to the second) and the capacity an assignment was made for."""
+    lines = [f"{task.name}:{round(cost(task))}" for task in sorted(tasks, key=lambda task: task.name)]
+    return hashlib.sha256("\n".join([f"capacity:{round(capacity)}"] + lines).encode()).hexdigest()[:16]
+
+
+def update_shards(previous: list[list[str]], tasks: list[Task], cost: Callable[[Task], float], capacity: float,
+                  plan: Callable[[list[Task]], tuple[list[Task], ...]]) -> list[list[Task]]:
+    """Assignment of `tasks` that keeps every task of `previous` (lists of task names) in its shard when possible.
+
+    Shards that exceed the `capacity` (seconds) evict their most expensive tasks, which are then reassigned
+    together with the new ones. Tasks that fit in no existing shard are split with `plan` into new shards,
+    that take the place of empty shards first.
+    """
+    by_name = {task.name: task for task in tasks}
+    parts = [[by_name[name] for name in part if name in by_name] for part in previous]
+    assigned = {task.name for part in parts for task in part}
+    leftover = [task for task in tasks if task.name not in assigned]
+    for part in parts:
+        part.sort(key=lambda task: (cost(task), task.name))
+        while sum(map(cost, part)) > capacity:
+            leftover.append(part.pop())
+
+    remaining = []
+    loads = [sum(map(cost, part)) for part in parts]
+    for task in sorted(leftover, key=lambda task: (-cost(task), task.name)):
+        fits = [i for i, part in enumerate(parts) if len(part) > 0 and loads[i] + cost(task) <= capacity]
+        if len(fits) == 0:
+            remaining.append(task)
+            continue
+        i = min(fits, key=lambda i: (loads[i], i))
+        parts[i].append(task)
+        loads[i] += cost(task)
+
+    empty = [i for i, part in enumerate(parts) if len(part) == 0]
+    for new_part in plan(remaining):
+        if len(empty) > 0:
+            parts[empty.pop(0)] = list(new_part)
+        else:
+            parts.append(list(new_part))
+    return [sorted(part, key=lambda task: task.name) for part in parts]
+
+
+def get_default_shards(path: Path, key: str, tasks: list[Task], cost: Callable[[Task], float], capacity: float,
+                       plan: Callable[[list[Task]], tuple[list[Task], ...]]) -> tuple[list[Task], ...]:
+    """Default shards of `tasks` stored under `key` (e.g. `70:hf`) in `path`, updating them if needed.
+
+    Empty shards can be present in the result, they must be skipped but not removed.
+    """
+    by_name = {task.name: task for task in tasks}
+    version = get_version(tasks, cost, capacity)
+    memo_key = (Path(path), key, version)
+    if memo_key in _MEMO:
+        return tuple([by_name[name] for name in part] for part in _MEMO[memo_key])
+
+    try:
+        with open(path) as f:
+            stored = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        stored = {}
+    entry = stored.get(key, {"latest": None, "versions": {}})
+    names = entry["versions"].get(version)
+    if names is None or any(sum(cost(by_name[name]) for name in part) > capacity for part in names):
+        previous = entry["versions"].get(entry["latest"], []) if names is None else names
+        parts = update_shards(previous, tasks, cost, capacity, plan)
+        names = [[task.name for task in part] for part in parts]
+        if names != previous:
+            print(f"Updated default shards of {key}: {len(previous)} -> {len(names)} shards")
+        versions = {version: names}
+        versions.update((v, shards) for v, shards in entry["versions"].items() if v != version)
+        stored[key] = {"latest": version, "versions": dict(list(versions.items())[:MAX_VERSIONS])}
+        try:
+            write_json(path, stored, indent=1)
+        except OSError as err:
+            print(f"WARNING! Could not save the default shards to {path}: {err}")
+
+    _MEMO[memo_key] = names
+    return tuple([by_name[name] for name in part] for part in names)
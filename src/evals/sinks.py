@@ -0,0 +1,135 @@
+"""Where the results of `scripts/update_wandb.py` and `scripts/alignment` are uploaded to.
+
+Everything a sync has for a run (its metric logs, tables and sample tables) is an `Upload`, pushed by a sink in a
+single session: `WandbSink` opens the wandb run once, `LocalSink` appends it as json lines to `{dir}/{run_id}.jsonl`
+(for tests and air-gapped clusters). `upload` pushes the runs of a sync concurrently, each in a worker process
+(wandb only supports one run per process), and retries the failures that look transient with exponential backoff.
+Sinks are given as `wandb` or `local:{dir}` (`--sink` of the upload scripts).
+"""
+from __future__ import annotations
+
+import abc
+import dataclasses
+import json
+import multiprocessing
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Optional
+
+
+RETRIES = 3
+BACKOFF = 30  # Seconds before the first retry, doubled every time.
+
+
+@dataclasses.dataclass
+class Table:
+    columns: list[str]
+    rows: list[list[Any]]
+
+
+@dataclasses.dataclass
+class Upload:
+    """Everything to push to a run."""
+    run_id: str
+    name: str
+    logs: list[dict[str, Any]] = dataclasses.field(default_factory=list)  # Logged in order, one step each.
+    tables: dict[str, Table] = dataclasses.field(default_factory=dict)  # Logged one by one after the logs.
+    table_log: dict[str, Any] = dataclasses.field(default_factory=dict)  # Logged with the tables (e.g. the step).
+    step_metric: Optional[str] = None  # Metric every other metric is plotted against.
+    resume: Optional[str] = None  # `resume` of `wandb.init`, the default of wandb (or WANDB_RESUME) if None.
+
+
+class Sink(abc.ABC):
+    @abc.abstractmethod
+    def push(self, upload: Upload):
+        """Pushes everything in `upload` to its run."""
+
+    def is_transient(self, error: Exception) -> bool:
+        """Whether pushing again might work."""
+        return False
+
+
+@dataclasses.dataclass
+class WandbSink(Sink):
+    entity: Optional[str] = None  # WANDB_ENTITY and WANDB_PROJECT if None.
+    project: Optional[str] = None
+
+    def push(self, upload: Upload):
+        import wandb
+
+        # Built before anything is logged, so a malformed table is skipped instead of failing the push
+        # (whose retry would log the metrics again).
+        tables = {}
+        for key, table in upload.tables.items():
+            try:
+                tables[key] = wandb.Table(data=table.rows, columns=table.columns)
+            except Exception as error:
+                print(f"WARNING! Skipping table {key} of {upload.run_id}: {error}")
+
+        kwargs = {key: value for key, value in [("entity", self.entity), ("project", self.project),
+                                                ("resume", upload.resume)] if value is not None}
+        with wandb.init(id=upload.run_id, name=upload.name, **kwargs) as run:
+            if upload.step_metric is not None:
+                run.define_metric(upload.step_metric)
+                run.define_metric("*", step_metric=upload.step_metric)
+            for log in upload.logs:
+                run.log(log)
+            for key, table in tables.items():
+                try:
+                    run.log({key: table, **upload.table_log})
+                except Exception as error:
+                    print(f"WARNING! Failed to log table {key} of {upload.run_id}: {error}")
+
+    def is_transient(self, error: Exception) -> bool:
+        import wandb
+
+        return isinstance(error, (wandb.errors.errors.CommError, ConnectionError, TimeoutError))
+
+
+@dataclasses.dataclass
+class LocalSink(Sink):
+    root: Path
+
+    def push(self, upload: Upload):
+        Path(self.root).mkdir(parents=True, exist_ok=True)
+        lines = [{"name": upload.name, "log": log} for log in upload.logs]
+        if len(upload.tables) > 0:
+            lines.append({"name": upload.name, "log": upload.table_log,
+                          "tables": {key: dataclasses.asdict(table) for key, table in upload.tables.items()}})
+        now = time.time()
+        with open(Path(self.root)/f"{upload.run_id}.jsonl", "a") as f:
+            for line in lines:
+                f.write(json.dumps({"time": now, **line}, default=str) + "\n")
+
+
+def get_sink(spec: str, entity: Optional[str] = None, project: Optional[str] = None) -> Sink:
+    if spec == "wandb":
+        return WandbSink(entity, project)
+    if spec.startswith("local:"):
+        return LocalSink(Path(spec[len("local:"):]))
+    raise ValueError(f"Unknown sink {spec}, expected `wandb` or `local:<dir>`")
+
+
+def push(sink: Sink, upload: Upload, retries: int = RETRIES, backoff: float = BACKOFF) -> Optional[str]:
+    """Pushes `upload`, retrying transient failures. Returns the error if it failed in the end, None otherwise."""
+    for attempt in range(retries + 1):
+        try:
+            sink.push(upload)
+            return None
+        except Exception as error:
+            if attempt == retries or not sink.is_transient(error):
+                return "".join(traceback.format_exception_only(type(error), error)).strip()
+            print(f"WARNING! Pushing {upload.run_id} failed ({error}), retrying in {backoff*2**attempt:.0f}s")
+            time.sleep(backoff*2**attempt)
+
+
+def upload(sink: Sink, uploads: list[Upload], workers: int = 4) -> dict[str, Optional[str]]:
+    """Pushes `uploads` with up to `workers` runs at a time, returns run id -> error (None if it was pushed)."""
+    if workers <= 1 or len(uploads) <= 1:
+        return {item.run_id: push(sink, item) for item in uploads}
+    with ProcessPoolExecutor(max_workers=min(workers, len(uploads)),
+                             mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = {item.run_id: pool.submit(push, sink, item) for item in uploads}
+        return {run_id: future.result() for run_id, future in futures.items()}
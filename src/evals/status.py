@@ -0,0 +1,136 @@
+"""Index of the tasks already evaluated in a `LOGS_ROOT`.
+
+Every harness `results*.json` is only read once: the index (an sqlite database in `state_dir(LOGS_ROOT)`)
+remembers the path, mtime and size of each file together with the tasks it contains, and a refresh only
+parses the files that are new or changed since the last one (files that disappeared are dropped).
+Run `python -m evals.status --logs-root $LOGS_ROOT` to refresh and summarize it, `--rebuild` to start from scratch.
+"""
+from __future__ import annotations
+
+import argparse
+import collections
+import json
+import os
+import re
+import sqlite3
+from pathlib import Path
+from typing import Iterator, Optional
+
+from evals.cache import state_dir
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    iteration INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_model ON files (model, iteration);
+CREATE TABLE IF NOT EXISTS tasks (
+    path TEXT NOT NULL REFERENCES files (path) ON DELETE CASCADE,
+    task TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tasks_path ON tasks (path);
+"""
+
+
+def get_status_path(logs_root: Path) -> Path:
+    return state_dir(logs_root)/"status.sqlite"
+
+
+def _scandir(path: Path, pattern: str) -> Iterator[os.DirEntry]:
+    try:
+        with os.scandir(path) as entries:
+            yield from (entry for entry in entries if re.match(pattern, entry.name) is not None)
+    except (FileNotFoundError, NotADirectoryError):
+        return
+
+
+def scan(logs_root: Path, model: str) -> Iterator[tuple[int, os.DirEntry]]:
+    """(iteration, entry) of every `{model}/iter_*/harness/eval_*/*/results*.json` of `logs_root`."""
+    for iter_dir in _scandir(Path(logs_root)/model, "^iter_[0-9]+$"):
+        it = int(iter_dir.name[len("iter_"):])
+        for eval_dir in _scandir(Path(iter_dir.path)/"harness", "^eval_"):
+            for model_dir in _scandir(Path(eval_dir.path), ".*"):
+                if model_dir.is_dir():
+                    for results in _scandir(Path(model_dir.path), r"^results.*\.json$"):
+                        yield it, results
+
+
+class StatusIndex:
+    def __init__(self, path: Path):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = Path(path)
+        self.db = sqlite3.connect(self.path)
+        self.db.execute("PRAGMA foreign_keys = ON")
+        self.db.executescript(SCHEMA)
+
+    @classmethod
+    def open(cls, logs_root: Path) -> StatusIndex:
+        return cls(get_status_path(logs_root))
+
+    def refresh(self, logs_root: Path, model: str) -> int:
+        """Ingests the new or changed results files of `model`, returns how many were read."""
+        known = {path: (mtime_ns, size) for path, mtime_ns, size in
+                 self.db.execute("SELECT path, mtime_ns, size FROM files WHERE model = ?", (model,))}
+        seen = set()
+        read = 0
+        with self.db:
+            for it, entry in scan(logs_root, model):
+                stat = entry.stat()
+                seen.add(entry.path)
+                if known.get(entry.path) == (stat.st_mtime_ns, stat.st_size):
+                    continue
+                try:
+                    with open(entry.path) as f:
+                        tasks = list(json.load(f)["results"])
+                except (json.JSONDecodeError, KeyError):  # Still being written.
+                    continue
+                self.db.execute("DELETE FROM files WHERE path = ?", (entry.path,))
+                self.db.execute("INSERT INTO files VALUES (?, ?, ?, ?, ?)",
+                                (entry.path, model, it, stat.st_mtime_ns, stat.st_size))
+                self.db.executemany("INSERT INTO tasks VALUES (?, ?)", [(entry.path, task) for task in tasks])
+                read += 1
+            self.db.executemany("DELETE FROM files WHERE path = ?", [(path,) for path in set(known) - seen])
+        return read
+
+    def evaluated(self, model: str) -> dict[int, set[str]]:
+        """Iteration -> names of the tasks with results of `model`."""
+        status = collections.defaultdict(set)
+        query = "SELECT files.iteration, tasks.task FROM files JOIN tasks USING (path) WHERE files.model = ?"
+        for it, task in self.db.execute(query, (model,)):
+            status[it].add(task)
+        return status
+
+    def models(self) -> list[str]:
+        return [model for model, in self.db.execute("SELECT DISTINCT model FROM files ORDER BY model")]
+
+    def clear(self, model: Optional[str] = None):
+        with self.db:
+            if model is None:
+                self.db.execute("DELETE FROM files")
+            else:
+                self.db.execute("DELETE FROM files WHERE model = ?", (model,))
+
+
+def main(logs_root: Path, models: list[str], rebuild: bool):
+    index = StatusIndex.open(logs_root)
+    if len(models) == 0:
+        models = sorted(path.name for path in Path(logs_root).iterdir() if path.is_dir())
+    for model in models:
+        if rebuild:
+            index.clear(model)
+        read = index.refresh(logs_root, model)
+        status = index.evaluated(model)
+        print(f"{model}: {len(status)} iterations, {sum(map(len, status.values()))} task results ({read} files read)")
+    print("Index:", index.path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Refresh (or rebuild) the index of evaluated tasks of a LOGS_ROOT.")
+    parser.add_argument("--logs-root", type=Path, required=True)
+    parser.add_argument("--models", nargs="*", default=[], help="Models to index (all the ones in LOGS_ROOT by default).")
+    parser.add_argument("--rebuild", action="store_true", help="Forget everything indexed and read all results again.")
+    main(**vars(parser.parse_args()))
@@ -1,19 +1,21 @@
 from __future__ import annotations
 
 import re
+import concurrent.futures
 import dataclasses
 import enum
-import json
 import os
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Optional
 
-import requests
-import iso639
-import prtpy
+# Heavy dependencies (requests, iso639, prtpy) are imported where they are needed,
+# this module is imported by CLIs that must start fast (see `scripts/check_import_time.py`).
+from evals.cache import JsonCache, DEFAULT_TTL, cache_dir, is_offline
 
 
-REQUEST_CACHE = {}
+# datasets-server responses, persisted across runs (see `python -m evals.cache`).
+DATASET_INFO = JsonCache(cache_dir()/"datasets_info.json",
+                         ttl=float(os.environ.get("EVALS_CACHE_TTL", DEFAULT_TTL)))
 
 
 class Dimension(enum.StrEnum):
@@ -36,6 +38,21 @@ class Dimension(enum.StrEnum):
         raise ValueError(f"Could not infer dimension for task {task}")
 
 
+@dataclasses.dataclass(frozen=True)
+class Language:
+    """The subset of `iso639.Lang` we use, so compiled catalogs can be loaded without iso639."""
+    name: str
+    pt1: str
+    pt3: str
+
+    @classmethod
+    def get(cls, code_or_name: str) -> Language:
+        import iso639
+
+        lang = iso639.Lang(code_or_name)
+        return cls(lang.name, lang.pt1, lang.pt3)
+
+
 class TaskKind(enum.StrEnum):
     pretrain = enum.auto()
     posttrain = enum.auto()
@@ -46,10 +63,15 @@ class Task:
     name: str
     kinds: tuple[TaskKind]
     size: int = None
-    language: iso639.Lang = None
+    language: Language = None
     dimension: Dimension = None
     alias: tuple[str] = ()
 
+    @property
+    def result_names(self) -> tuple[str, ...]:
+        """Names under which the harness reports the results of this task."""
+        return self.alias if len(self.alias) > 0 else (self.name,)
+
     def __hash__(self) -> int:
         return hash((self.name, self.kinds, self.size, self.language.pt1, self.dimension, self.alias))
 
@@ -60,26 +82,110 @@ class Task:
         if self.language is None:
             chunks = self.name.split("_")
             if len(chunks) == 1:  # no language code, assume English.
-                self.language = iso639.Lang("en")
+                self.language = Language.get("en")
             elif len(chunks[-1]) == 2:  # iso639 already expected.
-                self.language = iso639.Lang(chunks[-1])
+                self.language = Language.get(chunks[-1])
             else:  # full name of the language given.
-                self.language = iso639.Lang(chunks[-1].title())
+                self.language = Language.get(chunks[-1].title())
         if self.dimension is None:
             self.dimension = Dimension.get(self.name)
 
-def _infer_size(name: str) -> int:
-    def query(source: str) -> dict:
-        headers = {"Authorization": f"Bearer {os.environ['HF_TOKEN']}"}
-        url = f"https://datasets-server.huggingface.co/info?dataset={source}"
-        response = requests.get(url, headers=headers)
-        return response.json()
+# Get `source, config` when exact names match.
+EXACT_SOURCES = {
+    "hellaswag": ("Rowan/hellaswag", "default"),
+    "mmlu": ("cais/mmlu", "all"),
+    "winogrande": ("allenai/winogrande", "winogrande_xl"),
+    "ai2_arc": ("allenai/ai2_arc", None),
+    "cultural_bench": ("kellycyy/CulturalBench", None),
+    "aime": ("AI-MO/aimo-validation-aime", None),
+    "gsm8k": ("openai/gsm8k", "main")
+}
+
+# Get `source` and infer language when task names have underscores.
+UNDERSCORE_SOURCES = {
+    "arc": "alexandrainst/m_arc",
+    "global_mmlu": "CohereLabs/Global-MMLU-Lite",
+    "hellaswag": "alexandrainst/m_hellaswag",
+    "include_base_44": "CohereLabs/include-base-44",
+    "xcopa": "cambridgeltl/xcopa",
+    "xnli": "facebook/xnli",
+    "xwinograd": "Muennighoff/xwinograd",
+}
+
+# These tasks use a very specific split:
+SPECIFIC_SPLITS = {
+    r"xnli_.*": "validation",
+    "winogrande": "validation",
+    "^hellaswag$": "validation",
+}
+
+
+def _get_source(name: str) -> tuple[str, Optional[str]]:
+    # Get `source ` and `config` based on the above dicts.
+    if name in EXACT_SOURCES:
+        source, config = EXACT_SOURCES[name]
+    elif "_" in name:
+        root = "_".join(name.split("_")[:-1])
+        if root not in UNDERSCORE_SOURCES:
+            raise ValueError(f"Could not infer size for task {name}")
+        source = UNDERSCORE_SOURCES[root]
+        config = name.split("_")[-1]
+    else:
+        raise ValueError(f"Could not infer size for task {name}")
+    if name.startswith("include_base_44"):  # Include languages need to start with Capital letters.
+        config = config.title()
+    return source, config
+
+
+def _query(source: str) -> dict:
+    import requests
+
+    headers = {}
+    if "HF_TOKEN" in os.environ:  # Public datasets can be queried anonymously.
+        headers["Authorization"] = f"Bearer {os.environ['HF_TOKEN']}"
+    url = f"https://datasets-server.huggingface.co/info?dataset={source}"
+    response = requests.get(url, headers=headers, timeout=30)
+    response.raise_for_status()
+    return response.json()
+
+
+def prefetch_dataset_info(sources: set[str], max_workers: int = 8):
+    """Makes sure the datasets-server info of all `sources` is cached, fetching the missing ones in parallel."""
+    missing = sorted(source for source in sources if not DATASET_INFO.is_fresh(source))
+    if len(missing) == 0:
+        return
+    import requests
+
+    if is_offline():
+        unavailable = [source for source in missing if DATASET_INFO.get(source, allow_stale=True) is None]
+        if len(unavailable) > 0:
+            raise RuntimeError(f"Offline mode requested but dataset info is not cached for: {unavailable}")
+        return
 
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(max_workers, len(missing))) as pool:
+        futures = {pool.submit(_query, source): source for source in missing}
+        for future in concurrent.futures.as_completed(futures):
+            source = futures[future]
+            try:
+                DATASET_INFO.put(source, future.result())
+            except requests.RequestException as err:
+                if DATASET_INFO.get(source, allow_stale=True) is None:
+                    raise
+                print(f"WARNING! Could not refresh info of {source} ({err}), using stale cache")
+    DATASET_INFO.save()
+
+
+def _get_dataset_info(source: str) -> dict:
+    prefetch_dataset_info({source})
+    return DATASET_INFO.get(source, allow_stale=True)
+
+
+def _infer_size(name: str) -> int:
     def get_split(names: list[str]) -> str:
-        maybe_specific = [pattern for pattern in specific_splits if re.match(pattern, name) is not None]
+        maybe_specific = [pattern for pattern in SPECIFIC_SPLITS if re.match(pattern, name) is not None]
         if len(maybe_specific):
             pattern, = maybe_specific
-            return specific_splits[pattern]
+            return SPECIFIC_SPLITS[pattern]
         if len(names) == 1:
             return names[0]
         if "test" in names:
@@ -87,51 +193,8 @@ def _infer_size(name: str) -> int:
 
         print("Unknown", name, names)
 
-    # Get `source, config` when exact names match.
-    exact_sources = {
-        "hellaswag": ("Rowan/hellaswag", "default"),
-        "mmlu": ("cais/mmlu", "all"),
-        "winogrande": ("allenai/winogrande", "winogrande_xl"),
-        "ai2_arc": ("allenai/ai2_arc", None),
-        "cultural_bench": ("kellycyy/CulturalBench", None),
-        "aime": ("AI-MO/aimo-validation-aime", None),
-        "gsm8k": ("openai/gsm8k", "main")
-    }
-
-    # Get `source` and infer language when task names have underscores.
-    underscore_sources = {
-        "arc": "alexandrainst/m_arc",
-        "global_mmlu": "CohereLabs/Global-MMLU-Lite",
-        "hellaswag": "alexandrainst/m_hellaswag",
-        "include_base_44": "CohereLabs/include-base-44",
-        "xcopa": "cambridgeltl/xcopa",
-        "xnli": "facebook/xnli",
-        "xwinograd": "Muennighoff/xwinograd",
-    }
-
-    # These tasks use a very specific split:
-    specific_splits = {
-        r"xnli_.*": "validation",
-        "winogrande": "validation",
-        "^hellaswag$": "validation",
-    }
-
-    # Get `source ` and `config` based on the above dicts.
-    if name in exact_sources:
-        source, config = exact_sources[name]
-    elif "_" in name:
-        root = "_".join(name.split("_")[:-1])
-        if root not in underscore_sources:
-            raise ValueError(f"Could not infer size for task {name}")
-        source = underscore_sources[root]
-        config = name.split("_")[-1]
-    else:
-        raise ValueError(f"Could not infer size for task {name}")
-    if name.startswith("include_base_44"):  # Include languages need to start with Capital letters.
-        config = config.title()
-    if source not in REQUEST_CACHE:  # HTTPS request if not already queried.
-        REQUEST_CACHE[source] = query(source)
-    req = REQUEST_CACHE[source]
+    source, config = _get_source(name)
+    req = _get_dataset_info(source)
 
     # Get the `split_name` available.
     if config is None:
@@ -145,10 +208,13 @@ def _infer_size(name: str) -> int:
     return sum(splits[split_name]["num_examples"] for splits in all_splits)
 
 
-def get_all_tasks(all_tasks_json: Path = Path("configs/all_tasks.json")) -> list[Task]:
-    with open(all_tasks_json) as f:
-        raw_tasks = json.load(f)
-    
+def build_tasks(raw_tasks: dict) -> list[Task]:
+    """Builds all tasks specified in the `all_tasks.json` format, inferring the missing fields."""
+    # Fetch the metadata of all datasets whose size needs to be inferred at once.
+    to_infer = [name for names in raw_tasks["infer"].values() for name in names]
+    to_infer += [row["name"] for row in raw_tasks["other"] if row.get("size") is None]
+    prefetch_dataset_info({_get_source(name)[0] for name in to_infer})
+
     tasks = []
     for kind, names in raw_tasks["infer"].items():
         for name in names:
@@ -158,7 +224,7 @@ def get_all_tasks(all_tasks_json: Path = Path("configs/all_tasks.json")) -> list
             name=row["name"],
             kinds=tuple(row["kinds"]),
             size=row.get("size"),
-            language=None if row["language"] is None else iso639.Lang(row["language"]),
+            language=None if row["language"] is None else Language.get(row["language"]),
             dimension=row.get("dimension"),
             alias=tuple(row.get("alias", ())),
         ))
@@ -166,12 +232,22 @@ def get_all_tasks(all_tasks_json: Path = Path("configs/all_tasks.json")) -> list
     return tasks
 
 
+def get_all_tasks(all_tasks_json: Path = Path("configs/all_tasks.json")) -> list[Task]:
+    from evals.catalog import TaskCatalog
+
+    return list(TaskCatalog.load(all_tasks_json))
+
+
 def get_partition(tasks: Optional[list[Task]] = None, shards: int = 1,
-                  all_tasks_json: Path = Path("configs/all_tasks.json")) -> tuple[list[Task], ...]:
+                  all_tasks_json: Path = Path("configs/all_tasks.json"),
+                  cost: Optional[Callable[[Task], float]] = None) -> tuple[list[Task], ...]:
+    """Splits `tasks` in `shards` balanced parts, by `cost` (see `evals.cost`) or by number of rows if not given."""
 
     if tasks is None:
         tasks = get_all_tasks(all_tasks_json=all_tasks_json)
     if shards == 1:
         return tasks,
+    import prtpy
+
     return tuple(prtpy.partition(prtpy.partitioning.greedy, shards, tasks,
-                                 valueof=lambda task: task.size))
+                                 valueof=(lambda task: task.size) if cost is None else cost))
@@ -0,0 +1,109 @@
+"""Parallel, resumable and verified directory copies, used to move converted checkpoints across filesystems.
+
+`shutil.move` across filesystems is a single-threaded copy that leaves a half-copied destination if interrupted.
+Instead, files are copied by a pool of threads into `{dest}.partial` (each one through a `.part` file renamed once
+complete, so an interrupted transfer resumes from the files already there), verified (sizes, and checksums
+computed while copying) and only then renamed to `dest`, so `dest` existing means the copy is complete.
+Files in `last` (e.g. the `.complete` marker of a checkpoint) are copied after all the others.
+Run `python -m evals.transfer SRC DEST` to copy a directory by hand.
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+
+PARTIAL_SUFFIX = ".partial"
+PART_SUFFIX = ".part"
+CHUNK_SIZE = 64*1024*1024
+
+
+def checksum(path: Path) -> str:
+    digest = hashlib.blake2b()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def copy_file(src: Path, dest: Path) -> str:
+    """Copies `src` to `dest` through a temporary file, returns the checksum of `src`."""
+    tmp = dest.with_name(dest.name + PART_SUFFIX)
+    digest = hashlib.blake2b()
+    with open(src, "rb") as fin, open(tmp, "wb") as fout:
+        while chunk := fin.read(CHUNK_SIZE):
+            fout.write(chunk)
+            digest.update(chunk)
+    shutil.copystat(src, tmp)
+    os.replace(tmp, dest)
+    return digest.hexdigest()
+
+
+def is_copied(src: Path, dest: Path) -> bool:
+    """Whether `dest` is a finished copy of `src` from an earlier (interrupted) transfer."""
+    if not dest.exists():
+        return False
+    src_stat, dest_stat = src.stat(), dest.stat()
+    return src_stat.st_size == dest_stat.st_size and int(src_stat.st_mtime) == int(dest_stat.st_mtime)
+
+
+def copy_tree(src: Path, dest: Path, workers: int = 8, verify: bool = True, last: tuple[str, ...] = ()) -> int:
+    """Copies the directory `src` to `dest` (which must not exist), returns the bytes copied.
+
+    Raises `OSError` if a copy doesn't match its source, the partial copy is kept to resume from.
+    """
+    src, dest = Path(src), Path(dest)
+    if dest.exists():
+        raise FileExistsError(dest)
+    partial = dest.with_name(dest.name + PARTIAL_SUFFIX)
+    files = []
+    for root, dirs, fnames in os.walk(src):
+        (partial/Path(root).relative_to(src)).mkdir(parents=True, exist_ok=True)
+        files += [(Path(root)/fname).relative_to(src) for fname in fnames]
+    files.sort(key=lambda rel: (str(rel) in last, -(src/rel).stat().st_size))  # Biggest first, `last` at the end.
+
+    def transfer(rel: Path) -> tuple[int, int]:
+        if is_copied(src/rel, partial/rel):
+            if verify and checksum(src/rel) != checksum(partial/rel):
+                (partial/rel).unlink()
+                return transfer(rel)
+            return 0, (src/rel).stat().st_size
+        digest = copy_file(src/rel, partial/rel)
+        if (src/rel).stat().st_size != (partial/rel).stat().st_size or verify and digest != checksum(partial/rel):
+            (partial/rel).unlink()
+            raise OSError(f"Copy of {src/rel} does not match its source")
+        return (src/rel).stat().st_size, (src/rel).stat().st_size
+
+    start = time.time()
+    regular = [rel for rel in files if str(rel) not in last]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(transfer, regular))
+    results += [transfer(rel) for rel in files if str(rel) in last]
+    copied, total = sum(result[0] for result in results), sum(result[1] for result in results)
+    for leftover in partial.rglob(f"*{PART_SUFFIX}"):  # Of copies interrupted before.
+        leftover.unlink()
+    os.rename(partial, dest)
+    elapsed = time.time() - start
+    print(f"Copied {src} to {dest}: {total/1e9:.1f}GB ({(total - copied)/1e9:.1f}GB resumed) "
+          f"in {elapsed/60:.1f}min ({copied/1e9/max(elapsed, 1e-3):.2f}GB/s)")
+    return copied
+
+
+def main(src: Path, dest: Path, workers: int, no_verify: bool, last: Optional[list[str]]):
+    copy_tree(src, dest, workers, not no_verify, tuple(last or []))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Copy a directory in parallel, resuming and verifying the copy.")
+    parser.add_argument("src", type=Path)
+    parser.add_argument("dest", type=Path)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--no-verify", action="store_true", help="Only compare sizes, not checksums.")
+    parser.add_argument("--last", nargs="*", help="Files (relative to src) copied after all the others, e.g. markers.")
+    main(**vars(parser.parse_args()))
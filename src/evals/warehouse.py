@@ -0,0 +1,200 @@
+"""Columnar store of the harness results of a `LOGS_ROOT`, for analyses across models and iterations.
+
+Ingestion reads every new or changed `{model}/iter_*/harness/eval_*/*/results*.json` once and keeps only what
+is needed for metrics (not the large per task `configs`), in parquet tables under `state_dir(LOGS_ROOT)/warehouse`,
+partitioned by model and iteration (`{table}/model={model}/iteration={it}/part.parquet`):
+- `metrics`: path, task, metric, filter, value (the `results` section, e.g. `acc,none` is metric `acc` filter `none`),
+- `samples`: path, task, original, effective (the `n-samples` section),
+- `groups`: path, group, subtask (the `group_subtasks` section),
+- `files`: path, mtime_ns, size and the timing of the run (`date`, `start_time`, `end_time`,
+  `total_evaluation_time_seconds`), also used to know what was already ingested.
+Only the partitions of the iterations whose files changed are rewritten (atomically, so readers never see a
+partial one). Query them with `load`, e.g. `load(logs_root, "metrics", models=["apertus-8b"]).to_pandas()`.
+Run `python -m evals.warehouse --logs-root $LOGS_ROOT` to ingest and summarize it, `--rebuild` to start from scratch.
+"""
+from __future__ import annotations
+
+import argparse
+import collections
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional
+
+from evals.cache import state_dir
+from evals.status import scan
+
+if TYPE_CHECKING:  # pyarrow is slow to import, only load it when actually reading or writing.
+    import pyarrow as pa
+
+
+TABLES = ["metrics", "samples", "groups", "files"]
+PART = "part.parquet"
+TIMING = ["date", "start_time", "end_time", "total_evaluation_time_seconds"]
+
+
+def get_schemas() -> dict[str, pa.Schema]:
+    import pyarrow as pa
+
+    return {"metrics": pa.schema([("path", pa.string()), ("task", pa.string()), ("metric", pa.string()),
+                                  ("filter", pa.string()), ("value", pa.float64())]),
+            "samples": pa.schema([("path", pa.string()), ("task", pa.string()), ("original", pa.int64()),
+                                  ("effective", pa.int64())]),
+            "groups": pa.schema([("path", pa.string()), ("group", pa.string()), ("subtask", pa.string())]),
+            "files": pa.schema([("path", pa.string()), ("mtime_ns", pa.int64()), ("size", pa.int64())] +
+                               [(name, pa.float64()) for name in TIMING])}
+
+
+def get_warehouse_dir(logs_root: Path) -> Path:
+    return state_dir(logs_root)/"warehouse"
+
+
+def get_part(root: Path, table: str, model: str, it: int) -> Path:
+    return Path(root)/table/f"model={model}"/f"iteration={it}"/PART
+
+
+def _float(value) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def read_file(path: str, stat: os.stat_result) -> Optional[dict[str, list[dict]]]:
+    """The rows of each table for a results file, None if it can't be read (e.g. still being written or just removed)."""
+    try:
+        with open(path) as f:
+            info = json.load(f)
+        results = info["results"]
+    except (OSError, json.JSONDecodeError, KeyError):
+        return None
+    rows = {"metrics": [], "samples": [], "groups": [],
+            "files": [{"path": path, "mtime_ns": stat.st_mtime_ns, "size": stat.st_size,
+                       **{name: _float(info.get(name)) for name in TIMING}}]}
+    for task, details in results.items():
+        for name, value in details.items():
+            if name == "alias" or isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            metric, _, metric_filter = name.partition(",")
+            rows["metrics"].append({"path": path, "task": task, "metric": metric, "filter": metric_filter,
+                                    "value": float(value)})
+    for task, details in info.get("n-samples", {}).items():
+        rows["samples"].append({"path": path, "task": task, "original": details.get("original"),
+                                "effective": details.get("effective")})
+    for group, subtasks in info.get("group_subtasks", {}).items():
+        rows["groups"] += [{"path": path, "group": group, "subtask": subtask} for subtask in subtasks]
+    return rows
+
+
+def _write(table: pa.Table, dest: Path):
+    import pyarrow.parquet as pq
+
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=dest.parent, prefix=f".{dest.name}.")
+    os.close(fd)
+    pq.write_table(table, tmp)
+    os.replace(tmp, dest)
+
+
+def ingest(logs_root: Path, model: str, root: Optional[Path] = None) -> int:
+    """Ingests the new or changed results files of `model`, returns how many were read."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    root = get_warehouse_dir(logs_root) if root is None else Path(root)
+    schemas = get_schemas()
+    known = collections.defaultdict(dict)  # Iteration -> path -> (mtime_ns, size).
+    model_dir = Path(root)/"files"/f"model={model}"
+    if model_dir.exists():
+        for part in model_dir.glob(f"iteration=*/{PART}"):
+            it = int(part.parent.name[len("iteration="):])
+            for row in pq.ParquetFile(part).read(columns=["path", "mtime_ns", "size"]).to_pylist():
+                known[it][row["path"]] = row["mtime_ns"], row["size"]
+
+    current = collections.defaultdict(dict)
+    for it, entry in scan(logs_root, model):
+        stat = entry.stat()
+        current[it][entry.path] = stat
+
+    read = 0
+    for it, files in current.items():
+        changed = [path for path, stat in files.items() if known[it].get(path) != (stat.st_mtime_ns, stat.st_size)]
+        removed = set(known[it]) - set(files)
+        if len(changed) == 0 and len(removed) == 0:
+            continue
+        rows = {table: [] for table in TABLES}
+        unreadable = set()
+        for path in changed:
+            file_rows = read_file(path, files[path])
+            if file_rows is None:  # Ingested once it can be read, keep the rows of its previous version until then.
+                unreadable.add(path)
+                continue
+            for table in TABLES:
+                rows[table] += file_rows[table]
+            read += 1
+        drop = pa.array(sorted(set(changed) - unreadable | removed), pa.string())
+        for table in TABLES:
+            part = get_part(root, table, model, it)
+            new = pa.Table.from_pylist(rows[table], schema=schemas[table])
+            if part.exists():
+                old = pq.ParquetFile(part).read()
+                new = pa.concat_tables([old.filter(pc.invert(pc.is_in(old["path"], drop))), new])
+            _write(new, part)
+
+    # Iterations whose results disappeared.
+    for it in set(known) - set(current):
+        for table in TABLES:
+            shutil.rmtree(get_part(root, table, model, it).parent, ignore_errors=True)
+    return read
+
+
+def load(logs_root: Path, table: str = "metrics", models: Optional[list[str]] = None,
+         iterations: Optional[list[int]] = None, tasks: Optional[list[str]] = None,
+         columns: Optional[list[str]] = None, root: Optional[Path] = None) -> pa.Table:
+    """The rows of `table` (with their `model` and `iteration`) matching the given filters, in one scan."""
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    root = get_warehouse_dir(logs_root) if root is None else Path(root)
+    partitioning = ds.partitioning(pa.schema([("model", pa.string()), ("iteration", pa.int64())]), flavor="hive")
+    if not (root/table).exists():
+        schema = get_schemas()[table].append(pa.field("model", pa.string())).append(pa.field("iteration", pa.int64()))
+        return schema.empty_table().select(schema.names if columns is None else columns)
+    dataset = ds.dataset(root/table, format="parquet", partitioning=partitioning)
+    expression = None
+    for column, values in [("model", models), ("iteration", iterations), ("task", tasks)]:
+        if values is not None:
+            condition = ds.field(column).isin(values)
+            expression = condition if expression is None else expression & condition
+    return dataset.to_table(columns=columns, filter=expression)
+
+
+def clear(logs_root: Path, model: Optional[str] = None, root: Optional[Path] = None):
+    root = get_warehouse_dir(logs_root) if root is None else Path(root)
+    for table in TABLES:
+        shutil.rmtree(Path(root)/table if model is None else Path(root)/table/f"model={model}", ignore_errors=True)
+
+
+def main(logs_root: Path, models: list[str], rebuild: bool):
+    if len(models) == 0:
+        models = sorted(path.name for path in Path(logs_root).iterdir() if path.is_dir())
+    for model in models:
+        if rebuild:
+            clear(logs_root, model)
+        read = ingest(logs_root, model)
+        files = load(logs_root, "files", models=[model], columns=["iteration"])
+        metrics = load(logs_root, "metrics", models=[model], columns=["task"])
+        print(f"{model}: {len(set(files['iteration'].to_pylist()))} iterations, {len(files)} results files, "
+              f"{len(metrics)} metrics ({read} files read)")
+    print("Warehouse:", get_warehouse_dir(logs_root))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest the harness results of a LOGS_ROOT into a parquet warehouse.")
+    parser.add_argument("--logs-root", type=Path, required=True)
+    parser.add_argument("--models", nargs="*", default=[], help="Models to ingest (all the ones in LOGS_ROOT by default).")
+    parser.add_argument("--rebuild", action="store_true", help="Forget everything ingested and read all results again.")
+    main(**vars(parser.parse_args()))
@@ -0,0 +1,105 @@
+import os
+import tempfile
+
+# Must be set before `evals.tasks` is imported: its dataset info cache is created at import time.
+os.environ.setdefault("EVALS_CACHE_DIR", tempfile.mkdtemp(prefix="evals-tests-"))
+os.environ["EVALS_OFFLINE"] = "1"
+
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    """Every test gets its own `EVALS_CACHE_DIR`, so no state leaks between them."""
+    path = tmp_path/"cache"
+    monkeypatch.setenv("EVALS_CACHE_DIR", str(path))
+    return path
+
+
+LANGUAGES = {"en": ("English", "eng"), "de": ("German", "deu"), "fr": ("French", "fra"), "it": ("Italian", "ita")}
+
+
+@pytest.fixture
+def make_catalog():
+    """Builds a `TaskCatalog` without the network: `make_catalog({"arc_de": 100, ...}, aliases={...})`.
+
+    Languages are taken from the task name suffix (English when there is none).
+    """
+    from evals.catalog import TaskCatalog
+
+    def make(sizes: dict[str, int], aliases: dict[str, list[str]] = {}, groups: dict[str, str] = {},
+             dimension: str = "general_abilities", version: str = "test") -> TaskCatalog:
+        rows = []
+        for name, size in sizes.items():
+            code = name.split("_")[-1] if name.split("_")[-1] in LANGUAGES else "en"
+            language = LANGUAGES[code]
+            group = groups.get(name, name[:-len(code) - 1] if name.endswith(f"_{code}") else name)
+            rows.append({"name": name, "kinds": ["pretrain"], "size": size, "dimension": dimension,
+                         "language": {"name": language[0], "pt1": code, "pt3": language[1]},
+                         "alias": aliases.get(name, []), "group": group})
+        return TaskCatalog.from_lock({"version": version, "tasks": rows})
+
+    return make
+
+
+@pytest.fixture
+def write_results():
+    """Writes a harness `results*.json` (and `consumed_tokens.txt`) of `{model}/iter_{it}` of a logs root.
+
+    `results` maps each task to its accuracy (with a stderr of 0.01) or to all its `{metric: value}`.
+    """
+    import json
+
+    def write(logs_root, model: str, it: int, results: dict, eval_dir: str = "eval_1", sizes: dict[str, int] = {},
+              group_subtasks: dict[str, list[str]] = {}, name: str = "results_2025.json"):
+        iter_dir = logs_root/model/f"iter_{it}"
+        path = iter_dir/"harness"/eval_dir/"org__model"/name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        (iter_dir/"consumed_tokens.txt").write_text(str(it*1000))
+        results = {task: value if isinstance(value, dict) else {"acc,none": value, "acc_stderr,none": 0.01}
+                   for task, value in results.items()}
+        path.write_text(json.dumps({
+            "results": {task: {"alias": task, **metrics} for task, metrics in results.items()},
+            "n-samples": {task: {"original": sizes.get(task, 100), "effective": sizes.get(task, 100)}
+                          for task in results if task not in group_subtasks},
+            "group_subtasks": group_subtasks,
+        }))
+        return path
+
+    return write
+
+
+@pytest.fixture
+def write_samples():
+    """Writes the harness samples file of `task` next to a results file, a line per `{doc_id, metric: score}`."""
+    import json
+
+    def write(results_path, task: str, samples: list[dict]):
+        path = results_path.parent/f"samples_{task}_{results_path.stem[len('results_'):]}.jsonl"
+        path.write_text("".join(json.dumps({"doc": {"question": "?"}, "filter": "none", **sample}) + "\n"
+                                for sample in samples))
+        return path
+
+    return write
+
+
+@pytest.fixture
+def make_cfg(tmp_path, make_catalog):
+    """A `--cfg` directory for `scripts/update_wandb.py`, with a compiled catalog of the given tasks."""
+    import hashlib
+    import json
+
+    def make(sizes: dict[str, int], aggregations: dict, show_in_table: list[str], aliases: dict = {},
+             language_groups: dict[str, list[str]] = {"english": ["eng"]}):
+        cfg = tmp_path/"cfg"
+        cfg.mkdir(exist_ok=True)
+        lock = make_catalog(sizes, aliases=aliases).to_lock()
+        content = json.dumps(lock["tasks"]).encode()  # Unique per catalog, compiled catalogs are memoized by hash.
+        (cfg/"all_tasks.json").write_bytes(content)
+        lock["version"] = hashlib.sha256(content).hexdigest()
+        (cfg/"all_tasks.lock.json").write_text(json.dumps(lock))
+        (cfg/"tasks.json").write_text(json.dumps({"show_in_table": show_in_table, "language_groups": language_groups}))
+        (cfg/"aggregations.json").write_text(json.dumps(aggregations))
+        return cfg
+
+    return make
@@ -0,0 +1,187 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from evals.aggregate import INVALID_NUM, Graph, Group, Results, State, StateStore, aggregate, load_groups
+
+SIZES = {"hellaswag": 100, "hellaswag_de": 100, "hellaswag_fr": 100, "arc_de": 100, "arc_fr": 100,
+         "ai2_arc": 100, "cultural_bench": 100}
+CULTURAL_BENCH = {"cultural_bench": ["cultural_bench_easy", "cultural_bench_hard"],
+                  "cultural_bench_easy": ["cultural_bench_easy_c0", "cultural_bench_easy_c1"],
+                  "cultural_bench_hard": ["cultural_bench_hard_c0"]}
+AGGREGATIONS = json.loads((Path(__file__).parent.parent/"configs"/"aggregations.json").read_text())
+TASKS_CFG = {"language_groups": {"english": ["eng"], "european": ["deu", "fra"]}}
+
+
+@pytest.fixture
+def catalog(make_catalog):
+    return make_catalog(SIZES, aliases={"ai2_arc": ["arc_easy", "arc_challenge"]})
+
+
+@pytest.fixture
+def get_graph(tmp_path, catalog):
+    def get(aggregations: dict) -> Graph:
+        path = tmp_path/"aggregations.json"
+        path.write_text(json.dumps(aggregations))
+        return Graph(load_groups(path, TASKS_CFG, catalog))
+    return get
+
+
+def get_info(results: dict, sizes: dict[str, int] = {}, group_subtasks: dict[str, list[str]] = {}) -> dict:
+    """The harness `results.json` of `results` (task -> {metric: value}), 100 samples per task by default."""
+    return {"results": {task: {"alias": task, **{f"{metric},none": value for metric, value in metrics.items()}}
+                        for task, metrics in results.items()},
+            "n-samples": {task: {"original": sizes.get(task, 100), "effective": sizes.get(task, 100)}
+                          for task in results if task not in group_subtasks},
+            "group_subtasks": group_subtasks}
+
+
+def get_logs(graph: Graph, *infos: dict) -> dict[str, float]:
+    results = Results()
+    results.add("k", list(infos))
+    return aggregate(results, graph)[0]["k"]
+
+
+def test_load_groups(get_graph, capsys):
+    graph = get_graph({
+        "families": [{"prefix": "m_hellaswag", "group": "hellaswag", "exclude": ["hellaswag"]},
+                     {"prefix": "arc", "tasks": ["arc_easy", "arc_challenge", "arc_xx"]},
+                     {"prefix": "both", "tasks": ["ai2_arc", "arc_de"], "macro": False},
+                     {"prefix": "xnli", "group": "xnli"},
+                     {"prefix": "cultural_bench", "subtasks_of": "cultural_bench", "exclude": ["cultural_bench_hard"]}],
+        "averages": [{"prefix": "All Tasks/{language_group}", "over": ["language_group"], "micro": False},
+                     {"prefix": "{dimension}/{language_group}", "over": ["language_group", "dimension"],
+                      "dimension_metrics": {"general_abilities": ["acc_norm"]}}],
+    })
+    assert graph.groups == [
+        Group("m_hellaswag", ("hellaswag_de", "hellaswag_fr"), exclude=("hellaswag",), complete=True),
+        Group("arc", ("arc_easy", "arc_challenge"), complete=True),
+        Group("both", ("arc_easy", "arc_challenge", "arc_de"), complete=True, macro=False),
+        Group("cultural_bench", subtasks_of="cultural_bench", exclude=("cultural_bench_hard",), complete=True),
+        Group("All Tasks/english", ("hellaswag", "arc_easy", "arc_challenge", "cultural_bench"), micro=False),
+        Group("All Tasks/european", ("hellaswag_de", "hellaswag_fr", "arc_de", "arc_fr"), micro=False),
+        Group("General Abilities/english", ("hellaswag", "arc_easy", "arc_challenge", "cultural_bench"),
+              metrics=("acc_norm",)),
+        Group("General Abilities/european", ("hellaswag_de", "hellaswag_fr", "arc_de", "arc_fr"),
+              metrics=("acc_norm",)),
+    ]
+    out = capsys.readouterr().out
+    assert "Tasks of the family arc not in the catalog: ['arc_xx']" in out
+    assert "Not aggregating the families without members in the catalog: xnli" in out
+
+
+def test_macro_and_micro(get_graph, capsys):
+    graph = get_graph({
+        "families": [{"prefix": "m_hellaswag", "group": "hellaswag", "exclude": ["hellaswag"]}],
+        "averages": [{"prefix": "All Tasks/{language_group}", "over": ["language_group"], "micro": False,
+                      "metrics": ["acc"]}],
+    })
+    info = get_info({"hellaswag_de": {"acc": 0.4, "acc_stderr": 0.01, "acc_norm": 0.2},
+                     "hellaswag_fr": {"acc": 0.6, "acc_stderr": 0.01},
+                     "arc_de": {"acc": 0.2}, "arc_fr": {"acc": 0.3}},
+                    sizes={"hellaswag_de": 100, "hellaswag_fr": 300})
+    logs = get_logs(graph, info)
+    assert logs["hellaswag_de/acc"] == 0.4
+    assert logs["m_hellaswag.macro/acc"] == pytest.approx(0.5)
+    assert logs["m_hellaswag.micro/acc"] == pytest.approx((0.4*100 + 0.6*300)/400)
+    assert logs["m_hellaswag.macro/acc_norm"] == logs["m_hellaswag.micro/acc_norm"] == 0.2  # Only where reported.
+    assert "m_hellaswag.macro/acc_stderr" not in logs
+    assert logs["All Tasks/european.macro/acc"] == pytest.approx((0.4 + 0.6 + 0.2 + 0.3)/4)
+    assert not any(key.startswith("All Tasks/european.micro") for key in logs)
+    assert logs["All Tasks/english.macro/acc"] == INVALID_NUM  # hellaswag, ai2_arc and cultural_bench are missing.
+    assert "Aggregation for All Tasks/english not available" in capsys.readouterr().out
+
+
+def test_families_missing_members_are_not_logged(get_graph, capsys):
+    graph = get_graph({"families": [{"prefix": "m_arc", "group": "arc"}, {"prefix": "xcb", "subtasks_of": "xcb"}],
+                       "averages": []})
+    logs = get_logs(graph, get_info({"arc_de": {"acc": 0.2}}))
+    assert logs == {"arc_de/acc": 0.2}
+    assert "Not logging the families missing members (found/expected): m_arc 1/2 (missing arc_fr), " \
+           "xcb not evaluated" in capsys.readouterr().out
+
+
+def test_reported_subtasks(get_graph):
+    """The legacy `cultural_bench` aggregates: the harness group (leaves of its subgroups) and its micro average."""
+    graph = get_graph(AGGREGATIONS | {"averages": [
+        {"prefix": "All Tasks/{language_group}", "over": ["language_group"], "micro": False, "metrics": ["acc"]}]})
+    leaves = {"cultural_bench_easy_c0": 0.1, "cultural_bench_easy_c1": 0.2, "cultural_bench_hard_c0": 0.6}
+    results = {name: {"acc": value} for name, value in leaves.items()}
+    results |= {name: {"acc": 0.9} for name in CULTURAL_BENCH}  # Overwritten by the aggregates.
+    results |= {"hellaswag": {"acc": 0.5}, "arc_easy": {"acc": 0.7}, "arc_challenge": {"acc": 0.3}}
+    logs = get_logs(graph, get_info(results, sizes={"cultural_bench_easy_c0": 100, "cultural_bench_easy_c1": 100,
+                                                    "cultural_bench_hard_c0": 200}, group_subtasks=CULTURAL_BENCH))
+    micro = (0.1*100 + 0.2*100 + 0.6*200)/400
+    assert logs["cultural_bench.macro/acc"] == pytest.approx(0.3)
+    assert logs["cultural_bench.micro/acc"] == logs["cultural_bench/acc"] == pytest.approx(micro)
+    assert logs["cultural_bench_easy.macro/acc"] == pytest.approx(0.15)
+    assert logs["cultural_bench_hard.micro/acc"] == pytest.approx(0.6)
+    assert logs["arc.macro/acc"] == pytest.approx(0.5)
+    # Averaged over the aggregate written into `cultural_bench`, not what the harness reported.
+    assert logs["All Tasks/english.macro/acc"] == pytest.approx((0.5 + 0.7 + 0.3 + micro)/4)
+
+    del results["cultural_bench_easy_c1"]
+    logs = get_logs(graph, get_info(results, group_subtasks=CULTURAL_BENCH))
+    assert "cultural_bench.macro/acc" not in logs
+    assert "cultural_bench_easy.macro/acc" not in logs
+    assert logs["cultural_bench_hard.macro/acc"] == pytest.approx(0.6)
+    assert logs["cultural_bench/acc"] == 0.9
+
+
+def test_changed():
+    info = get_info({"arc_de": {"acc": 0.2}, "arc_fr": {"acc": 0.3}})
+    before = Results()
+    before.add("k", [info])
+
+    after = Results()
+    after.add("k", [get_info({"arc_de": {"acc": 0.2}, "arc_fr": {"acc": 0.4}, "hellaswag": {"acc": 0.5}})])
+    assert after.changed("k", before) == {"arc_fr", "hellaswag"}
+    after.add("k", [get_info({"arc_de": {"acc": 0.2}, "arc_fr": {"acc": 0.3}}, sizes={"arc_de": 50})])
+    assert after.changed("k", before) == {"arc_de"}
+    after.add("k", [info])
+    assert after.changed("k", before) == set()
+
+    after.add("k", [get_info({"arc_de": {"acc": 0.2, "acc_norm": 0.1}, "arc_fr": {"acc": 0.3}})])
+    assert after.changed("k", before) is None  # Every group aggregates every metric.
+    after.add("k", [{**info, "group_subtasks": {"arc": ["arc_de", "arc_fr"]}}])
+    assert after.changed("k", before) is None  # Members of the `subtasks_of` groups.
+
+
+@pytest.mark.parametrize("update", [
+    {"hellaswag_fr": {"acc": 0.8}},
+    {"cultural_bench_hard_c0": {"acc": 0.1}},
+    {"arc_easy": {"acc": 0.9}, "arc_de": {"acc": 0.1}},
+])
+def test_incremental_matches_full(get_graph, update):
+    graph = get_graph(AGGREGATIONS)
+    results = {name: {"acc": 0.1*i, "acc_norm": 0.05*i} for i, name in enumerate(
+        ["hellaswag", "hellaswag_de", "hellaswag_fr", "arc_de", "arc_easy", "arc_challenge", "cultural_bench",
+         "cultural_bench_easy", "cultural_bench_hard", "cultural_bench_easy_c0", "cultural_bench_easy_c1",
+         "cultural_bench_hard_c0"])}
+    previous = Results()
+    previous.add(("m", 100), [get_info(results, group_subtasks=CULTURAL_BENCH)])
+    previous.add(("m", 200), [get_info(results, group_subtasks=CULTURAL_BENCH)])
+    _, previous_outputs = aggregate(previous, graph)
+
+    current = Results()
+    current.add(("m", 100), [get_info(results, group_subtasks=CULTURAL_BENCH)])
+    current.add(("m", 200), [get_info(results | update | {"arc_fr": {"acc": 0.5}}, group_subtasks=CULTURAL_BENCH)])
+    logs, outputs = aggregate(current, graph, previous, previous_outputs)
+    assert (logs, outputs) == aggregate(current, graph)
+    assert "m_arc.macro/acc" in logs[("m", 200)] and "m_arc.macro/acc" not in logs[("m", 100)]
+    assert outputs[("m", 100)] == previous_outputs[("m", 100)]
+
+
+def test_state_store(tmp_path):
+    store = StateStore.open(tmp_path/"logs")
+    assert store.get("m", 100) is None
+    state = State("graph", {"results.json": ("1:2", get_info({"arc_de": {"acc": 0.2}}))},
+                  [{"m_arc.macro": {"acc": 0.2}}, {}])
+    store.put({("m", 100): state})
+    store.close()
+    store = StateStore.open(tmp_path/"logs")
+    assert store.get("m", 100) == state
+    assert store.get("m", 200) is None
+    store.put({("m", 100): State("other", {}, [])})
+    assert store.get("m", 100) == State("other", {}, [])
@@ -0,0 +1,81 @@
+import collections
+import json
+
+import pytest
+
+from alignment.wandb_alignment_utils import (create_model_evaluation_from_results, get_sample_files, index_eval_dir,
+                                             reservoir_sample, upload_multi_model_results)
+from evals import samples
+
+TIMESTAMP = "2025-01-01T00-00-00.0"
+
+
+@pytest.fixture
+def eval_dir(tmp_path):
+    """An evaluation directory with the samples of `t` in two subdirectories, and an aggregation task `g`."""
+    eval_dir = tmp_path/"harness"/"eval_1"
+    for name, size in [("m", 5000), ("other", 300)]:
+        (eval_dir/name).mkdir(parents=True)
+        with open(eval_dir/name/f"samples_t_{TIMESTAMP}.jsonl", "w") as f:
+            for i in range(size):
+                f.write(json.dumps({"doc_id": i, "where": name, "doc": {"text": "y"*100}}) + "\n")
+    (eval_dir/"m"/f"results_{TIMESTAMP}.json").write_text(json.dumps({"results": {
+        "g": {"alias": "g", "acc,none": 0.5}, "t": {"alias": "t", "acc,none": 0.5, "acc_stderr,none": "N/A"}}}))
+    return eval_dir
+
+
+def get_drawn(eval_dir, seed: int = 3) -> list[tuple[str, int]]:
+    evaluation = create_model_evaluation_from_results("model", eval_dir, 12, seed=seed)
+    task, = [task for task in evaluation.tasks if task.task_name == "t"]
+    return [(sample.sample_data["where"], sample.sample_data["doc_id"]) for sample in task.samples]
+
+
+def test_sample_files(eval_dir):
+    index = index_eval_dir(eval_dir)
+    assert sorted(index) == [f"m/results_{TIMESTAMP}.json", f"m/samples_t_{TIMESTAMP}.jsonl",
+                             f"other/samples_t_{TIMESTAMP}.jsonl"]
+    assert get_sample_files(index, TIMESTAMP) == {"t": [eval_dir/"m"/f"samples_t_{TIMESTAMP}.jsonl",
+                                                        eval_dir/"other"/f"samples_t_{TIMESTAMP}.jsonl"]}
+    assert get_sample_files(index, "2024-01-01T00-00-00.0") == {}
+
+    compacted = samples.compact(eval_dir/"m"/f"samples_t_{TIMESTAMP}.jsonl")
+    (eval_dir/"m"/f"samples_t_{TIMESTAMP}.jsonl").write_text("")  # A leftover of the compaction.
+    assert get_sample_files(index_eval_dir(eval_dir), TIMESTAMP)["t"][0] == compacted
+
+
+def test_model_evaluation(eval_dir):
+    evaluation = create_model_evaluation_from_results("model", eval_dir, 12)
+    assert evaluation.get_flattened_metrics() == {"g/acc": 0.5, "t/acc": 0.5}
+    assert [task.sample_count for task in evaluation.tasks] == [0, 12]
+    drawn = get_drawn(eval_dir)
+    assert drawn == sorted(drawn) and len(set(drawn)) == 12  # In file order.
+    assert drawn == get_drawn(eval_dir) != get_drawn(eval_dir, seed=4)
+
+
+def test_reservoir_sample_is_uniform(tmp_path):
+    path = tmp_path/f"samples_t_{TIMESTAMP}.jsonl"
+    path.write_text("".join(json.dumps({"doc_id": i}) + "\n" for i in range(20)))
+    assert [sample.sample_data["doc_id"] for sample in reservoir_sample([path], 50)] == list(range(20))
+    counts = collections.Counter(sample.sample_data["doc_id"] for seed in range(2000)
+                                 for sample in reservoir_sample([path], 5, seed))
+    assert sorted(counts) == list(range(20))
+    assert all(abs(count - 2000*5/20) < 100 for count in counts.values())
+
+
+def test_same_samples_after_compaction(eval_dir):
+    before = get_drawn(eval_dir)
+    assert {where for where, _ in before} == {"m", "other"}
+    samples.compact(eval_dir/"m"/f"samples_t_{TIMESTAMP}.jsonl", block_bytes=20_000)
+    assert not (eval_dir/"m"/f"samples_t_{TIMESTAMP}.jsonl").exists()
+    assert get_drawn(eval_dir) == before
+
+
+def test_upload(tmp_path, eval_dir):
+    evaluation = create_model_evaluation_from_results("model", eval_dir, 3)
+    upload_multi_model_results("entity", "project", [evaluation], ["t/acc", "missing/acc"],
+                               sink=f"local:{tmp_path/'out'}", workers=1)
+    log, tables = [json.loads(line) for line in (tmp_path/"out"/"model-001.jsonl").read_text().splitlines()]
+    assert log["log"] == {"g/acc": 0.5, "t/acc": 0.5}
+    assert tables["tables"]["main_results"] == {"columns": ["model", "t/acc"], "rows": [["model", 0.5]]}
+    samples_table = tables["tables"]["samples/model/t"]
+    assert samples_table["columns"] == ["doc_id", "where", "doc/text"] and len(samples_table["rows"]) == 3
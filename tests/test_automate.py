@@ -0,0 +1,283 @@
+import json
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+import automate
+from automate import Automation, acquire_lock, get_available
+from evals import checkpoints, packs
+from evals.catalog import TaskCatalog
+from evals.cost import CostModel
+from evals.scheduler import FakeScheduler
+
+ROOT = Path(__file__).parent.parent
+HOUR = 3600
+
+
+@pytest.fixture
+def make_automation(tmp_path, make_catalog, monkeypatch):
+    """Builds an `Automation` on a `FakeScheduler` whose jobs never finish on their own.
+
+    Every task takes one second per row, so sizes are in seconds.
+    """
+    monkeypatch.chdir(ROOT)  # For `configs/tasks.json`.
+    monkeypatch.setattr(automate, "_ITERATIONS", {})
+
+    def make(sizes: dict[str, int], models: dict[str, dict], **overrides) -> Automation:
+        catalog = make_catalog(sizes)
+        monkeypatch.setattr(TaskCatalog, "load", classmethod(lambda cls, *args: catalog))
+        cfg = {"logs_root": str(tmp_path/"logs"), "hf_temp_dir": str(tmp_path/"hf_temp"),
+               "hf_storage_dir": str(tmp_path/"hf_storage"), "hf_cache_quota_gb": 1, "transfer_workers": 2,
+               "walltime_hours": 12, "walltime_margin": 0.1, "job_overhead_minutes": 0, "makespan_weight": 1.0,
+               "cost_model_max_age_hours": 24, "tasks_per_run": 4, "failure_backoff_hours": 1,
+               "failure_max_backoff_hours": 24, "failure_quarantine": 3, "models": models, **overrides}
+        config_path = tmp_path/f"automation{len(list(tmp_path.glob('automation*.json')))}.json"
+        config_path.write_text(json.dumps(cfg))
+        scheduler = FakeScheduler(4, lambda job: (float("inf"), True))
+        automation = Automation(config_path, scheduler=scheduler)
+        sizes = {model.get("size", 1) for model in models.values()}
+        automation.cost_model = CostModel(rates={"hf": {float(size): {name: 1.0 for name in catalog.by_name}
+                                                        for size in sizes}})
+        return automation
+
+    return make
+
+
+def make_checkpoints(model_dir: Path, iterations: list[int], latest: int = None) -> str:
+    for it in iterations:
+        (model_dir/f"iter_{it:07d}").mkdir(parents=True, exist_ok=True)
+    if latest is not None:
+        (model_dir/"latest_checkpointed_iteration.txt").write_text(str(latest))
+    return str(model_dir)
+
+
+def megatron_model(model_dir: str, **fields) -> dict:
+    return {"model_dirs": [model_dir], "size": 8, "tokens_per_iter": "1000", "frequency": 100,
+            "start_eval_from": 100, **fields}
+
+
+def test_lock_is_per_logs_root(tmp_path):
+    lock = acquire_lock(tmp_path/"a", timeout=0)
+    with pytest.raises(SystemExit, match="Another automation"):
+        acquire_lock(tmp_path/"a", timeout=0)
+    start = time.time()
+    with pytest.raises(SystemExit):
+        acquire_lock(tmp_path/"a", timeout=0.3, poll=0.05)
+    assert time.time() - start >= 0.3
+    acquire_lock(tmp_path/"b", timeout=0).close()
+    lock.close()
+    acquire_lock(tmp_path/"a", timeout=0).close()
+
+
+def test_iterations_wait_for_the_tracker(tmp_path, monkeypatch):
+    monkeypatch.setattr(automate, "_ITERATIONS", {})
+    model_dir = make_checkpoints(tmp_path/"ckpts", [100, 200, 300], latest=200)
+    assert sorted(get_available([model_dir])) == [100, 200]
+    (Path(model_dir)/"latest_checkpointed_iteration.txt").write_text("300")
+    os.utime(Path(model_dir)/"latest_checkpointed_iteration.txt", ns=(1, 1))
+    assert sorted(get_available([model_dir, tmp_path/"missing"])) == [100, 200, 300]
+
+
+def test_signature_tracks_checkpoints_jobs_and_config(tmp_path, make_automation):
+    model_dir = make_checkpoints(tmp_path/"ckpts", [100])
+    automation = make_automation({"hellaswag": 10}, {"m": megatron_model(model_dir)})
+    signature = automation.get_signature(["eval_other_mixed_100"])
+    assert automation.get_signature(["eval_other_mixed_100", "unrelated"]) == signature
+    assert automation.get_signature(["eval_m_mixed_100"]) != signature
+
+    make_checkpoints(tmp_path/"ckpts", [200])
+    assert automation.get_signature(["eval_other_mixed_100"]) != signature
+    signature = automation.get_signature([])
+    os.utime(automation.config_path, ns=(1, 1))
+    assert automation.get_signature([]) != signature
+
+
+def write_results(automation: Automation, name: str, it: int, tasks: list[str]):
+    path = Path(automation.cfg["logs_root"])/name/f"iter_{it}"/"harness"/f"eval_{it}"/"org__model"/"results_1.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps({"results": {task: {"acc,none": 0.5} for task in tasks}}))
+
+
+def eval_jobs(automation: Automation) -> list[str]:
+    return [jobname for _, jobname in automation.scheduler.jobs() if jobname.startswith("eval_")]
+
+
+@pytest.fixture
+def queued(tmp_path, make_automation):
+    """An automation whose jobs never start, with three one hour tasks (`arc_de` is not shown in the main table).
+
+    Every task gets its own default shard: `arc_de`, `hellaswag` and `mmlu` in this order.
+    """
+    def make(iterations: list[int], model_fields: dict = {}, **overrides) -> Automation:
+        model_dir = make_checkpoints(tmp_path/"ckpts", iterations)
+        automation = make_automation({"arc_de": HOUR, "hellaswag": HOUR, "mmlu": HOUR},
+                                     {"m": megatron_model(model_dir, **model_fields)}, **overrides)
+        automation.scheduler.nodes = 0
+        return automation
+    return make
+
+
+def test_submissions_by_priority(queued):
+    automation = queued([100, 200, 300, 400], {"force_iters": [100]}, max_jobs=5)
+    write_results(automation, "m", 400, ["hellaswag", "mmlu"])
+    write_results(automation, "m", 300, ["hellaswag", "mmlu"])
+    automation.submit_needed()
+    # Pinned first, then the iterations missing headline tasks (headline shards first), then the newest ones.
+    assert eval_jobs(automation) == ["eval_m_shard1of3_100", "eval_m_shard2of3_100", "eval_m_shard0of3_100",
+                                     "eval_m_shard1of3_200", "eval_m_shard2of3_200"]
+
+    automation.cfg["max_jobs"] = 7
+    automation.submit_needed()
+    assert eval_jobs(automation)[5:] == ["eval_m_shard0of3_400", "eval_m_shard0of3_300"]
+    automation.submit_needed()
+    assert len(eval_jobs(automation)) == 7
+
+
+def test_jobs_per_model_are_capped_round_robin(tmp_path, make_automation):
+    models = {name: megatron_model(make_checkpoints(tmp_path/name, [100, 200])) for name in ["a", "b"]}
+    automation = make_automation({"hellaswag": HOUR, "mmlu": HOUR}, models, max_jobs_per_model=3)
+    automation.scheduler.nodes = 0
+    automation.submit_needed()
+    assert sorted(eval_jobs(automation)) == ["eval_a_shard0of2_100", "eval_a_shard0of2_200", "eval_a_shard1of2_200",
+                                             "eval_b_shard0of2_100", "eval_b_shard0of2_200", "eval_b_shard1of2_200"]
+
+
+def test_obsolete_jobs_are_cancelled(queued):
+    automation = queued([100], max_pending_iterations=1)
+    automation.submit_needed()
+    assert len(eval_jobs(automation)) == 3
+
+    # A newer checkpoint supersedes the queued jobs of the old one, including its materialization.
+    make_checkpoints(Path(automation.cfg["models"]["m"]["model_dirs"][0]), [200])
+    automation.submit_needed()
+    assert [jobname for _, jobname in automation.scheduler.jobs()] == \
+        ["mat_m_200", "eval_m_shard1of3_200", "eval_m_shard2of3_200", "eval_m_shard0of3_200"]
+    cancelled = [job.name for job in automation.scheduler.history.values() if job.cancelled]
+    assert sorted(cancelled) == ["eval_m_shard0of3_100", "eval_m_shard1of3_100", "eval_m_shard2of3_100", "mat_m_100"]
+
+
+def test_jobs_with_the_same_name_are_cancelled_by_id(queued):
+    automation = queued([100])
+    ids = [automation.scheduler.submit("scripts/evaluate.sbatch", [], "eval_m_mixed_100", {}) for _ in range(2)]
+    automation.scheduler.submit("scripts/other.sbatch", [], "unrelated", {})
+    automation.submit_needed()
+    assert eval_jobs(automation) == ["eval_m_mixed_100", "eval_m_mixed_100"]  # A mixed job might have everything.
+
+    write_results(automation, "m", 100, ["arc_de", "hellaswag", "mmlu"])
+    automation.submit_needed()
+    assert automation.scheduler.states(ids) == {job_id: "CANCELLED" for job_id in ids}
+    assert [jobname for _, jobname in automation.scheduler.jobs()] == ["unrelated"]
+
+
+def test_failed_evaluations_are_retried_with_backoff(tmp_path, make_automation):
+    model_dir = make_checkpoints(tmp_path/"ckpts", [100])
+    automation = make_automation({"hellaswag": HOUR, "mmlu": HOUR}, {"m": megatron_model(model_dir)},
+                                 failure_quarantine=2)
+    scheduler = automation.scheduler = FakeScheduler(4, lambda job: (60, job.name.startswith("mat_")))
+    automation.get_time = lambda: scheduler.now
+
+    def submitted() -> list[str]:
+        return sorted(job.name for job in scheduler.history.values() if job.name.startswith("eval_"))
+
+    automation.submit_needed()
+    scheduler.advance(10*60)
+    automation.submit_needed()  # Both shards failed, wait an hour.
+    assert submitted() == ["eval_m_shard0of2_100", "eval_m_shard1of2_100"]
+    scheduler.advance(HOUR)
+    automation.submit_needed()
+    assert len(submitted()) == 2
+    scheduler.advance(HOUR + 10*60)
+    automation.submit_needed()
+    assert submitted() == ["eval_m_shard0of2_100"]*2 + ["eval_m_shard1of2_100"]*2
+    scheduler.advance(4*HOUR)
+    automation.submit_needed()  # Failed twice, quarantined.
+    assert len(submitted()) == 4
+    assert len(automation.get_ledger().quarantined()) == 2
+
+
+def test_single_gpu_evaluations_are_packed(tmp_path, make_automation):
+    models = {name: megatron_model(make_checkpoints(tmp_path/name, [100, 200, 300]), size=1) for name in ["a", "b"]}
+    automation = make_automation({"hellaswag": HOUR}, models, single_gpu_max_size=4, max_pending_iterations=1)
+    automation.scheduler.nodes = 0
+    automation.submit_needed()
+    packed = [jobname for _, jobname in automation.scheduler.jobs() if not jobname.startswith("mat_")]
+    assert len(packed) == 1 and packed[0].startswith("pack_")
+    assert sorted(jobname for _, jobname in automation.get_jobs() if jobname.startswith("eval_")) == \
+        ["eval_a_shard0of1_300", "eval_b_shard0of1_300"]
+    job = automation.scheduler.history[automation.scheduler.jobs()[-1][0]]
+    assert job.script == "scripts/evaluate_pack.sbatch"
+    assert sorted(job.dependency.split(":")) == sorted(job_id for job_id, jobname in automation.scheduler.jobs()
+                                                       if jobname.startswith("mat_"))
+
+    # Still needed as long as one of its evaluations is.
+    make_checkpoints(tmp_path/"a", [400])
+    automation.submit_needed()
+    assert packed[0] in [jobname for _, jobname in automation.scheduler.jobs()]
+    make_checkpoints(tmp_path/"b", [400])
+    automation.submit_needed()
+    assert packed[0] not in [jobname for _, jobname in automation.scheduler.jobs()]
+    assert sorted(jobname for _, jobname in automation.get_jobs() if jobname.startswith("eval_")) == \
+        ["eval_a_shard0of1_400", "eval_b_shard0of1_400"]
+
+
+def batched_slots(automation: Automation) -> list[tuple[str, list[str]]]:
+    packs_dir = packs.get_packs_dir(Path(automation.cfg["logs_root"]))
+    return [(job.script, [slot.jobname for slot in packs.read_pack(packs_dir, job.name)] if packs.is_pack(job.name)
+             else [job.name]) for job in automation.scheduler.history.values() if not job.name.startswith("mat_")]
+
+
+def test_checkpoints_are_batched_within_the_walltime(tmp_path, make_automation):
+    model_dir = make_checkpoints(tmp_path/"ckpts", [100, 200, 300, 400, 500])
+    automation = make_automation({"hellaswag": 4*HOUR}, {"m": megatron_model(model_dir)},
+                                 max_batch_size=2, batch_item_overhead_minutes=30)
+    automation.scheduler.nodes = 0
+    automation.submit_needed()
+    assert batched_slots(automation) == [
+        ("scripts/evaluate_batch.sbatch", ["eval_m_shard0of1_100", "eval_m_shard0of1_200"]),
+        ("scripts/evaluate_batch.sbatch", ["eval_m_shard0of1_300", "eval_m_shard0of1_400"]),
+        ("scripts/evaluate.sbatch", ["eval_m_shard0of1_500"]),  # Alone, not worth a batch.
+    ]
+
+
+def test_batches_are_capped_by_the_walltime(tmp_path, make_automation):
+    model_dir = make_checkpoints(tmp_path/"ckpts", [100, 200, 300])
+    automation = make_automation({"hellaswag": 5*HOUR}, {"m": megatron_model(model_dir)},
+                                 max_batch_size=4, batch_item_overhead_minutes=20)
+    automation.scheduler.nodes = 0
+    automation.submit_needed()
+    # 2*(5h + 20min) fit in the 10.8h available, a third one doesn't.
+    assert [slots for _, slots in batched_slots(automation)] == \
+        [["eval_m_shard0of1_100", "eval_m_shard0of1_200"], ["eval_m_shard0of1_300"]]
+
+
+def test_jobs_activate_the_prebuilt_environments(tmp_path, make_automation):
+    model_dir = make_checkpoints(tmp_path/"ckpts", [100])
+    automation = make_automation({"hellaswag": HOUR}, {"m": megatron_model(model_dir)}, envs_dir=str(tmp_path/"envs"))
+    automation.scheduler.nodes = 0
+    automation.submit_needed()
+    for job in automation.scheduler.history.values():
+        assert job.env["ENVS_DIR"] == str(tmp_path/"envs")
+        assert job.env["CONTAINER"] == automate.get_container(False)
+
+
+def test_finished_checkpoints_move_to_the_storage_cache(tmp_path, make_automation):
+    model_dir = make_checkpoints(tmp_path/"ckpts", [100])
+    automation = make_automation({"hellaswag": HOUR}, {"m": megatron_model(model_dir)})
+    temp_dir, storage_dir = Path(automation.cfg["hf_temp_dir"]), Path(automation.cfg["hf_storage_dir"])
+    for it in [100, 200]:
+        entry = temp_dir/checkpoints.get_entry_name("m", it, "abc123")
+        entry.mkdir(parents=True)
+        (entry/"model.safetensors").write_bytes(b"x"*100)
+        (entry/checkpoints.MARKER).write_text('{"bytes": 100}')
+    (temp_dir/(checkpoints.get_entry_name("m", 300, "abc123") + checkpoints.PARTIAL_SUFFIX)).mkdir()
+    automation.scheduler.submit("scripts/evaluate.sbatch", [], "eval_m_mixed_200", {})
+
+    automation.update_hf_checkpoints()
+    automation.wait_transfers()
+    # Checkpoints still in use stay, leftovers of failed conversions are removed.
+    assert sorted(path.name for path in temp_dir.iterdir()) == [checkpoints.get_entry_name("m", 200, "abc123")]
+    entry, = checkpoints.list_entries(storage_dir)
+    assert (entry.it, entry.size) == (100, 100)
+    assert (entry.path/"model.safetensors").read_bytes() == b"x"*100
@@ -0,0 +1,127 @@
+import json
+import math
+import random
+
+import numpy as np
+import pytest
+
+from evals import bootstrap
+from evals.aggregate import Graph, Group, Results, aggregate
+
+SUBTASKS = {"arc": ["arc_de", "arc_fr"]}
+
+
+@pytest.fixture
+def write_iteration(tmp_path, write_results, write_samples):
+    """Writes the results and samples of `m/iter_{it}`, with an accuracy of about `p` on every task."""
+    def write(it: int, p: float, sizes: dict[str, int] = {"arc_de": 300, "arc_fr": 100, "hellaswag": 200},
+              without_samples: list[str] = []):
+        rng = random.Random(it)
+        scores = {task: [{"doc_id": i, "acc": float(rng.random() < p), "f1": rng.random(), "bleu": [1, 2]}
+                         for i in range(size)] for task, size in sizes.items()}
+        results = {task: {"acc,none": statistics(samples, "acc"), "acc_stderr,none": 0.01,
+                          "f1,none": statistics(samples, "f1"), "bleu,none": 3.0} for task, samples in scores.items()}
+        results["arc"] = {"acc,none": sum(results[task]["acc,none"]*sizes[task] for task in SUBTASKS["arc"]) /
+                          sum(sizes[task] for task in SUBTASKS["arc"])}
+        path = write_results(tmp_path/"logs", "m", it, results, sizes=sizes, group_subtasks=SUBTASKS)
+        for task, samples in scores.items():
+            if task not in without_samples:
+                write_samples(path, task, samples)
+        return path
+    return write
+
+
+def statistics(samples: list[dict], metric: str) -> float:
+    return sum(sample[metric] for sample in samples)/len(samples)
+
+
+def get_intervals(tmp_path, groups: list[Group], iterations: list[int], resamples: int = 1000):
+    graph = Graph(groups)
+    results = Results()
+    for it in iterations:
+        path = next((tmp_path/"logs"/"m"/f"iter_{it}").rglob("results*.json"))
+        results.add(("m", it), [json.loads(path.read_text())])
+    logs, outputs = aggregate(results, graph)
+    directories = {"m": {it: tmp_path/"logs"/"m"/f"iter_{it}" for it in iterations}}
+    return logs, bootstrap.confidence_intervals(tmp_path/"logs", results, graph, outputs, directories, resamples)
+
+
+def test_read_samples(tmp_path):
+    path = tmp_path/"samples_arc_de_2025.jsonl"
+    path.write_text("\n".join(json.dumps(sample) for sample in [
+        {"doc_id": 1, "target": 2, "filter": "none", "acc": 1, "bleu": [1, 2]},
+        {"doc_id": 0, "target": 2, "filter": "none", "acc": 0, "bleu": [1, 2]},
+        {"doc_id": 0, "filter": "strict", "metrics": ["exact_match"], "exact_match": True, "acc": 1.0},
+        {"doc_id": 1, "filter": "strict", "metrics": ["exact_match"], "exact_match": False},
+    ]) + "\n")
+    samples = bootstrap.read_samples(path)
+    assert samples.doc_ids.tolist() == [0, 1]
+    assert samples.metrics == ["acc", "exact_match"]
+    assert samples.values.tolist() == [[0.0, 1.0], [1.0, 0.0]]
+
+    path.write_text(path.read_text() + '{"doc_id": 2, "ac')  # Still being written.
+    assert bootstrap.read_samples(path) is None
+
+
+def test_load_samples_is_cached(tmp_path, monkeypatch):
+    path = tmp_path/"samples_arc_de_2025.jsonl"
+    path.write_text("".join(json.dumps({"doc_id": i, "acc": i % 2}) + "\n" for i in range(10)))
+    samples = bootstrap.load_samples(path, tmp_path/"cache")
+    monkeypatch.setattr(bootstrap, "read_samples", None)
+    cached = bootstrap.load_samples(path, tmp_path/"cache")
+    assert cached.metrics == samples.metrics == ["acc"]
+    assert (cached.values == samples.values).all() and (cached.doc_ids == samples.doc_ids).all()
+
+
+@pytest.mark.parametrize("binary", [True, False])
+def test_resample_means(binary):
+    rng = np.random.default_rng(0)
+    values = (rng.random((400, 1)) < 0.3).astype(float) if binary else rng.random((400, 1))
+    means = bootstrap.resample_means(values, 20_000, np.random.default_rng(1))
+    assert means.shape == (20_000, 1)
+    assert means.mean() == pytest.approx(values.mean(), abs=1e-3)
+    assert means.std() == pytest.approx(values.std()/math.sqrt(len(values)), rel=0.03)
+
+
+def test_draws_are_seeded_by_task(tmp_path, write_iteration):
+    write_iteration(100, 0.5)
+    samples = bootstrap.IterationSamples(tmp_path/"logs"/"m"/"iter_100", tmp_path/"cache")
+    first, _ = bootstrap.draw_task("arc_de", samples.get("arc_de"), None, 100)
+    again, _ = bootstrap.draw_task("arc_de", samples.get("arc_de"), None, 100)
+    other, _ = bootstrap.draw_task("arc_fr", samples.get("arc_de"), None, 100)
+    assert (first["acc"] == again["acc"]).all() and not (first["acc"] == other["acc"]).all()
+
+
+def test_intervals_and_deltas(tmp_path, write_iteration):
+    write_iteration(100, 0.5)
+    write_iteration(200, 0.6)
+    groups = [Group("m_arc", ("arc_de", "arc_fr"), complete=True),
+              Group("All", ("arc", "hellaswag"), micro=False)]  # Over the harness group `arc`.
+    logs, intervals = get_intervals(tmp_path, groups, [100, 200])
+    assert "Bootstrap/BaseOptStep" not in intervals["m", 100]
+    current, previous = logs["m", 200], logs["m", 100]
+    values = intervals["m", 200]
+    assert values["Bootstrap/BaseOptStep"] == 100
+    for name in ["m_arc.macro", "m_arc.micro", "All.macro"]:
+        for metric in ["acc", "f1"]:
+            point = current[f"{name}/{metric}"]
+            assert values[f"{name}/{metric}_ci_low"] < point < values[f"{name}/{metric}_ci_high"]
+            delta = values[f"{name}/{metric}_delta"]
+            assert delta == pytest.approx(point - previous[f"{name}/{metric}"])
+            assert values[f"{name}/{metric}_delta_ci_low"] < delta < values[f"{name}/{metric}_delta_ci_high"]
+    assert values["m_arc.macro/acc_ci_high"] - values["m_arc.macro/acc_ci_low"] == pytest.approx(
+        2*1.96*math.sqrt(0.6*0.4/300 + 0.6*0.4/100)/2, rel=0.2)
+    assert not any(key.startswith("arc_de/bleu") for key in values)  # Not the mean of its samples.
+    assert not any("acc_stderr" in key for key in values)
+
+    _, again = get_intervals(tmp_path, groups, [100, 200])
+    assert again == intervals
+
+
+def test_members_without_samples(tmp_path, write_iteration):
+    write_iteration(100, 0.5, without_samples=["arc_fr"])
+    groups = [Group("m_arc", ("arc_de", "arc_fr"), complete=True), Group("m_hellaswag", ("hellaswag",))]
+    _, intervals = get_intervals(tmp_path, groups, [100])
+    assert not any(key.startswith(("m_arc", "arc/")) for key in intervals["m", 100])
+    assert "arc_de/acc_ci_low" not in intervals["m", 100]  # Only the aggregates get intervals.
+    assert "m_hellaswag.macro/acc_ci_low" in intervals["m", 100]
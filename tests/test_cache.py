@@ -0,0 +1,113 @@
+import json
+import time
+
+import pytest
+
+from evals import tasks
+from evals.cache import JsonCache, is_offline, state_dir, write_json
+
+
+def test_put_save_and_reload(tmp_path):
+    cache = JsonCache(tmp_path/"info.json")
+    cache.put("a", {"rows": 1})
+    assert cache.get("a") == {"rows": 1}
+    assert not (tmp_path/"info.json").exists()
+    cache.save()
+    assert JsonCache(tmp_path/"info.json").get("a") == {"rows": 1}
+
+
+def test_stale_entries_are_only_a_fallback(tmp_path):
+    cache = JsonCache(tmp_path/"info.json", ttl=60)
+    cache.put("a", 1)
+    cache.entries["a"]["time"] = time.time() - 120
+    assert not cache.is_fresh("a")
+    assert cache.get("a") is None
+    assert cache.get("a", allow_stale=True) == 1
+
+
+def test_save_merges_concurrent_writers(tmp_path):
+    first = JsonCache(tmp_path/"info.json")
+    second = JsonCache(tmp_path/"info.json")
+    first.put("a", 1)
+    second.put("b", 2)
+    first.save()
+    second.save()
+    assert set(JsonCache(tmp_path/"info.json").entries) == {"a", "b"}
+    assert second.get("a") == 1
+
+
+def test_invalidate(tmp_path):
+    cache = JsonCache(tmp_path/"info.json")
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.save()
+    cache.invalidate(["a"])
+    assert set(JsonCache(tmp_path/"info.json").entries) == {"b"}
+    cache.invalidate()
+    assert not (tmp_path/"info.json").exists()
+    assert cache.get("b") is None
+
+
+def test_corrupted_file_reads_as_empty(tmp_path):
+    (tmp_path/"info.json").write_text("{not json")
+    assert JsonCache(tmp_path/"info.json").entries == {}
+
+
+def test_write_json_is_atomic(tmp_path):
+    write_json(tmp_path/"sub"/"x.json", {"a": 1})
+    assert json.loads((tmp_path/"sub"/"x.json").read_text()) == {"a": 1}
+    assert [path.name for path in (tmp_path/"sub").iterdir()] == ["x.json"]
+
+
+def test_state_dir_is_keyed_by_resolved_path(tmp_path, cache_dir):
+    (tmp_path/"logs").mkdir()
+    assert state_dir(tmp_path/"logs") == state_dir(tmp_path/"logs"/".."/"logs")
+    assert state_dir(tmp_path/"logs") != state_dir(tmp_path/"other")
+    assert state_dir(tmp_path/"logs").parent == cache_dir/"state"
+
+
+def test_offline_flags(monkeypatch):
+    monkeypatch.delenv("EVALS_OFFLINE")
+    monkeypatch.delenv("HF_HUB_OFFLINE", raising=False)
+    assert not is_offline()
+    monkeypatch.setenv("HF_HUB_OFFLINE", "1")
+    assert is_offline()
+    monkeypatch.setenv("EVALS_OFFLINE", "false")
+    assert not is_offline()
+
+
+@pytest.fixture
+def dataset_info(tmp_path, monkeypatch):
+    cache = JsonCache(tmp_path/"datasets_info.json", ttl=60)
+    monkeypatch.setattr(tasks, "DATASET_INFO", cache)
+    return cache
+
+
+def test_prefetch_offline_uses_stale_cache(dataset_info):
+    dataset_info.put("cached", {"x": 1})
+    dataset_info.entries["cached"]["time"] = 0
+    tasks.prefetch_dataset_info({"cached"})
+    with pytest.raises(RuntimeError, match="missing"):
+        tasks.prefetch_dataset_info({"cached", "missing"})
+
+
+def test_prefetch_queries_only_missing_sources(dataset_info, monkeypatch):
+    requests = pytest.importorskip("requests")
+    monkeypatch.setenv("EVALS_OFFLINE", "0")
+    dataset_info.put("fresh", {"x": 0})
+    dataset_info.put("stale", {"x": 1})
+    dataset_info.entries["stale"]["time"] = 0
+    queried = []
+
+    def query(source):
+        queried.append(source)
+        if source == "stale":
+            raise requests.ConnectionError("down")
+        return {"x": 2}
+
+    monkeypatch.setattr(tasks, "_query", query)
+    tasks.prefetch_dataset_info({"fresh", "stale", "new"})
+    assert sorted(queried) == ["new", "stale"]
+    assert dataset_info.get("new") == {"x": 2}
+    assert dataset_info.get("stale", allow_stale=True) == {"x": 1}
+    assert JsonCache(dataset_info.path).get("new") == {"x": 2}
@@ -0,0 +1,72 @@
+import hashlib
+import json
+
+import pytest
+
+from evals import catalog as catalog_module
+from evals.catalog import TaskCatalog, get_group, get_lock_path
+from evals.tasks import Dimension, Language, Task, TaskKind
+
+
+@pytest.fixture
+def catalog(make_catalog):
+    return make_catalog({"hellaswag": 10, "arc_de": 20, "arc_fr": 30, "ai2_arc": 40, "mmlu_de": 50},
+                        aliases={"ai2_arc": ["arc_easy", "arc_challenge"]})
+
+
+def test_lookups(catalog):
+    assert len(catalog) == 5
+    assert catalog.get("arc_de").size == 20
+    assert catalog.get("arc_easy").name == "ai2_arc"
+    assert "arc_challenge" in catalog and "arc_it" not in catalog
+    assert catalog.languages == ["deu", "eng", "fra"]
+    assert [task.name for task in catalog.by_group["arc"]] == ["arc_de", "arc_fr"]
+
+
+def test_select_intersects_filters_in_catalog_order(catalog):
+    assert [task.name for task in catalog.select(language="deu")] == ["arc_de", "mmlu_de"]
+    assert [task.name for task in catalog.select(language=["fra", "deu"], group="arc")] == ["arc_de", "arc_fr"]
+    assert catalog.select(group="unknown") == []
+    assert catalog.select() == list(catalog)
+
+
+def test_result_names(catalog):
+    assert catalog.result_names(catalog.select(group=["ai2_arc", "hellaswag"])) == \
+        ["hellaswag", "arc_easy", "arc_challenge"]
+
+
+def test_get_group():
+    german = Language("German", "de", "deu")
+    task = lambda name: Task(name, (TaskKind.pretrain,), 1, german, Dimension.factual)
+    assert get_group(task("include_base_44_german")) == "include_base_44"
+    assert get_group(task("global_mmlu_de")) == "global_mmlu"
+    assert get_group(task("mmlu")) == "mmlu"
+
+
+def test_lock_round_trip(catalog):
+    lock = json.loads(json.dumps(catalog.to_lock()))
+    loaded = TaskCatalog.from_lock(lock)
+    assert loaded.tasks == catalog.tasks
+    assert loaded.groups == catalog.groups
+
+
+def test_load_reuses_the_lock_until_the_config_changes(tmp_path, catalog, monkeypatch):
+    config = tmp_path/"all_tasks.json"
+    config.write_text('{"infer": {}, "other": []}')
+    lock = catalog.to_lock()
+    lock["version"] = hashlib.sha256(config.read_bytes()).hexdigest()
+    get_lock_path(config).write_text(json.dumps(lock))
+    monkeypatch.setattr(catalog_module, "_LOADED", {})
+
+    def build_tasks(raw_tasks):
+        raise AssertionError("Should not be compiled")
+
+    monkeypatch.setattr(catalog_module, "build_tasks", build_tasks)
+    assert TaskCatalog.load(config).tasks == catalog.tasks
+    assert TaskCatalog.load(config) is TaskCatalog.load(config)
+
+    config.write_text('{"infer": {}, "other": [] }')
+    monkeypatch.setattr(catalog_module, "build_tasks", lambda raw_tasks: list(catalog)[:1])
+    recompiled = TaskCatalog.load(config)
+    assert [task.name for task in recompiled] == ["hellaswag"]
+    assert json.loads(get_lock_path(config).read_text())["version"] == recompiled.version
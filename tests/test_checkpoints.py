@@ -0,0 +1,60 @@
+import json
+import os
+
+from evals.checkpoints import MARKER, evict, get_entry_name, get_key, list_entries, lookup, read_entry, touch
+
+
+def make_checkpoint(path, files):
+    for name, size in files.items():
+        (path/name).parent.mkdir(parents=True, exist_ok=True)
+        (path/name).write_bytes(b"x"*size)
+    return path
+
+
+def make_entry(root, name, it, size, last_used, complete=True):
+    path = root/get_entry_name(name, it, "abc123")
+    path.mkdir(parents=True)
+    if complete:
+        (path/MARKER).write_text(json.dumps({"bytes": size}))
+        os.utime(path/MARKER, (last_used, last_used))
+    return path
+
+
+def test_key_fingerprints_contents_and_tokenizer(tmp_path):
+    checkpoint = make_checkpoint(tmp_path/"iter_100", {"mp_rank_00/model.pt": 10, "common.pt": 5})
+    key = get_key(checkpoint, "tok")
+    assert key == get_key(checkpoint, "tok")
+    assert key != get_key(checkpoint, "other-tok")
+    make_checkpoint(checkpoint, {"mp_rank_00/model.pt": 11})
+    assert key != get_key(checkpoint, "tok")
+
+
+def test_only_complete_entries_are_listed(tmp_path):
+    complete = make_entry(tmp_path, "apertus-8b", 1000, 42, 100)
+    make_entry(tmp_path, "apertus-8b", 2000, 42, 100, complete=False)
+    (tmp_path/"unrelated").mkdir()
+    entry, = list_entries(tmp_path)
+    assert (entry.name, entry.it, entry.key, entry.size, entry.last_used) == ("apertus-8b", 1000, "abc123", 42, 100)
+    assert read_entry(tmp_path/"unrelated") is None
+    assert list_entries(tmp_path/"missing") == []
+
+    name = get_entry_name("apertus-8b", 1000, "abc123")
+    assert lookup([tmp_path/"missing", tmp_path], name) == complete
+    assert lookup([tmp_path], get_entry_name("apertus-8b", 2000, "abc123")) is None
+
+
+def test_touch_updates_last_use(tmp_path):
+    path = make_entry(tmp_path, "m", 1, 1, 100)
+    touch(path)
+    assert read_entry(path).last_used > 100
+
+
+def test_evict_least_recently_used(tmp_path):
+    make_entry(tmp_path, "m", 1, 10, 100)
+    make_entry(tmp_path, "m", 2, 10, 300)
+    make_entry(tmp_path, "m", 3, 10, 200)
+    make_entry(tmp_path, "m", 4, 10, 50)
+    removed = evict(tmp_path, 20, in_use=lambda entry: entry.it == 4)
+    assert [entry.it for entry in removed] == [1, 3]
+    assert sorted(entry.it for entry in list_entries(tmp_path)) == [2, 4]
+    assert evict(tmp_path, 20) == []
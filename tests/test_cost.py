@@ -0,0 +1,78 @@
+import json
+
+import pytest
+
+from evals.cost import (GPUS_PER_NODE, PRIOR_SECONDS_PER_ROW_PER_B, CostModel, Observation, collect_observations,
+                        fit, get_cost_model, get_cost_model_path, read_observation)
+from evals.tasks import get_partition
+
+
+@pytest.fixture
+def catalog(make_catalog):
+    return make_catalog({"hellaswag": 100, "ai2_arc": 100, "arc_de": 100},
+                        aliases={"ai2_arc": ["arc_easy", "arc_challenge"]})
+
+
+def test_fit_recovers_the_rates_of_tasks_evaluated_together():
+    observations = [Observation("hf", 8, 10, {"a": 10}),
+                    Observation("hf", 8, 60, {"b": 20}),
+                    Observation("hf", 8, 20, {"a": 5, "b": 5})]
+    model = fit(observations, iterations=500)
+    assert model.rate("a", 8) == pytest.approx(1, rel=1e-2)
+    assert model.rate("b", 8) == pytest.approx(3, rel=1e-2)
+
+
+def test_rate_fallbacks():
+    model = CostModel(rates={"hf": {8.0: {"a": 2.0}}})
+    assert model.rate("a", 8) == 2
+    assert model.rate("a", 70) == pytest.approx(2*70/8)  # Extrapolated from the closest size.
+    assert model.rate("b", 8) == pytest.approx(PRIOR_SECONDS_PER_ROW_PER_B*8)
+    assert model.rate("a", 8, "hf/1gpu") == pytest.approx(2*GPUS_PER_NODE)
+    assert model.rate("a", 8, "vllm") == pytest.approx(PRIOR_SECONDS_PER_ROW_PER_B*8)
+
+
+def test_save_and_load(tmp_path):
+    model = CostModel(rates={"hf": {8.0: {"a": 2.0}}, "vllm/1gpu": {70.0: {"b": 1.0}}}, fitted_at=123)
+    model.save(tmp_path/"model.json")
+    assert CostModel.load(tmp_path/"model.json") == model
+    assert CostModel.load(tmp_path/"missing.json") == CostModel()
+
+
+def test_read_observation_assigns_leaves_to_catalog_tasks(catalog):
+    info = {"total_evaluation_time_seconds": "42.5",
+            "config": {"model": "vllm"},
+            "group_subtasks": {"my_group": ["arc_easy", "arc_challenge"], "arc_easy": []},
+            "n-samples": {"arc_easy": {"effective": 10}, "arc_challenge": {"effective": 5},
+                          "hellaswag": {"effective": 7}, "unknown": {"effective": 1}, "empty": {"effective": 0}}}
+    observation = read_observation(info, 8, catalog)
+    assert observation == Observation("vllm", 8, 42.5, {"ai2_arc": 15, "hellaswag": 7, "unknown": 1})
+    assert read_observation(info, 8, catalog, gpus=1).backend == "vllm/1gpu"
+    assert read_observation({"n-samples": {}}, 8, catalog) is None
+    assert read_observation({**info, "total_evaluation_time_seconds": "nan?"}, 8, catalog) is None
+
+
+def write_results(logs_root, model, eval_dir, info):
+    path = logs_root/model/"iter_100"/"harness"/eval_dir/"org__model"/"results_2025.json"
+    path.parent.mkdir(parents=True)
+    path.write_text(json.dumps(info))
+
+
+def test_collect_observations_and_refits(tmp_path, catalog):
+    info = {"total_evaluation_time_seconds": 100, "n-samples": {"hellaswag": {"effective": 100}}}
+    write_results(tmp_path, "big", "eval_1", info)
+    write_results(tmp_path, "small", "eval_2_0", info)
+    observations = collect_observations(tmp_path, {"big": 70, "small": 8}, catalog)
+    assert sorted((obs.backend, obs.size) for obs in observations) == [("hf", 70), ("hf/1gpu", 8)]
+
+    model = get_cost_model(tmp_path, {"big": 70, "small": 8}, catalog)
+    assert model.rate("hellaswag", 70) == pytest.approx(1)
+    assert get_cost_model_path(tmp_path).exists()
+    write_results(tmp_path, "big", "eval_3", {**info, "total_evaluation_time_seconds": 300})
+    assert get_cost_model(tmp_path, {"big": 70}, catalog).rate("hellaswag", 70) == pytest.approx(1)  # Still fresh.
+    assert get_cost_model(tmp_path, {"big": 70}, catalog, max_age=0).rate("hellaswag", 70) == pytest.approx(2)
+
+
+def test_get_partition_balances_by_cost(catalog):
+    cost = {"hellaswag": 10, "ai2_arc": 1, "arc_de": 9}
+    parts = get_partition(list(catalog), shards=2, cost=lambda task: cost[task.name])
+    assert sorted(sorted(task.name for task in part) for part in parts) == [["ai2_arc", "arc_de"], ["hellaswag"]]
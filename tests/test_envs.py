@@ -0,0 +1,97 @@
+import dataclasses
+import json
+import os
+import subprocess
+
+import pytest
+
+from evals import envs
+from evals.envs import MARKER, Spec, build, gc, get_key, get_spec, list_entries, read_entry, resolve_commit
+
+
+@pytest.fixture
+def repo(tmp_path):
+    path = tmp_path/"repo"
+    path.mkdir()
+    git = lambda *args: subprocess.run(["git", "-C", str(path), *args], check=True, capture_output=True, text=True)
+    git("init", "-q", "-b", "main")
+    (path/"file.txt").write_text("a\n")
+    git("add", "file.txt")
+    git("-c", "user.name=test", "-c", "user.email=test@test", "commit", "-qm", "first")
+    return path, git("rev-parse", "HEAD").stdout.strip()
+
+
+def make_spec(**fields) -> Spec:
+    spec = Spec(container="abc", harness_fork="https://example.com/harness.git", harness_commit="0"*40,
+                transformers_path="", transformers_commit="", extra_pips="")
+    return dataclasses.replace(spec, **fields)
+
+
+def test_resolve_commit(repo):
+    path, commit = repo
+    assert resolve_commit(str(path)) == commit
+    assert resolve_commit(str(path), "main") == commit
+    assert resolve_commit(str(path), "f"*40) == "f"*40
+    with pytest.raises(ValueError, match="missing"):
+        resolve_commit(str(path), "missing")
+    (path/"file.txt").write_text("b\n")
+    dirty = resolve_commit(str(path))
+    assert dirty.startswith(f"{commit}+") and dirty != commit
+
+
+def test_spec_and_key(tmp_path, repo):
+    path, commit = repo
+    container = tmp_path/"env.toml"
+    container.write_text("image = 'x'")
+    spec = get_spec(str(container), str(path), "main", str(path), "b==1 a==2")
+    assert spec.harness_commit == spec.transformers_commit == commit
+    assert spec.extra_pips == "a==2 b==1"
+    assert spec == get_spec(str(container), str(path), "main", str(path), "a==2  b==1")
+    assert get_spec("not/a/file.toml", str(path), "main").container == "not/a/file.toml"
+
+    assert get_key(make_spec()) == get_key(make_spec())
+    assert get_key(make_spec()) != get_key(make_spec(harness_commit="1"*40))
+    assert get_key(make_spec()) != get_key(make_spec(extra_pips="a==2"))
+
+
+def test_build_once(tmp_path, monkeypatch):
+    commands = []
+
+    def run(cmd, **kwargs):
+        commands.append(cmd)
+        if cmd[1:3] == ["-m", "venv"]:
+            os.makedirs(cmd[-1])
+
+    monkeypatch.setattr(envs.subprocess, "run", run)
+    spec = make_spec(extra_pips="a==2")
+    path = build(tmp_path, spec)
+    assert path == tmp_path/get_key(spec)
+    assert json.loads((path/MARKER).read_text()) == dataclasses.asdict(spec)
+    assert commands[1][-1] == f"git+{spec.harness_fork}@{spec.harness_commit}"
+    assert commands[2][-2:] == ["a==2", "--no-build-isolation"]
+
+    os.utime(path/MARKER, (0, 0))
+    assert build(tmp_path, spec) == path
+    assert len(commands) == 3  # Reused, not rebuilt.
+    assert read_entry(path).last_used > 0
+
+
+def test_gc_removes_idle_and_failed_environments(tmp_path):
+    def make_env(key: str, last_used: float, complete: bool = True):
+        path = tmp_path/key
+        path.mkdir()
+        if complete:
+            (path/MARKER).write_text(json.dumps(dataclasses.asdict(make_spec())))
+            os.utime(path/MARKER, (last_used, last_used))
+        else:
+            os.utime(path, (last_used, last_used))
+
+    make_env("idle", 0)
+    make_env("used", 0)
+    make_env("recent", 1e12)
+    make_env("failed", 0, complete=False)
+    make_env("building", 1e12, complete=False)
+    removed = gc(tmp_path, max_idle=24*60*60, in_use=lambda entry: entry.key == "used")
+    assert sorted(path.name for path in removed) == ["failed", "idle"]
+    assert sorted(entry.key for entry in list_entries(tmp_path)) == ["recent", "used"]
+    assert gc(tmp_path/"missing", 0) == []
@@ -0,0 +1,82 @@
+import math
+
+import pytest
+
+from evals.failures import Attempt, FailureLedger, get_failures_path, read_error
+
+HOUR = 3600
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    return FailureLedger.open(tmp_path, backoff=HOUR, max_backoff=3*HOUR, quarantine=4)
+
+
+def test_exponential_backoff_and_quarantine(ledger):
+    assert ledger.retry_at("m", 100, "mmlu") == 0
+    expected = [1*HOUR, 2*HOUR, 3*HOUR, math.inf]  # Capped by `max_backoff`, then quarantined.
+    for failures, delay in enumerate(expected, start=1):
+        ledger.record("m", 100, ["mmlu"], "FAILED", now=1000)
+        assert ledger.failures["m"][100]["mmlu"].count == failures
+        assert ledger.retry_at("m", 100, "mmlu") == 1000 + delay
+        assert ledger.blocked("m", 100, "mmlu", now=1000 + min(delay, 100*HOUR) - 1)
+    assert not ledger.blocked("m", 100, "hellaswag", now=1000)
+    assert ledger.blocked("m", 100, "mmlu", now=1e12)
+    assert [(name, it, task) for name, it, task, _ in ledger.quarantined()] == [("m", 100, "mmlu")]
+
+    ledger.clear("m", 100, ["mmlu"])
+    assert ledger.retry_at("m", 100, "mmlu") == 0
+    assert ledger.quarantined() == []
+
+
+def test_persistence(ledger, tmp_path):
+    ledger.track("1", Attempt("m", 100, ["mmlu"], "eval_m_mixed_100", "logs/x.err", "0"))
+    ledger.record("m", 100, ["hellaswag"], "TIMEOUT", now=5)
+    ledger.save()
+    loaded = FailureLedger(get_failures_path(tmp_path))
+    assert loaded.attempts == ledger.attempts
+    assert loaded.failures == ledger.failures
+
+
+def settle(ledger, states, evaluated=set(), queued=set()):
+    return ledger.settle(queued, lambda job_ids: {job_id: states[job_id] for job_id in job_ids if job_id in states},
+                         lambda name, it: evaluated, now=0)
+
+
+def test_settle_records_the_tasks_without_results(ledger, tmp_path):
+    log = tmp_path/"job.err"
+    log.write_text("loading\nRuntimeError: CUDA error: out of memory\nexiting\n")
+    ledger.track("1", Attempt("m", 100, ["mmlu", "hellaswag"], "eval_m_mixed_100", str(log)))
+    ledger.track("2", Attempt("m", 100, ["piqa"], "eval_m_mixed_100", str(log)))
+    assert settle(ledger, {"1": "FAILED", "2": "RUNNING"}, evaluated={"hellaswag"}, queued={"2"}) == \
+        [("m", 100, ["mmlu"], "FAILED RuntimeError: CUDA error: out of memory")]
+    assert set(ledger.failures["m"][100]) == {"mmlu"}
+    assert list(ledger.attempts) == ["2"]
+
+    # A later success clears the earlier failures.
+    ledger.track("3", Attempt("m", 100, ["mmlu"], "eval_m_mixed_100", str(log)))
+    assert settle(ledger, {"3": "COMPLETED"}, evaluated={"mmlu"}, queued={"2"}) == []
+    assert ledger.failures["m"][100] == {}
+
+
+def test_settle_ignores_what_is_not_the_jobs_fault(ledger):
+    for job_id, state in enumerate(["NODE_FAIL", "PREEMPTED", "CANCELLED", "RUNNING"]):
+        ledger.track(str(job_id), Attempt("m", 100, ["mmlu"], "eval_m_mixed_100", "missing.err"))
+    ledger.track("unknown", Attempt("m", 100, ["mmlu"], "eval_m_mixed_100", "missing.err"))
+    assert settle(ledger, {"0": "NODE_FAIL", "1": "PREEMPTED", "2": "CANCELLED", "3": "RUNNING"}) == []
+    assert list(ledger.attempts) == ["3"]  # Squeue was slow to show it, settled later.
+
+
+def test_settle_blames_failed_materializations(ledger):
+    ledger.track("2", Attempt("m", 100, ["mmlu"], "eval_m_mixed_100", "missing.err", dependency="1"))
+    ledger.track("4", Attempt("m", 200, ["mmlu"], "eval_m_mixed_200", "missing.err", dependency="3"))
+    recorded = settle(ledger, {"1": "FAILED", "2": "CANCELLED", "3": "CANCELLED", "4": "CANCELLED"})
+    assert recorded == [("m", 100, ["mmlu"], "materialization FAILED")]
+
+
+def test_read_error(tmp_path):
+    assert read_error(tmp_path/"missing.err") == ""
+    (tmp_path/"job.err").write_text("all good\n")
+    assert read_error(tmp_path/"job.err") == ""
+    (tmp_path/"job.err").write_text("slurmstepd: error: Detected 1 oom_kill event\n" + "x"*300 + " Error\n")
+    assert read_error(tmp_path/"job.err", max_chars=10) == "x"*10
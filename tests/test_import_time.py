@@ -0,0 +1,35 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import pytest
+
+from check_import_time import CHECKS, HEAVY, run_check
+from evals.catalog import get_lock_path
+
+ROOT = Path(__file__).parent.parent
+
+
+@pytest.fixture
+def repo_env(monkeypatch):
+    monkeypatch.chdir(ROOT)
+    monkeypatch.setenv("PYTHONPATH", os.pathsep.join([str(ROOT/"src"), str(ROOT)]))
+
+
+@pytest.mark.parametrize("name", [name for name in CHECKS if name != "TaskCatalog.load"])
+def test_entry_points_import_lazily(repo_env, name):
+    statement, forbidden = CHECKS[name]
+    _, modules = run_check(statement)
+    assert sorted(module for module in forbidden if module in modules) == []
+
+
+def test_loading_a_compiled_catalog_is_lazy(repo_env, tmp_path, make_catalog):
+    config = tmp_path/"all_tasks.json"
+    config.write_text('{"infer": {}, "other": []}')
+    lock = make_catalog({"hellaswag": 10, "arc_de": 20}).to_lock()
+    lock["version"] = hashlib.sha256(config.read_bytes()).hexdigest()
+    get_lock_path(config).write_text(json.dumps(lock))
+    statement = f"from pathlib import Path; from evals.catalog import TaskCatalog; TaskCatalog.load(Path({str(config)!r}))"
+    _, modules = run_check(statement)
+    assert sorted(module for module in HEAVY if module in modules) == []
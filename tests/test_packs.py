@@ -0,0 +1,35 @@
+import os
+import shlex
+
+from evals.packs import Slot, get_packs_dir, is_pack, prune, read_pack, write_pack
+
+
+def test_write_and_read_a_pack(tmp_path):
+    slots = [Slot("eval_m_shard0of2_100", ["model", "100", "1000", "m"], {"TASKS": "mmlu,hellaswag"}),
+             Slot("eval_m_shard1of2_100", ["model", "100", "1000", "m"], {"TASKS": "a b'c"})]
+    path = write_pack(tmp_path, slots, "batch")
+    assert path.parent == tmp_path and path.name.startswith("batch_") and is_pack(path.name)
+    assert read_pack(tmp_path, path.name) == slots
+    assert read_pack(tmp_path, "pack_missing") is None
+
+    scripts = sorted(path.glob("*.sh"))
+    assert [script.name for script in scripts] == ["00_eval_m_shard0of2_100.sh", "01_eval_m_shard1of2_100.sh"]
+    lines = scripts[1].read_text().splitlines()
+    assert lines[1] == "export TASKS=" + shlex.quote("a b'c")
+    assert lines[-1] == "exec bash scripts/evaluate.sbatch model 100 1000 m"
+
+
+def test_pack_names():
+    assert is_pack("pack_0123456789ab") and is_pack("batch_0123456789ab")
+    assert not is_pack("eval_m_mixed_100") and not is_pack("mat_m_100")
+
+
+def test_prune_keeps_queued_and_recent_packs(tmp_path):
+    packs_dir = get_packs_dir(tmp_path)
+    slots = [Slot("eval_m_mixed_100", [], {})]
+    old, queued, recent = [write_pack(packs_dir, slots) for _ in range(3)]
+    for path in [old, queued]:
+        os.utime(path, (0, 0))
+    prune(packs_dir, {queued.name})
+    assert sorted(path.name for path in packs_dir.iterdir()) == sorted([queued.name, recent.name])
+    prune(tmp_path/"missing", set())
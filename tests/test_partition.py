@@ -0,0 +1,54 @@
+import itertools
+import random
+
+import pytest
+
+from evals.partition import improve, lpt, plan_partition
+
+HOUR = 3600
+
+
+def loads(parts, cost):
+    return [sum(cost(item) for item in part) for part in parts]
+
+
+def test_lpt_and_improve_balance():
+    cost = {"a": 5, "b": 4, "c": 3, "d": 3, "e": 3}.__getitem__
+    parts = lpt(["a", "b", "c", "d", "e"], cost, 2)
+    assert sorted(loads(parts, cost)) == [8, 10]
+    parts = improve(parts, cost)
+    assert sorted(loads(parts, cost)) == [9, 9]
+    assert sorted(itertools.chain(*parts)) == ["a", "b", "c", "d", "e"]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_every_shard_fits_in_the_walltime(seed):
+    rng = random.Random(seed)
+    costs = {f"task{i}": rng.uniform(0.1, 3)*HOUR for i in range(40)}
+    walltime, overhead, margin = 12*HOUR, HOUR, 0.1
+    parts = plan_partition(list(costs), costs.__getitem__, walltime, overhead=overhead, margin=margin)
+    assert sorted(itertools.chain(*parts)) == sorted(costs)
+    assert all(len(part) > 0 for part in parts)
+    assert max(loads(parts, costs.__getitem__)) <= walltime*(1 - margin) - overhead
+
+
+def test_deterministic_output():
+    costs = {name: HOUR for name in "dcbaef"}
+    parts = plan_partition(list(costs), costs.__getitem__, 4*HOUR, margin=0)
+    assert parts == plan_partition(list(reversed(costs)), costs.__getitem__, 4*HOUR, margin=0)
+    assert [part[0] for part in parts] == sorted(part[0] for part in parts)
+
+
+def test_overhead_favours_fewer_shards():
+    costs = {name: HOUR for name in "abcd"}
+    assert len(plan_partition(list(costs), costs.__getitem__, 10*HOUR, overhead=0, margin=0)) == 4
+    assert len(plan_partition(list(costs), costs.__getitem__, 10*HOUR, overhead=HOUR, margin=0)) == 1
+    assert len(plan_partition(list(costs), costs.__getitem__, 10*HOUR, overhead=HOUR, margin=0,
+                              makespan_weight=100)) == 4
+
+
+def test_oversized_tasks_raise():
+    costs = {"small": HOUR, "huge": 20*HOUR}
+    with pytest.raises(ValueError, match="huge"):
+        plan_partition(list(costs), costs.__getitem__, 12*HOUR)
+    assert plan_partition([], costs.__getitem__, 12*HOUR) == ()
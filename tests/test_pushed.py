@@ -0,0 +1,37 @@
+from evals.pushed import PushedLog, get_pushed_path
+
+
+def test_history_merges_the_logs_in_order(tmp_path):
+    pushed = PushedLog.open(tmp_path)
+    assert pushed.path == get_pushed_path(tmp_path)
+    pushed.append("p", "r", [{"ConsumedTokens": 1, "a": 1.0, "b": 1.0}, {"ConsumedTokens": 2, "a": 2.0}])
+    pushed.append("p", "r", [{"ConsumedTokens": 1, "b": 3.0}])
+    pushed.append("p", "other", [{"ConsumedTokens": 1, "a": 9.0}])
+    assert pushed.history("p", "r") == {1: {"ConsumedTokens": 1, "a": 1.0, "b": 3.0}, 2: {"ConsumedTokens": 2, "a": 2.0}}
+    assert pushed.history("other-project", "r") == {}
+    pushed.close()
+    assert PushedLog.open(tmp_path).history("p", "other") == {1: {"ConsumedTokens": 1, "a": 9.0}}
+
+
+def test_inputs(tmp_path):
+    pushed = PushedLog.open(tmp_path)
+    pushed.set_inputs("p", "r", {10: ("f1", 1), 20: ("f2", None)})
+    pushed.set_inputs("p", "r", {10: ("f3", 1)})
+    assert pushed.inputs("p", "r") == {10: ("f3", 1), 20: ("f2", None)}
+    assert pushed.inputs("p", "other") == {}
+
+
+def test_reconcile_makes_the_remote_history_authoritative(tmp_path):
+    pushed = PushedLog.open(tmp_path)
+    assert pushed.reconciled_at("p", "r") is None
+    pushed.append("p", "r", [{"ConsumedTokens": 1, "a": 1.0}, {"ConsumedTokens": 2, "a": 2.0},
+                             {"ConsumedTokens": 3, "a": 3.0}])
+    pushed.set_inputs("p", "r", {10: ("f1", 1), 20: ("f2", 2), 30: ("f3", 3), 40: ("f4", None)})
+
+    # Step 2 differs remotely, step 3 is missing and step 4 was only pushed from elsewhere.
+    assert pushed.reconcile("p", "r", {1: {"a": 1.0}, 2: {"a": 5.0}, 4: {"a": 4.0}}) == 3
+    assert pushed.history("p", "r") == {1: {"ConsumedTokens": 1, "a": 1.0}, 2: {"ConsumedTokens": 2, "a": 5.0},
+                                        4: {"ConsumedTokens": 4, "a": 4.0}}
+    assert pushed.inputs("p", "r") == {10: ("f1", 1)}  # The others are synced again.
+    assert pushed.reconciled_at("p", "r") is not None
+    assert pushed.reconcile("p", "r", {1: {"a": 1.0}, 2: {"a": 5.0}, 4: {"a": 4.0}}) == 0
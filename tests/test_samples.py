@@ -0,0 +1,74 @@
+import json
+
+import pytest
+
+from evals import samples
+from evals.bootstrap import read_samples
+
+TIMESTAMP = "2025-01-01T00-00-00.0"
+
+
+@pytest.fixture
+def samples_path(tmp_path):
+    """A samples file with two filters per document, each line about 200 bytes."""
+    path = tmp_path/f"samples_arc_de_{TIMESTAMP}.jsonl"
+    with open(path, "w") as f:
+        for doc_id in range(100):
+            for name in ["none", "strict"]:
+                f.write(json.dumps({"doc_id": doc_id, "filter": name, "acc": float(doc_id % 3 == 0),
+                                    "doc": {"text": "é"*80}}) + "\n")
+    return path
+
+
+def test_compact_round_trip(samples_path):
+    content = samples_path.read_text()
+    dest = samples.compact(samples_path, block_bytes=2000)
+    assert dest.name == f"samples_arc_de_{TIMESTAMP}.jsonl.zst"
+    assert not samples_path.exists() and samples.get_index_path(dest).exists()
+    assert "".join(samples.iter_lines(dest)) == content
+
+    log = samples.SampleLog(dest)
+    assert len(log.frames) > 10 and len(log) == 200
+    assert [(sample["doc_id"], sample["filter"]) for sample in log.get(42)] == [(42, "none"), (42, "strict")]
+    assert log.get(1000) == []
+    lines = content.splitlines()
+    assert all(log.line(i) == json.loads(lines[i]) for i in [0, 199, 57, 58, 3])
+
+
+def test_find_samples(samples_path, tmp_path):
+    (tmp_path/f"samples_hellaswag_{TIMESTAMP}.jsonl").write_text("")
+    (tmp_path/"samples_hellaswag_2024-01-01T00-00-00.0.jsonl").write_text("")
+    assert samples.find_samples(tmp_path, TIMESTAMP) == {"arc_de": samples_path,
+                                                        "hellaswag": tmp_path/f"samples_hellaswag_{TIMESTAMP}.jsonl"}
+    assert samples.get_task(f"samples_arc_de_{TIMESTAMP}.jsonl.zst", TIMESTAMP) == "arc_de"
+    assert samples.get_task(f"results_{TIMESTAMP}.json", TIMESTAMP) is None
+
+    dest = samples.compact(samples_path)
+    samples_path.write_text("")  # The compacted file wins if both exist.
+    assert samples.find_samples(tmp_path, TIMESTAMP)["arc_de"] == dest
+
+
+def test_compact_all(samples_path, tmp_path, capsys):
+    truncated = tmp_path/"eval_1"/f"samples_hellaswag_{TIMESTAMP}.jsonl"
+    truncated.parent.mkdir()
+    truncated.write_text(json.dumps({"doc_id": 0, "acc": 1.0}) + '\n{"doc_id": 1, "ac')
+    size = samples_path.stat().st_size
+    before, after = samples.compact_all(tmp_path)
+    assert before == size > after > 0
+    assert f"Couldn't compact {truncated}" in capsys.readouterr().out
+    assert truncated.exists() and not samples_path.exists()
+    assert samples.compact_all(tmp_path) == (0, 0)
+
+
+def test_scores_are_the_same_after_compaction(samples_path):
+    before = read_samples(samples_path)
+    after = read_samples(samples.compact(samples_path))
+    assert after.metrics == before.metrics == ["acc"]
+    assert (after.doc_ids == before.doc_ids).all() and (after.values == before.values).all()
+
+
+def test_show(samples_path, capsys):
+    dest = samples.compact(samples_path)
+    samples.main([], samples.LEVEL, dest, 7)
+    out = capsys.readouterr().out
+    assert out.count('"doc_id": 7') == 2 and '"filter": "strict"' in out
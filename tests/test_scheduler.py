@@ -0,0 +1,55 @@
+from evals.scheduler import FakeScheduler
+
+
+def make_scheduler(nodes=1, durations={}, finished=None):
+    """Jobs take `durations[name]` seconds (one hour by default) and fail if their name starts with `fail`."""
+    return FakeScheduler(nodes, lambda job: (durations.get(job.name, 3600), not job.name.startswith("fail")),
+                         on_finish=lambda job: finished.append(job.name) if finished is not None else None)
+
+
+def test_jobs_start_in_order_when_nodes_free_up():
+    finished = []
+    scheduler = make_scheduler(nodes=2, durations={"a": 100, "b": 300, "c": 100}, finished=finished)
+    ids = [scheduler.submit("x.sbatch", [], name, {}) for name in ["a", "b", "c"]]
+    assert scheduler.states(ids) == {ids[0]: "RUNNING", ids[1]: "RUNNING", ids[2]: "PENDING"}
+    assert scheduler.jobs(pending_only=True) == [(ids[2], "c")]
+    assert scheduler.next_event() == 100
+
+    scheduler.advance(150)
+    assert finished == ["a"]
+    assert scheduler.history[ids[2]].started == 100
+    scheduler.advance(1000)
+    assert finished == ["a", "c", "b"]
+    assert scheduler.jobs() == []
+    assert scheduler.now == 1000
+    assert scheduler.states(ids + ["unknown"]) == {job_id: "COMPLETED" for job_id in ids}
+
+
+def test_dependencies():
+    finished = []
+    scheduler = make_scheduler(nodes=4, finished=finished)
+    ok = scheduler.submit("x.sbatch", [], "ok", {})
+    fail = scheduler.submit("x.sbatch", [], "fail", {})
+    after_ok = scheduler.submit("x.sbatch", [], "after_ok", {}, dependency=ok)
+    after_both = scheduler.submit("x.sbatch", [], "after_both", {}, dependency=f"{ok}:{fail}")
+    assert scheduler.states([after_ok, after_both]) == {after_ok: "PENDING", after_both: "PENDING"}
+
+    scheduler.advance(3600)
+    assert scheduler.states([ok, fail, after_ok, after_both]) == \
+        {ok: "COMPLETED", fail: "FAILED", after_ok: "RUNNING", after_both: "CANCELLED"}
+    assert finished == ["ok", "fail", "after_both"]
+
+
+def test_cancel_frees_the_node():
+    scheduler = make_scheduler(nodes=1)
+    running = scheduler.submit("x.sbatch", [], "running", {})
+    queued = scheduler.submit("x.sbatch", [], "queued", {})
+    other = scheduler.submit("x.sbatch", [], "other", {})
+    scheduler.cancel(queued)
+    assert scheduler.jobs() == [(running, "running"), (other, "other")]
+    scheduler.advance(10)
+    scheduler.cancel(running)
+    assert scheduler.states([running, queued, other]) == {running: "CANCELLED", queued: "CANCELLED", other: "RUNNING"}
+    assert scheduler.history[other].started == 10
+    scheduler.cancel(running)  # Already gone, nothing happens.
+    assert scheduler.history[running].finished == 10
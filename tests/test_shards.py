@@ -0,0 +1,78 @@
+import dataclasses
+import json
+
+import pytest
+
+from evals import shards
+from evals.shards import get_default_shards, get_version, update_shards
+
+
+def plan(tasks):
+    """Pairs of tasks, enough to tell new shards apart from updated ones."""
+    tasks = sorted(tasks, key=lambda task: task.name)
+    return tuple(tasks[i:i + 2] for i in range(0, len(tasks), 2))
+
+
+@pytest.fixture(autouse=True)
+def memo(monkeypatch):
+    monkeypatch.setattr(shards, "_MEMO", {})
+
+
+@pytest.fixture
+def tasks(make_catalog):
+    return list(make_catalog({f"t{i}": 10 for i in range(6)}))
+
+
+def names(parts):
+    return [[task.name for task in part] for part in parts]
+
+
+def test_version_covers_tasks_costs_and_capacity(tasks):
+    version = get_version(tasks, lambda task: 100, 1000)
+    assert version == get_version(list(reversed(tasks)), lambda task: 100.2, 1000)
+    assert version != get_version(tasks[1:], lambda task: 100, 1000)
+    assert version != get_version(tasks, lambda task: 200, 1000)
+    assert version != get_version(tasks, lambda task: 100, 2000)
+
+
+def test_update_keeps_tasks_in_place(tasks):
+    parts = update_shards([["t0", "t1"], ["t2", "removed"], ["gone"]], tasks, lambda task: 1, 3, plan)
+    assert names(parts) == [["t0", "t1", "t4"], ["t2", "t3", "t5"], []]
+
+
+def test_update_evicts_the_most_expensive_tasks(tasks):
+    cost = {"t0": 1, "t1": 3, "t2": 1, "t3": 1, "t4": 1, "t5": 1}
+    parts = update_shards([["t0", "t1"], ["t2"], ["t3", "t4", "t5"]], tasks, lambda task: cost[task.name], 3, plan)
+    assert names(parts) == [["t0"], ["t2"], ["t3", "t4", "t5"], ["t1"]]
+
+
+def test_new_shards_fill_empty_placeholders_first(tasks):
+    parts = update_shards([["gone"], ["t0"]], tasks, lambda task: 1, 2, plan)
+    assert names(parts) == [["t2", "t3"], ["t0", "t1"], ["t4", "t5"]]
+
+
+def test_default_shards_are_stable_and_persisted(tmp_path, tasks):
+    path = tmp_path/"shards.json"
+    first = get_default_shards(path, "8:hf", tasks, lambda task: 100, 1000, plan)
+    assert names(first) == [["t0", "t1"], ["t2", "t3"], ["t4", "t5"]]
+    shards._MEMO.clear()
+    assert get_default_shards(path, "8:hf", list(reversed(tasks)), lambda task: 100, 1000, plan) == first
+
+    # A new task joins an existing shard instead of reshuffling them.
+    catalog_tasks = tasks + [dataclasses.replace(tasks[0], name="t6")]
+    updated = get_default_shards(path, "8:hf", catalog_tasks, lambda task: 100, 1000, plan)
+    assert names(updated) == [["t0", "t1", "t6"], ["t2", "t3"], ["t4", "t5"]]
+    stored = json.loads(path.read_text())["8:hf"]
+    assert stored["latest"] == get_version(catalog_tasks, lambda task: 100, 1000)
+    assert len(stored["versions"]) == 2
+
+
+def test_default_shards_follow_cost_and_capacity_changes(tmp_path, tasks):
+    path = tmp_path/"shards.json"
+    get_default_shards(path, "8:hf", tasks, lambda task: 100, 1000, plan)
+    # Tasks got three times as expensive: the old shards no longer fit and must be split.
+    slower = get_default_shards(path, "8:hf", tasks, lambda task: 300, 500, lambda tasks: tuple([task] for task in tasks))
+    assert names(slower) == [["t0"], ["t2"], ["t4"], ["t1"], ["t3"], ["t5"]]
+    # Going back to the original estimates reuses their assignment.
+    assert names(get_default_shards(path, "8:hf", tasks, lambda task: 100, 1000, plan)) == \
+        [["t0", "t1"], ["t2", "t3"], ["t4", "t5"]]
@@ -0,0 +1,64 @@
+from pathlib import Path
+
+import pytest
+
+from evals.cost import CostModel
+from simulate import get_arrivals, noise, simulate
+
+ROOT = Path(__file__).parent.parent
+
+
+@pytest.fixture
+def setup(tmp_path, make_catalog, monkeypatch):
+    monkeypatch.chdir(ROOT)  # For `configs/tasks.json`.
+    catalog = make_catalog({"hellaswag": 2*3600, "mmlu": 3*3600, "arc_de": 3600, "arc_fr": 3600})
+    cost_model = CostModel(rates={"hf": {8.0: {task.name: 1.0 for task in catalog}}})
+    cfg = {"logs_root": str(tmp_path/"logs"), "walltime_hours": 12, "walltime_margin": 0.1,
+           "job_overhead_minutes": 30, "makespan_weight": 1.0, "tasks_per_run": 4, "failure_backoff_hours": 1,
+           "failure_max_backoff_hours": 24, "failure_quarantine": 3,
+           "models": {"m": {"model_dirs": [str(tmp_path/"missing")], "size": 8, "tokens_per_iter": "1000",
+                            "frequency": 100, "start_eval_from": 100}}}
+    return cfg, catalog, cost_model
+
+
+def run(cfg, catalog, cost_model, **kwargs):
+    arrivals = get_arrivals(cfg, hours=24, checkpoint_hours=12)
+    options = dict(nodes=4, hours=24, poll_minutes=10, noise_sigma=0, overhead_minutes=30,
+                   materialize_minutes=30, verbose=False)
+    options.update(kwargs)
+    return arrivals, simulate(cfg, catalog, cost_model, arrivals, **options)
+
+
+def test_arrivals_fall_back_to_a_fixed_cadence(setup):
+    cfg, _, _ = setup
+    assert get_arrivals(cfg, hours=24, checkpoint_hours=12) == {"m": {100: 0, 200: 12*3600, 300: 24*3600}}
+
+
+def test_every_checkpoint_gets_evaluated(setup):
+    cfg, catalog, cost_model = setup
+    arrivals, result = run({**cfg, "makespan_weight": 0}, catalog, cost_model)
+    assert result["unfinished"] == 0
+    assert result["redundant_gpu_hours"] == 0
+    assert result["cancelled"] == 0
+    # Without caring for the makespan all the tasks (7h) go in a single job per checkpoint.
+    assert result["jobs"] == len(arrivals["m"]) == 3
+    assert result["gpu_hours"] == pytest.approx(3*4*(7 + 0.5 + 0.5))  # Evaluation and materialization jobs.
+    assert result["latency_h_max"] == pytest.approx(0.5 + 7.5, abs=10/60)
+
+
+def test_makespan_and_walltime_split_the_jobs(setup):
+    cfg, catalog, cost_model = setup
+    # Default shards are persisted per logs root, start every policy from scratch as `simulate.py` does.
+    _, fast = run({**cfg, "logs_root": f"{cfg['logs_root']}/fast"}, catalog, cost_model)
+    _, slow = run({**cfg, "logs_root": f"{cfg['logs_root']}/slow", "makespan_weight": 0}, catalog, cost_model)
+    assert fast["unfinished"] == 0 and fast["jobs"] > slow["jobs"]
+    assert fast["latency_h_max"] < slow["latency_h_max"]
+    assert fast["gpu_hours"] > slow["gpu_hours"]
+    _, short = run({**cfg, "logs_root": f"{cfg['logs_root']}/short", "makespan_weight": 0, "walltime_hours": 4},
+                   catalog, cost_model)
+    assert short["unfinished"] == 0 and short["jobs"] > slow["jobs"]
+
+
+def test_noise_is_deterministic():
+    assert noise("m/100/mmlu", 0.2) == noise("m/100/mmlu", 0.2) != noise("m/200/mmlu", 0.2)
+    assert noise("m/100/mmlu", 0) == 1
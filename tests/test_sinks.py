@@ -0,0 +1,76 @@
+import dataclasses
+import json
+
+import pytest
+
+from evals import sinks
+from evals.sinks import LocalSink, Table, Upload, WandbSink
+
+
+@dataclasses.dataclass
+class FlakySink(sinks.Sink):
+    errors: list[Exception]
+    pushed: list[str] = dataclasses.field(default_factory=list)
+
+    def push(self, upload: Upload):
+        if len(self.errors) > 0:
+            raise self.errors.pop(0)
+        self.pushed.append(upload.run_id)
+
+    def is_transient(self, error: Exception) -> bool:
+        return isinstance(error, ConnectionError)
+
+
+def read(path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def test_local_sink(tmp_path):
+    sink = LocalSink(tmp_path/"out")
+    table = Table(["task", "acc"], [["mmlu", 0.5]])
+    sink.push(Upload("run", "name", logs=[{"OptStep": 100, "acc": 0.5}, {"OptStep": 200, "acc": 0.6}],
+                     tables={"eval_table": table}, table_log={"OptStep": 200}))
+    sink.push(Upload("run", "name", logs=[{"OptStep": 300}]))
+    lines = read(tmp_path/"out"/"run.jsonl")
+    assert [line["log"] for line in lines] == [{"OptStep": 100, "acc": 0.5}, {"OptStep": 200, "acc": 0.6},
+                                               {"OptStep": 200}, {"OptStep": 300}]
+    assert {line["name"] for line in lines} == {"name"}
+    assert [("tables" in line) for line in lines] == [False, False, True, False]
+    assert lines[2]["tables"] == {"eval_table": {"columns": ["task", "acc"], "rows": [["mmlu", 0.5]]}}
+
+
+def test_get_sink(tmp_path):
+    assert sinks.get_sink(f"local:{tmp_path}") == LocalSink(tmp_path)
+    assert sinks.get_sink("wandb", "entity", "project") == WandbSink("entity", "project")
+    with pytest.raises(ValueError):
+        sinks.get_sink("s3://bucket")
+
+
+def test_push_retries_transient_errors():
+    sink = FlakySink([ConnectionError("reset"), ConnectionError("reset")])
+    assert sinks.push(sink, Upload("run", "name"), retries=2, backoff=0) is None
+    assert sink.pushed == ["run"]
+
+    sink = FlakySink([ConnectionError("reset")]*3)
+    assert sinks.push(sink, Upload("run", "name"), retries=2, backoff=0) == "ConnectionError: reset"
+    assert sink.pushed == []
+
+
+def test_push_gives_up_on_other_errors():
+    sink = FlakySink([ValueError("bad table"), ConnectionError("never reached")])
+    assert sinks.push(sink, Upload("run", "name"), backoff=0) == "ValueError: bad table"
+    assert len(sink.errors) == 1
+
+
+def test_upload_errors_per_run(tmp_path):
+    sink = FlakySink([ValueError("bad table")])
+    errors = sinks.upload(sink, [Upload("a", "a"), Upload("b", "b")], workers=1)
+    assert errors == {"a": "ValueError: bad table", "b": None}
+    assert sink.pushed == ["b"]
+
+    # Runs are pushed each by their own worker process.
+    uploads = [Upload(run_id, run_id, logs=[{"OptStep": 100}]) for run_id in ["a", "b", "c"]]
+    assert sinks.upload(LocalSink(tmp_path), uploads, workers=2) == {"a": None, "b": None, "c": None}
+    for run_id in ["a", "b", "c"]:
+        [line] = read(tmp_path/f"{run_id}.jsonl")
+        assert (line["name"], line["log"]) == (run_id, {"OptStep": 100})
@@ -0,0 +1,62 @@
+import json
+import os
+
+from evals.status import StatusIndex, get_status_path
+
+
+def write_results(logs_root, model, it, eval_dir, tasks, name="results_2025.json"):
+    path = logs_root/model/f"iter_{it}"/"harness"/eval_dir/"org__model"/name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps({"results": {task: {"acc,none": 0.5} for task in tasks}}))
+    return path
+
+
+def test_refresh_only_reads_new_or_changed_files(tmp_path):
+    logs_root = tmp_path/"logs"
+    first = write_results(logs_root, "m", 100, "eval_1", ["hellaswag", "mmlu"])
+    write_results(logs_root, "m", 200, "eval_2", ["hellaswag"])
+    write_results(logs_root, "other", 100, "eval_3", ["piqa"])
+    index = StatusIndex.open(logs_root)
+    assert index.path == get_status_path(logs_root)
+
+    assert index.refresh(logs_root, "m") == 2
+    assert index.evaluated("m") == {100: {"hellaswag", "mmlu"}, 200: {"hellaswag"}}
+    assert index.refresh(logs_root, "m") == 0
+
+    write_results(logs_root, "m", 100, "eval_1", ["hellaswag", "mmlu", "piqa"])
+    os.utime(first, ns=(1, 1))
+    assert index.refresh(logs_root, "m") == 1
+    assert index.evaluated("m")[100] == {"hellaswag", "mmlu", "piqa"}
+    assert index.models() == ["m"]
+
+
+def test_removed_and_partial_files(tmp_path):
+    logs_root = tmp_path/"logs"
+    removed = write_results(logs_root, "m", 100, "eval_1", ["hellaswag"])
+    partial = write_results(logs_root, "m", 200, "eval_2", ["mmlu"])
+    partial.write_text('{"results": {')
+    index = StatusIndex.open(logs_root)
+    assert index.refresh(logs_root, "m") == 1
+    assert set(index.evaluated("m")) == {100}
+
+    removed.unlink()
+    write_results(logs_root, "m", 200, "eval_2", ["mmlu"])
+    assert index.refresh(logs_root, "m") == 1
+    assert index.evaluated("m") == {200: {"mmlu"}}
+
+
+def test_index_persists_and_clears(tmp_path):
+    logs_root = tmp_path/"logs"
+    write_results(logs_root, "m", 100, "eval_1", ["hellaswag"])
+    write_results(logs_root, "n", 100, "eval_1", ["hellaswag"])
+    index = StatusIndex.open(logs_root)
+    index.refresh(logs_root, "m")
+    index.refresh(logs_root, "n")
+    reopened = StatusIndex.open(logs_root)
+    assert reopened.models() == ["m", "n"]
+    assert reopened.refresh(logs_root, "m") == 0
+    reopened.clear("m")
+    assert reopened.models() == ["n"]
+    assert reopened.refresh(logs_root, "m") == 1
+    reopened.clear()
+    assert reopened.models() == []
@@ -0,0 +1,62 @@
+import os
+import shutil
+
+import pytest
+
+from evals import transfer
+from evals.transfer import PART_SUFFIX, PARTIAL_SUFFIX, copy_tree
+
+
+@pytest.fixture
+def src(tmp_path):
+    src = tmp_path/"src"
+    for rel, content in {"a.bin": b"a"*100, "sub/b.bin": b"b"*10, "sub/deep/c.bin": b"c"*1000, ".complete": b"{}"}.items():
+        (src/rel).parent.mkdir(parents=True, exist_ok=True)
+        (src/rel).write_bytes(content)
+    return src
+
+
+def read_tree(root):
+    return {str(path.relative_to(root)): path.read_bytes() for path in root.rglob("*") if path.is_file()}
+
+
+def test_copy_tree(tmp_path, src):
+    assert copy_tree(src, tmp_path/"dest", workers=2) == 1112
+    assert read_tree(tmp_path/"dest") == read_tree(src)
+    assert not (tmp_path/f"dest{PARTIAL_SUFFIX}").exists()
+    with pytest.raises(FileExistsError):
+        copy_tree(src, tmp_path/"dest")
+
+
+def test_resumes_from_a_partial_copy(tmp_path, src):
+    partial = tmp_path/f"dest{PARTIAL_SUFFIX}"
+    (partial/"sub"/"deep").mkdir(parents=True)
+    shutil.copy2(src/"sub"/"deep"/"c.bin", partial/"sub"/"deep"/"c.bin")  # Finished before the interruption.
+    (partial/"a.bin.part").write_bytes(b"a"*10)  # Interrupted while copying.
+    shutil.copy2(src/"sub"/"b.bin", partial/"sub"/"b.bin")
+    (partial/"sub"/"b.bin").write_bytes(b"x"*10)  # Same size and mtime but corrupted.
+    shutil.copystat(src/"sub"/"b.bin", partial/"sub"/"b.bin")
+
+    assert copy_tree(src, tmp_path/"dest") == 112
+    assert read_tree(tmp_path/"dest") == read_tree(src)
+    assert list((tmp_path/"dest").rglob(f"*{PART_SUFFIX}")) == []
+
+
+def test_markers_are_copied_last(tmp_path, src, monkeypatch):
+    copied = []
+    copy_file = transfer.copy_file
+    monkeypatch.setattr(transfer, "copy_file", lambda src, dest: copied.append(dest.name) or copy_file(src, dest))
+    copy_tree(src, tmp_path/"dest", workers=1, last=(".complete",))
+    assert copied == ["c.bin", "a.bin", "b.bin", ".complete"]  # Biggest first.
+
+
+def test_mismatching_copies_keep_the_partial_copy(tmp_path, src, monkeypatch):
+    def copy_file(src, dest):
+        dest.write_bytes(b"?")
+        return "checksum"
+
+    monkeypatch.setattr(transfer, "copy_file", copy_file)
+    with pytest.raises(OSError, match="does not match"):
+        copy_tree(src, tmp_path/"dest", workers=1)
+    assert not (tmp_path/"dest").exists()
+    assert (tmp_path/f"dest{PARTIAL_SUFFIX}").is_dir()
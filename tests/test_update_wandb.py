@@ -0,0 +1,134 @@
+import json
+
+import pytest
+
+import update_wandb
+from evals.aggregate import INVALID_NUM
+from evals.pushed import PushedLog
+
+AGGREGATIONS = {
+    "families": [{"prefix": "m_arc", "group": "arc"}],
+    "averages": [{"prefix": "All Tasks/{language_group}", "over": ["language_group"], "micro": False, "metrics": ["acc"]}],
+}
+
+
+@pytest.fixture
+def sync(tmp_path, make_cfg):
+    """Runs `update_wandb.py` on `tmp_path/logs` with a local sink, returns the logs pushed to each run by that sync."""
+    cfg = make_cfg({"hellaswag": 100, "arc_de": 100, "arc_fr": 100}, AGGREGATIONS, ["hellaswag/acc"],
+                   language_groups={"english": ["eng"], "european": ["deu", "fra"]})
+    out = tmp_path/"out"
+
+    def run(**kwargs) -> dict[str, list[dict]]:
+        before = {path.name: len(path.read_text().splitlines()) for path in out.glob("*.jsonl")}
+        options = dict(logs_root=tmp_path/"logs", names=[], it=None, cfg=cfg, reconcile=False, reconcile_days=None,
+                       full=False, sink=f"local:{out}", workers=1, bootstrap=0)
+        update_wandb.main(**{**options, **kwargs})
+        pushed = {}
+        for path in sorted(out.glob("*.jsonl")):
+            lines = [json.loads(line) for line in path.read_text().splitlines()[before.get(path.name, 0):]]
+            if len(lines) > 0:
+                pushed[path.stem] = lines
+        return pushed
+
+    return run
+
+
+def test_get_pushed_reconciles_when_due(tmp_path):
+    pushed = PushedLog.open(tmp_path)
+    remote = {1: {"a": 1.0}}
+    calls = []
+
+    def get_remote(name):
+        calls.append(name)
+        return remote
+
+    assert update_wandb.get_pushed(pushed, "p", "r", False, 7, get_remote) == {1: {"ConsumedTokens": 1, "a": 1.0}}
+    pushed.append("p", "r", [{"ConsumedTokens": 2, "a": 2.0}])
+    assert update_wandb.get_pushed(pushed, "p", "r", False, 7, get_remote) == \
+        {1: {"ConsumedTokens": 1, "a": 1.0}, 2: {"ConsumedTokens": 2, "a": 2.0}}
+    assert calls == ["r"]  # Only the first time, the local record is enough until then.
+    assert update_wandb.get_pushed(pushed, "p", "r", True, 7, get_remote) == {1: {"ConsumedTokens": 1, "a": 1.0}}
+    assert update_wandb.get_pushed(pushed, "p", "r", False, 0, get_remote) == {1: {"ConsumedTokens": 1, "a": 1.0}}
+    assert calls == ["r"]*3
+    assert update_wandb.get_pushed(pushed, "p", "other", False, None, None) == {}
+
+
+def test_only_new_logs_are_pushed(tmp_path, sync, write_results):
+    write_results(tmp_path/"logs", "m", 100, {"hellaswag": 0.5, "arc_de": 0.2, "arc_fr": 0.4})
+    pushed = sync()
+    (table,) = [line for line in pushed["m"] if "tables" in line]
+    assert table["tables"]["eval_table"]["rows"] == [["m", 100_000, 0.5]]
+    log, = [line["log"] for line in pushed["m"] if "tables" not in line]
+    assert log["ConsumedTokens"] == 100_000 and log["OptStep"] == 100
+    assert log["m_arc.macro/acc"] == pytest.approx(0.3)
+    assert log["All Tasks/european.macro/acc"] == pytest.approx(0.3)
+
+    assert sync() == {}
+    assert sync(full=True) == {}  # Recomputed, but the same as what was pushed.
+    write_results(tmp_path/"logs", "m", 200, {"hellaswag": 0.6})
+    logs = [line["log"] for line in sync()["m"] if "tables" not in line]
+    assert [log["OptStep"] for log in logs] == [200]
+
+
+def test_fingerprint(tmp_path, write_results, make_cfg):
+    cfg = make_cfg({"hellaswag": 100}, AGGREGATIONS, [])
+    cfg_hash = update_wandb.get_cfg_hash(cfg)
+    assert cfg_hash != update_wandb.get_cfg_hash(cfg, bootstrap=100)
+    path = write_results(tmp_path/"logs", "m", 100, {"hellaswag": 0.5})
+    iter_dir = tmp_path/"logs"/"m"/"iter_100"
+    fingerprint = update_wandb.get_fingerprint(iter_dir, [path], cfg_hash)
+    assert fingerprint == update_wandb.get_fingerprint(iter_dir, [path], cfg_hash)
+    assert fingerprint != update_wandb.get_fingerprint(iter_dir, [], cfg_hash)
+    write_results(tmp_path/"logs", "m", 100, {"hellaswag": 0.25})
+    assert fingerprint != update_wandb.get_fingerprint(iter_dir, [path], cfg_hash)
+
+    (cfg/"aggregations.json").write_text(json.dumps({**AGGREGATIONS, "families": []}))
+    assert update_wandb.get_cfg_hash(cfg) != cfg_hash
+
+
+def test_only_changed_iterations_are_read(tmp_path, sync, write_results, monkeypatch):
+    read = []
+    read_results = update_wandb.read_results
+    monkeypatch.setattr(update_wandb, "read_results", lambda path: read.append(path) or read_results(path))
+    for it in [100, 200]:
+        write_results(tmp_path/"logs", "m", it, {"hellaswag": it/1000})
+    write_results(tmp_path/"logs", "n", 100, {"hellaswag": 0.5})
+    assert set(sync()) == {"m", "n"}
+    assert len(read) == 3
+
+    # A new shard of an iteration only reads that file, and only pushes that iteration.
+    read.clear()
+    write_results(tmp_path/"logs", "m", 200, {"arc_de": 0.2, "arc_fr": 0.4}, eval_dir="eval_2")
+    logs = [line["log"] for line in sync()["m"] if "tables" not in line]
+    assert [log["OptStep"] for log in logs] == [200]
+    assert logs[0]["m_arc.macro/acc"] == pytest.approx(0.3)
+    assert [path.split("/")[-3] for path in read] == ["eval_2"]
+
+    read.clear()
+    assert sync(names=["n"], full=True) == {}
+    assert len(read) == 1
+
+
+def test_failed_pushes_are_synced_again(tmp_path, sync, write_results, monkeypatch):
+    write_results(tmp_path/"logs", "m", 100, {"hellaswag": 0.5})
+    upload = update_wandb.sinks.upload
+    monkeypatch.setattr(update_wandb.sinks, "upload",
+                        lambda sink, uploads, workers: {upload.run_id: "ConnectionError" for upload in uploads})
+    assert sync() == {}
+    monkeypatch.setattr(update_wandb.sinks, "upload", upload)
+    assert [line["log"]["OptStep"] for line in sync()["m"] if "tables" not in line] == [100]
+
+
+def test_bootstrap(tmp_path, sync, write_results, write_samples):
+    scores = {"arc_de": [1.0, 0.0, 1.0, 1.0], "arc_fr": [0.0, 0.0, 1.0, 1.0]}
+    path = write_results(tmp_path/"logs", "m", 100, {task: sum(acc)/4 for task, acc in scores.items()},
+                         sizes={task: 4 for task in scores})
+    for task, acc in scores.items():
+        write_samples(path, task, [{"doc_id": i, "acc": value} for i, value in enumerate(acc)])
+    (log,) = [line["log"] for line in sync(bootstrap=100)["m"] if "tables" not in line]
+    assert log["m_arc.macro/acc_ci_low"] <= log["m_arc.macro/acc"] == 0.625 <= log["m_arc.macro/acc_ci_high"]
+    assert "arc_de/acc_ci_low" not in log
+    assert sync(bootstrap=100) == {}
+    # The resamples are an input, and the intervals no longer logged are invalidated (wandb can't remove them).
+    assert sync(bootstrap=0)["m"][0]["log"]["m_arc.macro/acc_ci_low"] == INVALID_NUM
@@ -0,0 +1,82 @@
+import os
+
+from evals import warehouse
+
+
+def get_metrics(logs_root, **filters) -> list[tuple]:
+    table = warehouse.load(logs_root, "metrics", columns=["model", "iteration", "task", "metric", "value"], **filters)
+    return sorted(tuple(row.values()) for row in table.to_pylist())
+
+
+def test_ingest_and_load(tmp_path, write_results):
+    logs = tmp_path/"logs"
+    path = write_results(logs, "m", 100, {"arc_de": 0.2, "hellaswag": {"acc,none": 0.5, "alias": "hellaswag"}},
+                         sizes={"arc_de": 50}, group_subtasks={"arc": ["arc_de"]})
+    write_results(logs, "m", 200, {"arc_de": 0.3})
+    write_results(logs, "n", 100, {"arc_de": 0.4})
+    assert warehouse.ingest(logs, "m") == 2
+    assert warehouse.ingest(logs, "n") == 1
+
+    assert get_metrics(logs, models=["m"], tasks=["arc_de"]) == [
+        ("m", 100, "arc_de", "acc", 0.2), ("m", 100, "arc_de", "acc_stderr", 0.01),
+        ("m", 200, "arc_de", "acc", 0.3), ("m", 200, "arc_de", "acc_stderr", 0.01)]
+    assert get_metrics(logs, iterations=[100], tasks=["hellaswag"]) == [("m", 100, "hellaswag", "acc", 0.5)]
+    assert {row["filter"] for row in warehouse.load(logs, "metrics").to_pylist()} == {"none"}
+    assert warehouse.load(logs, "samples", models=["m"], iterations=[100], tasks=["arc_de"]).to_pylist() == [
+        {"path": str(path), "task": "arc_de", "original": 50, "effective": 50, "model": "m", "iteration": 100}]
+    assert warehouse.load(logs, "groups", columns=["group", "subtask"]).to_pylist() == [
+        {"group": "arc", "subtask": "arc_de"}]
+    files = warehouse.load(logs, "files", models=["m"], iterations=[100]).to_pylist()
+    assert [(row["path"], row["size"]) for row in files] == [(str(path), path.stat().st_size)]
+
+
+def test_ingest_only_reads_changes(tmp_path, write_results):
+    logs = tmp_path/"logs"
+    write_results(logs, "m", 100, {"arc_de": 0.2})
+    removed = write_results(logs, "m", 100, {"arc_fr": 0.3}, eval_dir="eval_2")
+    write_results(logs, "m", 200, {"arc_de": 0.4})
+    assert warehouse.ingest(logs, "m") == 3
+    assert warehouse.ingest(logs, "m") == 0
+
+    write_results(logs, "m", 100, {"arc_de": 0.25})
+    os.remove(removed)
+    assert warehouse.ingest(logs, "m") == 1
+    assert get_metrics(logs, tasks=["arc_de", "arc_fr"]) == [
+        ("m", 100, "arc_de", "acc", 0.25), ("m", 100, "arc_de", "acc_stderr", 0.01),
+        ("m", 200, "arc_de", "acc", 0.4), ("m", 200, "arc_de", "acc_stderr", 0.01)]
+
+    # Iterations without results anymore are dropped.
+    for path in (logs/"m"/"iter_200").rglob("results*.json"):
+        os.remove(path)
+    assert warehouse.ingest(logs, "m") == 0
+    assert {row["iteration"] for row in warehouse.load(logs, "files").to_pylist()} == {100}
+
+
+def test_unreadable_files_keep_their_previous_rows(tmp_path, write_results):
+    logs = tmp_path/"logs"
+    path = write_results(logs, "m", 100, {"arc_de": 0.2})
+    assert warehouse.read_file(str(tmp_path/"missing.json"), path.stat()) is None
+    assert warehouse.ingest(logs, "m") == 1
+
+    path.write_text('{"results": {"arc_de"')  # Still being written.
+    assert warehouse.ingest(logs, "m") == 0
+    assert get_metrics(logs, tasks=["arc_de"]) == [("m", 100, "arc_de", "acc", 0.2),
+                                                   ("m", 100, "arc_de", "acc_stderr", 0.01)]
+    write_results(logs, "m", 100, {"arc_de": 0.3})
+    assert warehouse.ingest(logs, "m") == 1
+    assert get_metrics(logs, tasks=["arc_de"])[0] == ("m", 100, "arc_de", "acc", 0.3)
+
+
+def test_rebuild(tmp_path, write_results, capsys):
+    logs = tmp_path/"logs"
+    write_results(logs, "m", 100, {"arc_de": 0.2})
+    write_results(logs, "n", 100, {"arc_de": 0.2})
+    assert warehouse.load(logs, "metrics").num_rows == 0
+    warehouse.main(logs, [], rebuild=False)
+    assert "m: 1 iterations, 1 results files, 2 metrics (1 files read)" in capsys.readouterr().out
+    warehouse.main(logs, ["m"], rebuild=False)
+    assert "(0 files read)" in capsys.readouterr().out
+    warehouse.main(logs, ["m"], rebuild=True)
+    assert "(1 files read)" in capsys.readouterr().out
+    warehouse.clear(logs, "n")
+    assert {row["model"] for row in warehouse.load(logs, "metrics").to_pylist()} == {"m"}